@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Content hashed and precompressed copies of the export artifacts.
+
+The export target (and the bundles split from it) are written to fixed
+file names, which cannot be served with far-future cache headers.  The
+functions here produce copies of them with the digest of their contents
+in the file names, along with siblings compressed at the maximum level
+such that they need not be compressed on the fly, plus a manifest that
+maps the logical names of the artifacts to the hashed copies.
+"""
+
+import gzip
+import json
+import logging
+from contextlib import closing
+from io import BytesIO
+from os import remove
+from os import sep
+from os.path import dirname
+from os.path import exists
+from os.path import join
+from os.path import relpath
+from os.path import splitext
+
+from calmjs.rjs.cache import text_digest
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_MANIFEST_SUFFIX = '.manifest.json'
+ARTIFACT_MANIFEST_VERSION = 1
+# the number of characters of the digest used in the file names.
+HASH_LENGTH = 12
+
+
+def hashed_path(path, digest):
+    """
+    Return the path with the digest inserted before its extension.
+    """
+
+    root, ext = splitext(path)
+    return '%s.%s%s' % (root, digest[:HASH_LENGTH], ext)
+
+
+def gzip_compress(data):
+    buf = BytesIO()
+    # no file name and a fixed mtime, such that identical data produce
+    # identical results.
+    with closing(gzip.GzipFile(
+            filename='', mode='wb', compresslevel=9, fileobj=buf,
+            mtime=0)) as fd:
+        fd.write(data)
+    return buf.getvalue()
+
+
+def brotli_compress(data):
+    """
+    Compress with brotli, or return None if that is not installed.
+    """
+
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+# the filename extensions of the compressed siblings, along with the
+# functions that produce them.
+compressors = (
+    ('.gz', gzip_compress),
+    ('.br', brotli_compress),
+)
+
+
+def write_hashed_artifact(path):
+    """
+    Write the content hashed copy of the artifact at path, along with
+    its compressed siblings; the files that already exist are kept as
+    is, as their names are derived from the contents.  Returns the path
+    to the copy and the list of extensions of the compressed siblings.
+    """
+
+    with open(path, 'rb') as fd:
+        data = fd.read()
+    target = hashed_path(path, text_digest(data))
+    if not exists(target):
+        with open(target, 'wb') as fd:
+            fd.write(data)
+
+    exts = []
+    for ext, compress in compressors:
+        if not exists(target + ext):
+            compressed = compress(data)
+            if compressed is None:
+                logger.debug("no compressor available for '%s'", ext)
+                continue
+            with open(target + ext, 'wb') as fd:
+                fd.write(compressed)
+        exts.append(ext)
+    return target, exts
+
+
+def read_artifact_manifest(manifest_path):
+    """
+    Return the manifest at manifest_path, or None if there is no valid
+    manifest there.
+    """
+
+    try:
+        with open(manifest_path) as fd:
+            manifest = json.load(fd)
+    except (OSError, IOError):
+        return None
+    except ValueError:
+        logger.warning(
+            "ignoring corrupted artifact manifest '%s'", manifest_path)
+        return None
+    if not (isinstance(manifest, dict) and
+            manifest.get('version') == ARTIFACT_MANIFEST_VERSION):
+        logger.debug(
+            "ignoring incompatible artifact manifest '%s'", manifest_path)
+        return None
+    return manifest
+
+
+def prune_hashed_artifacts(root, previous, current):
+    """
+    Remove the copies listed in the files of the previous manifest that
+    are no longer listed in the current one, along with their compressed
+    siblings.  Returns the list of the paths removed.
+
+    Arguments:
+
+    root
+        The directory that the paths in the manifests are relative to.
+    previous
+        The files of the previous manifest.
+    current
+        The files of the current manifest.
+    """
+
+    removed = []
+    stale = set(previous.values()) - set(current.values()) - set(current)
+    for target in sorted(stale):
+        target = join(root, *target.split('/'))
+        for path in [target] + [target + ext for ext, _ in compressors]:
+            if not exists(path):
+                continue
+            try:
+                remove(path)
+            except (OSError, IOError) as e:
+                logger.warning(
+                    "failed to remove stale hashed artifact '%s': %s: %s",
+                    path, type(e).__name__, e,
+                )
+                continue
+            removed.append(path)
+    return removed
+
+
+def write_hashed_artifacts(paths, manifest_path):
+    """
+    Write the content hashed copies of the artifacts at paths, and the
+    manifest of them to manifest_path.  The logical names in the
+    manifest are the paths relative to the manifest.  The copies listed
+    in the previous manifest at manifest_path that are no longer listed
+    are removed.  Returns the mapping of the paths to the paths of their
+    copies.
+
+    Arguments:
+
+    paths
+        The paths to the artifacts.
+    manifest_path
+        The path to write the manifest to.
+    """
+
+    root = dirname(manifest_path)
+    previous = read_artifact_manifest(manifest_path)
+    results = {}
+    files = {}
+    compressed = None
+    for path in paths:
+        target, exts = write_hashed_artifact(path)
+        results[path] = target
+        files[relpath(path, root).replace(sep, '/')] = relpath(
+            target, root).replace(sep, '/')
+        compressed = exts if compressed is None else [
+            ext for ext in compressed if ext in exts]
+
+    with open(manifest_path, 'w') as fd:
+        json.dump({
+            'version': ARTIFACT_MANIFEST_VERSION,
+            'files': files,
+            # the extensions of the compressed siblings of every file.
+            'compressed': compressed or [],
+        }, fd, indent=1, sort_keys=True)
+    logger.info(
+        "wrote %d hashed artifact(s) listed in '%s'", len(files),
+        manifest_path)
+
+    if previous and isinstance(previous.get('files'), dict):
+        removed = prune_hashed_artifacts(root, previous['files'], files)
+        if removed:
+            logger.info(
+                "removed %d stale hashed artifact file(s)", len(removed))
+    return results
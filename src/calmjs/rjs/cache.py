@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Content addressed caching of results derived from source files.
+
+Parsing JavaScript sources through slimit is by far the most expensive
+operation done on the Python side of the toolchain, and the results of
+the extraction functions provided by ``calmjs.rjs.requirejs`` depend on
+nothing but the text of the file being processed.  This module provides
+a simple on-disk cache where each entry is keyed by the digest of the
+source text (combined with a version string that identifies the
+function that produced the value), such that unchanged files can skip
+the parsing step entirely across separate builds.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+from os.path import exists
+from os.path import join
+from tempfile import mkstemp
+
+from calmjs.rjs.requirejs import process_path
+from calmjs.rjs.requirejs import process_paths
+
+logger = logging.getLogger(__name__)
+
+# default upper bound of the total size of all entries in a cache
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+_ENTRY_SUFFIX = '.json'
+
+
+def text_digest(text, version=''):
+    """
+    Produce the hex digest for the provided text, prefixed with the
+    provided version string.
+    """
+
+    h = hashlib.sha1()
+    for value in (version, '\0', text):
+        if not isinstance(value, bytes):
+            value = value.encode('utf8')
+        h.update(value)
+    return h.hexdigest()
+
+
+class ContentCache(object):
+    """
+    A cache of JSON serializable values stored in a directory, with
+    each entry keyed by the digest of the text the value was derived
+    from.
+
+    The total size of the entries can be bounded through the max_size
+    argument; when exceeded, the least recently used entries will be
+    removed when prune is called.
+    """
+
+    def __init__(self, cache_dir, version='', max_size=DEFAULT_MAX_SIZE):
+        """
+        Arguments:
+
+        cache_dir
+            The directory to store the entries in; it will be created
+            as needed.
+        version
+            The version string that will form part of every key, so
+            that entries produced by different versions of a function
+            will not be mixed up.
+        max_size
+            The total size in bytes of all entries that will be kept
+            by prune.
+        """
+
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text):
+        return text_digest(text, self.version)
+
+    def _entry_path(self, key):
+        return join(self.cache_dir, key[:2], key + _ENTRY_SUFFIX)
+
+    def get(self, key):
+        """
+        Return the value stored for the key, or None if not found.
+        """
+
+        path = self._entry_path(key)
+        try:
+            with open(path) as fd:
+                value = json.load(fd)
+        except (OSError, IOError):
+            self.misses += 1
+            return None
+        except ValueError:
+            logger.warning("removing corrupted cache entry '%s'", path)
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        try:
+            # mark the entry as recently used for the pruning.
+            os.utime(path, None)
+        except (OSError, IOError):  # pragma: no cover
+            pass
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Store the JSON serializable value at the key.  Failures are
+        logged as a cache is not critical for correctness.
+        """
+
+        path = self._entry_path(key)
+        dirpath = join(self.cache_dir, key[:2])
+        try:
+            if not exists(dirpath):
+                try:
+                    os.makedirs(dirpath)
+                except OSError as e:  # pragma: no cover
+                    # created by a concurrent writer.
+                    if e.errno != errno.EEXIST:
+                        raise
+            # write to a temporary file then move it into place so that
+            # concurrent readers will never see a partial entry.
+            fd, tmp_path = mkstemp(dir=dirpath, suffix='.tmp')
+            with os.fdopen(fd, 'w') as tmp:
+                json.dump(value, tmp)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:  # pragma: no cover
+                # target exists on platforms that will not overwrite.
+                self._remove(tmp_path)
+        except (OSError, IOError) as e:
+            logger.warning(
+                "failed to write cache entry '%s': %s: %s",
+                path, type(e).__name__, e,
+            )
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except (OSError, IOError):  # pragma: no cover
+            pass
+
+    def entries(self):
+        """
+        Return a list of (mtime, size, path) for all the entries.
+        """
+
+        results = []
+        if not exists(self.cache_dir):
+            return results
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(_ENTRY_SUFFIX):
+                    continue
+                path = join(root, name)
+                try:
+                    st = os.stat(path)
+                except (OSError, IOError):  # pragma: no cover
+                    continue
+                results.append((st.st_mtime, st.st_size, path))
+        return results
+
+    def prune(self):
+        """
+        Remove the least recently used entries until the total size of
+        what remains is no greater than max_size.  Returns the number of
+        entries removed.
+        """
+
+        entries = sorted(self.entries())
+        total = sum(size for mtime, size, path in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+
+        if removed:
+            logger.debug(
+                "removed %d entries from cache '%s'", removed, self.cache_dir)
+        return removed
+
+    def process_path(self, path, f):
+        """
+        Same as ``calmjs.rjs.requirejs.process_path``, with the result
+        of the function cached as a list.  The function must return an
+        iterable of JSON serializable values.
+        """
+
+        def cached_f(text):
+            key = self.key(text)
+            value = self.get(key)
+            if value is None:
+                value = list(f(text))
+                self.set(key, value)
+            return value
+
+        return process_path(path, cached_f)
+
+    def process_paths(self, paths, f, processes=None):
+        """
+        Same as ``calmjs.rjs.requirejs.process_paths``, with only the
+        paths that have no cached results be processed through f.
+        """
+
+        keys = []
+        for path in paths:
+            try:
+                with open(path) as fd:
+                    keys.append(self.key(fd.read()))
+            except (OSError, IOError):
+                # let process_paths report the error.
+                keys.append(None)
+
+        results = [self.get(key) if key else None for key in keys]
+        missed = [idx for idx, result in enumerate(results) if result is None]
+        processed = process_paths(
+            [paths[idx] for idx in missed], f, processes=processes)
+        for idx, result in zip(missed, processed):
+            results[idx] = result
+            if result is not None and keys[idx]:
+                self.set(keys[idx], result)
+        return results
@@ -4,13 +4,39 @@ CalmJS RequireJS cli tools.
 """
 
 import logging
+import shutil
+import threading
+from os.path import basename
+from os.path import join
+from os.path import realpath
+from os.path import splitext
+from tempfile import mkdtemp
 
 from calmjs.toolchain import Spec
+from calmjs.toolchain import AFTER_ASSEMBLE
+from calmjs.toolchain import BEFORE_PREPARE
 from calmjs.toolchain import BUILD_DIR
+from calmjs.toolchain import CLEANUP
 from calmjs.toolchain import CALMJS_MODULE_REGISTRY_NAMES
 from calmjs.toolchain import EXPORT_TARGET
 from calmjs.toolchain import SOURCE_PACKAGE_NAMES
+from calmjs.rjs.exc import RJSRuntimeError
+from calmjs.rjs.requirejs import ARTIFACT_DEFINES
+from calmjs.rjs.requirejs import DEFINES_MANIFEST
+from calmjs.rjs.state import BuildState
+from calmjs.rjs.toolchain import BUILD_STATE
+from calmjs.rjs.toolchain import BUNDLES
+from calmjs.rjs.toolchain import CACHE_DIR
+from calmjs.rjs.toolchain import EXTRACT_ENGINE
+from calmjs.rjs.toolchain import HASHED_ARTIFACTS
+from calmjs.rjs.toolchain import INCREMENTAL
+from calmjs.rjs.toolchain import MINIFY
+from calmjs.rjs.toolchain import MODULE_GRAPH
+from calmjs.rjs.toolchain import PARSE_WORKERS
+from calmjs.rjs.toolchain import PYTHON_LINKER
+from calmjs.rjs.toolchain import RJS_WORKER
 from calmjs.rjs.toolchain import STUB_MISSING_WITH_EMPTY
+from calmjs.rjs.toolchain import TRACE
 
 from calmjs.rjs.toolchain import RJSToolchain
 from calmjs.rjs.toolchain import spec_update_source_map
@@ -18,6 +44,7 @@ from calmjs.rjs.toolchain import spec_update_source_map
 from calmjs.rjs.dist import generate_transpile_source_maps
 from calmjs.rjs.dist import generate_bundle_source_maps
 from calmjs.rjs.dist import get_calmjs_module_registry_for
+from calmjs.rjs.dist import MemoizedWorkingSet
 
 default_toolchain = RJSToolchain()
 logger = logging.getLogger(__name__)
@@ -28,7 +55,21 @@ def create_spec(
         source_registry_method='all', source_registries=None,
         source_map_method='all', bundle_map_method='all',
         stub_missing_with_empty=False,
-        transpile_no_indent=False):
+        transpile_no_indent=False,
+        cache_dir=None,
+        parse_workers=None,
+        extract_engine=None,
+        incremental=False,
+        rjs_worker=False,
+        python_linker=False,
+        minify=None,
+        hashed_artifacts=None,
+        trace=None,
+        artifact_defines=None,
+        defines_manifest=False,
+        module_graph=None,
+        bundles=None,
+        working_set=None):
     """
     Produce a spec for the compilation through the RJSToolchain.
 
@@ -121,6 +162,107 @@ def create_spec(
     transpile_no_indent
         Ensure that the transpile targets have no indents.
 
+    cache_dir
+        The directory to persist the results of the parsing of the
+        compiled sources in, such that sources that are unchanged across
+        builds will not be parsed again.  Defaults to None, which means
+        no caching will be done.
+
+    parse_workers
+        The number of processes to use for the parsing of the compiled
+        sources; 0 to use as many as there are CPUs.  Defaults to None,
+        which means the parsing is done in the current process.
+
+    extract_engine
+        The implementation to use for the extraction of the required
+        module names from the compiled sources.  Choices are between
+        'ast' and 'scan'.  Defaults to None, which is 'ast'.
+
+        'ast'
+            Parse the sources into a complete source tree.
+        'scan'
+            Scan through the tokens of the sources, which is much
+            faster than building the complete tree.
+
+    incremental
+        Keep track of the state of the build inside the build_dir, such
+        that subsequent builds using the same build_dir will only redo
+        the steps for the sources that have changed, and skip invoking
+        r.js if none of its inputs have changed.  Only useful when a
+        build_dir is specified.  Defaults to False.
+
+    rjs_worker
+        Do the build through a persistent Node.js process with r.js
+        loaded, which is kept for subsequent builds done with the same
+        toolchain instance, avoiding the startup cost for every build.
+        Falls back to invoking r.js directly if the worker cannot be
+        used.  Defaults to False.
+
+    python_linker
+        Link the export target (and the bundles) with the Linker from
+        calmjs.rjs.linker in place of r.js, which concatenates the
+        modules in the build directory in the order of their
+        dependencies.  Meant for development builds, as nothing is
+        optimized; falls back to r.js for builds that need the features
+        only r.js provides.  Defaults to False.
+
+    minify
+        Minify every module in the build directory on its own before
+        the linking, with the named minifier from calmjs.rjs.minify
+        (True for slimit), such that r.js only has to concatenate them.
+        The minification is distributed across the parse_workers, and
+        the results are cached in the cache_dir.  Defaults to None.
+
+    hashed_artifacts
+        After the linking, write copies of the export target and the
+        bundles with the digest of their contents in their file names,
+        along with their gzip (and brotli, if available) compressed
+        siblings, plus a JSON manifest of the logical names to those
+        copies to the specified path, or next to the export target if
+        True.  The paths to the bundles in the generated config.js are
+        rewritten to the copies.  Defaults to None.
+
+    trace
+        Record the time spent by the phases of the build and for every
+        module, and write that out as a Chrome trace event file to the
+        specified path, or next to the export target if True, with the
+        slowest modules logged.  Defaults to None.
+
+    artifact_defines
+        The list of module names defined by the artifacts to be loaded
+        for the tests done through the karma test runner, in place of
+        the extraction of those names from the artifacts.  An empty list
+        skips that.  Defaults to None, which means the artifacts without
+        a current defines manifest will be parsed for those names.
+
+    defines_manifest
+        Write the manifest of the module names defined by the export
+        target next to it, for use in place of the extraction of those
+        names when the export target is used as an artifact for tests.
+        Defaults to False.
+
+    module_graph
+        Write the graph of the modules in the build and the modules they
+        require into a SQLite database at the specified path, or inside
+        the build_dir if True, for querying through the ModuleGraph
+        provided by calmjs.rjs.graph.  Defaults to None.
+
+    bundles
+        A mapping of the names of bundles to the lists of their entry
+        module names.  If specified, the modules reachable from only one
+        of the bundles are built into a file of their own next to the
+        export target, named with the bundle name before the extension,
+        while the export target becomes the common layer with the rest
+        of the modules.  The bundles configuration is added to the
+        generated config.js for loading them on demand.  Defaults to
+        None.
+
+    working_set
+        The MemoizedWorkingSet to resolve the packages and read their
+        metadata through, such that the specs created for the multiple
+        targets of a build can share those lookups.  Defaults to a new
+        one for this spec.
+
     """
 
     working_dir = working_dir if working_dir else default_toolchain.join_cwd()
@@ -135,10 +277,14 @@ def create_spec(
     spec = Spec(
         transpile_no_indent=transpile_no_indent,
     )
+    # the dependency graph of the packages is resolved once for all the
+    # registries and extras looked up for the spec.
+    working_set = working_set or MemoizedWorkingSet()
 
     if source_registries is None:
         source_registries = get_calmjs_module_registry_for(
-            package_names, method=source_registry_method)
+            package_names, method=source_registry_method,
+            working_set=working_set)
         if source_registries:
             logger.info(
                 "automatically picked registries %r for building source map",
@@ -164,16 +310,57 @@ def create_spec(
     spec[SOURCE_PACKAGE_NAMES] = package_names
     spec[STUB_MISSING_WITH_EMPTY] = stub_missing_with_empty
 
+    if cache_dir:
+        spec[CACHE_DIR] = cache_dir
+
+    if parse_workers is not None:
+        spec[PARSE_WORKERS] = parse_workers
+
+    if extract_engine:
+        spec[EXTRACT_ENGINE] = extract_engine
+
+    if incremental:
+        spec[INCREMENTAL] = True
+
+    if rjs_worker:
+        spec[RJS_WORKER] = True
+
+    if python_linker:
+        spec[PYTHON_LINKER] = True
+
+    if minify:
+        spec[MINIFY] = minify
+
+    if hashed_artifacts:
+        spec[HASHED_ARTIFACTS] = hashed_artifacts
+
+    if trace:
+        spec[TRACE] = trace
+
+    if artifact_defines is not None:
+        spec[ARTIFACT_DEFINES] = artifact_defines
+
+    if defines_manifest:
+        spec[DEFINES_MANIFEST] = True
+
+    if module_graph:
+        spec[MODULE_GRAPH] = module_graph
+
+    if bundles:
+        spec[BUNDLES] = bundles
+
     spec_update_source_map(spec, generate_transpile_source_maps(
         package_names=package_names,
         registries=source_registries,
         method=source_map_method,
+        working_set=working_set,
     ), 'transpile_source_map')
 
     spec_update_source_map(spec, generate_bundle_source_maps(
         package_names=package_names,
         working_dir=working_dir,
         method=bundle_map_method,
+        working_set=working_set,
     ), 'bundle_source_map')
 
     return spec
@@ -185,6 +372,19 @@ def compile_all(
         source_map_method='all', bundle_map_method='all',
         stub_missing_with_empty=False,
         transpile_no_indent=False,
+        cache_dir=None,
+        parse_workers=None,
+        extract_engine=None,
+        incremental=False,
+        rjs_worker=False,
+        python_linker=False,
+        minify=None,
+        hashed_artifacts=None,
+        trace=None,
+        artifact_defines=None,
+        defines_manifest=False,
+        module_graph=None,
+        bundles=None,
         toolchain=default_toolchain):
     """
     Invoke the r.js compiler to generate a JavaScript bundle file for a
@@ -216,6 +416,167 @@ def compile_all(
         bundle_map_method=bundle_map_method,
         stub_missing_with_empty=stub_missing_with_empty,
         transpile_no_indent=transpile_no_indent,
+        cache_dir=cache_dir,
+        parse_workers=parse_workers,
+        extract_engine=extract_engine,
+        incremental=incremental,
+        rjs_worker=rjs_worker,
+        python_linker=python_linker,
+        minify=minify,
+        hashed_artifacts=hashed_artifacts,
+        trace=trace,
+        artifact_defines=artifact_defines,
+        defines_manifest=defines_manifest,
+        module_graph=module_graph,
+        bundles=bundles,
     )
     toolchain(spec)
     return spec
+
+
+def _advise_exclusive(spec, lock):
+    """
+    Hold the lock for the spec from before the prepare step until after
+    the assemble step, or until cleanup if the build failed before.
+    """
+
+    held = []
+
+    def acquire():
+        lock.acquire()
+        held.append(True)
+
+    def release():
+        if held:
+            held.pop()
+            lock.release()
+
+    spec.advise(BEFORE_PREPARE, acquire)
+    spec.advise(AFTER_ASSEMBLE, release)
+    spec.advise(CLEANUP, release)
+
+
+def build_targets(specs, build_dir=None, link_jobs=None,
+                  toolchain=default_toolchain):
+    """
+    Build all the specs, each for a different export target, with the
+    toolchain using a shared build directory, such that the modules
+    common to them are only transpiled and parsed once.  The compile and
+    assemble steps of each spec are done one at a time, while the link
+    steps (i.e. the r.js invocations) are done concurrently.
+
+    Arguments:
+
+    specs
+        The specs, as produced by create_spec.  The build directory and
+        the paths to the generated configuration files within it will
+        be assigned to each spec.
+    build_dir
+        The shared build directory.  Defaults to a temporary directory
+        that is removed when done.
+    link_jobs
+        The maximum number of builds to run concurrently.  Defaults to
+        the number of CPUs.
+    toolchain
+        The toolchain instance to use.
+
+    Returns the list of specs.  If any of the builds failed, the error
+    for the first one will be raised once all the builds are done.
+    """
+
+    names = [splitext(basename(spec[EXPORT_TARGET]))[0] for spec in specs]
+    duplicated = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicated:
+        raise RJSRuntimeError(
+            'export targets must have distinct names; duplicated: %s' % (
+                ', '.join(duplicated)))
+
+    tempdir = None
+    if not build_dir:
+        tempdir = build_dir = mkdtemp()
+    build_dir = realpath(build_dir)
+
+    # the shared state, which is only persisted for incremental builds.
+    state_path = join(build_dir, toolchain.build_state_name)
+    if not tempdir and any(spec.get(INCREMENTAL) for spec in specs):
+        state = BuildState.load(state_path)
+    else:
+        state = BuildState(None)
+
+    lock = threading.Lock()
+    for name, spec in zip(names, specs):
+        spec[BUILD_DIR] = build_dir
+        spec[BUILD_STATE] = state.fork()
+        for key, filename in (
+                ('requirejs_config_js', toolchain.requirejs_config_name),
+                ('node_config_js', toolchain.node_config_name),
+                ('build_manifest_path', toolchain.build_manifest_name)):
+            spec[key] = join(build_dir, name + '.' + filename)
+        _advise_exclusive(spec, lock)
+
+    def build(spec):
+        try:
+            toolchain(spec)
+        except Exception as e:
+            logger.error(
+                "failed to build '%s': %s: %s",
+                spec[EXPORT_TARGET], type(e).__name__, e,
+            )
+            return e
+
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(link_jobs or cpu_count())
+    try:
+        errors = [e for e in pool.map(build, specs) if e is not None]
+    finally:
+        pool.close()
+        pool.join()
+        if tempdir:
+            shutil.rmtree(tempdir)
+
+    if errors:
+        raise errors[0]
+    if state.path:
+        state.prune()
+        state.save()
+    return specs
+
+
+def compile_targets(targets, build_dir=None, link_jobs=None,
+                    toolchain=default_toolchain, **kwargs):
+    """
+    Invoke the r.js compiler to generate a JavaScript bundle file for
+    each of the targets, sharing the build directory between them.
+
+    Arguments:
+
+    targets
+        A list of 2-tuples of the list of package names and the export
+        target to produce from them.
+    build_dir
+        The build directory shared by all the targets.  Defaults to a
+        temporary directory that is removed when done.
+    link_jobs
+        The maximum number of r.js invocations to run concurrently.
+        Defaults to the number of CPUs.
+    toolchain
+        The toolchain instance to use.  Default is the instance in this
+        module.
+
+    All other arguments are passed to create_spec for the spec of each
+    of the targets, with the packages resolved and the registries looked
+    up through a MemoizedWorkingSet shared by all the specs.  Returns
+    the list of specs.
+    """
+
+    kwargs.setdefault('working_set', MemoizedWorkingSet())
+    specs = [
+        create_spec(
+            package_names=package_names, export_target=export_target,
+            **kwargs
+        ) for package_names, export_target in targets
+    ]
+    return build_targets(
+        specs, build_dir=build_dir, link_jobs=link_jobs, toolchain=toolchain)
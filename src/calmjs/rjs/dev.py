@@ -3,6 +3,7 @@
 Integration with various tools proided by the calmjs.dev package
 """
 
+import json
 import logging
 from os.path import basename
 from os.path import join
@@ -25,14 +26,28 @@ except ImportError:  # pragma: no cover
     # Package not available; None is the advice blackhole
     BEFORE_KARMA = None
 
+from calmjs.rjs.cache import ContentCache
+from calmjs.rjs.ecma import parser_version
 from calmjs.rjs.registry import RJS_LOADER_PLUGIN_REGISTRY
 from calmjs.rjs.registry import RJS_LOADER_PLUGIN_REGISTRY_NAME
-from calmjs.rjs.requirejs import extract_defines_with_deps_from_paths
+from calmjs.rjs.requirejs import ARTIFACT_DEFINES
+from calmjs.rjs.requirejs import DEPENDENCY_RECORDS
+from calmjs.rjs.requirejs import EXTRACTOR_VERSION
+from calmjs.rjs.requirejs import extract_dependencies
+from calmjs.rjs.requirejs import order_defines_with_deps
+from calmjs.rjs.requirejs import process_paths
+from calmjs.rjs.state import file_digest
 from calmjs.rjs.umdjs import UMD_REQUIREJS_JSON_EXPORT_HEADER
 from calmjs.rjs.umdjs import UMD_REQUIREJS_JSON_EXPORT_FOOTER
 
 logger = logging.getLogger(__name__)
 
+# the manifest of the modules defined in an artifact is written to the
+# path of the artifact with this suffix appended.
+DEFINES_MANIFEST_SUFFIX = '.defines.json'
+DEFINES_MANIFEST_VERSION = 1
+# the name of the cache for the records of the artifacts.
+ARTIFACT_CACHE_NAME = 'artifact_defines'
 
 TEST_SCRIPT_TEMPLATE = """
 var deps = %s;
@@ -65,15 +80,146 @@ def rjs_advice(spec, extras=None):
     spec.advise(BEFORE_KARMA, karma_requirejs, spec)
 
 
-def process_artifacts(paths):
+def write_defines_manifest(path, names):
+    """
+    Write the manifest of the module names defined by the artifact at
+    path next to it, along with the digest of the artifact such that
+    the manifest will not be used once the artifact was changed.
+    """
+
+    manifest_path = path + DEFINES_MANIFEST_SUFFIX
+    manifest = {
+        'version': DEFINES_MANIFEST_VERSION,
+        'digest': file_digest(path),
+        'defines': list(names),
+    }
+    try:
+        with open(manifest_path, 'w') as fd:
+            json.dump(manifest, fd, indent=1, sort_keys=True)
+    except (OSError, IOError) as e:
+        logger.warning(
+            "failed to write defines manifest '%s': %s: %s",
+            manifest_path, type(e).__name__, e,
+        )
+        return None
+    logger.debug("wrote defines manifest '%s'", manifest_path)
+    return manifest_path
+
+
+def read_defines_manifest(path):
+    """
+    Return the list of module names from the manifest of the artifact
+    at path, or None if there is no valid manifest that is current for
+    the artifact.
+    """
+
+    manifest_path = path + DEFINES_MANIFEST_SUFFIX
+    try:
+        with open(manifest_path) as fd:
+            manifest = json.load(fd)
+    except (OSError, IOError):
+        return None
+    except ValueError:
+        logger.warning(
+            "ignoring corrupted defines manifest '%s'", manifest_path)
+        return None
+
+    if not (isinstance(manifest, dict) and
+            manifest.get('version') == DEFINES_MANIFEST_VERSION):
+        logger.debug("ignoring incompatible defines manifest '%s'", path)
+        return None
+    if manifest.get('digest') != file_digest(path):
+        logger.debug("ignoring outdated defines manifest for '%s'", path)
+        return None
+    return manifest.get('defines', [])
+
+
+def parse_artifacts(paths, cache_dir=None, processes=None):
+    """
+    Extract the records of dependencies from the artifacts at paths,
+    returning them in the same order, with None for the artifacts that
+    failed to be processed.
+
+    Arguments:
+
+    paths
+        The paths to the artifacts.
+    cache_dir
+        The directory for caching the records, keyed by the contents of
+        the artifacts.
+    processes
+        The number of processes to parse the artifacts with, as per
+        process_paths; by default they are parsed one at a time in this
+        process, such that only one of them is held in memory.
+    """
+
+    if not cache_dir:
+        return process_paths(paths, extract_dependencies, processes=processes)
+
+    cache = ContentCache(
+        join(cache_dir, ARTIFACT_CACHE_NAME),
+        version='%s:%s:%s' % (
+            ARTIFACT_CACHE_NAME, EXTRACTOR_VERSION, parser_version()),
+    )
+    results = cache.process_paths(
+        paths, extract_dependencies, processes=processes)
+    logger.debug(
+        "cache '%s' had %d hits and %d misses",
+        cache.cache_dir, cache.hits, cache.misses,
+    )
+    cache.prune()
+    return results
+
+
+def process_artifacts(paths, records=None, cache_dir=None, processes=None):
     """
     If they are provided, assuming the defined modules there will not be
     listed as a deps for loading.
+
+    Arguments:
+
+    paths
+        The paths to the artifacts.
+    records
+        A mapping of the paths of the sources that were already parsed
+        in the build to their records of dependencies, as produced by
+        extract_dependencies, such that those will not be parsed again;
+        the records for the paths that are not found will be added.
+    cache_dir
+        The directory for caching the records of the artifacts that had
+        to be parsed.
+    processes
+        The number of processes to parse the artifacts with, as per
+        parse_artifacts.
+
+    The artifacts with a current defines manifest written next to them
+    (see write_defines_manifest) will not be parsed.
     """
 
-    # TODO figure out how to have a flag to disable this feature for use
-    # cases where this is undesirable (e.g. performance reasons).
-    return extract_defines_with_deps_from_paths(paths)
+    if records is None:
+        records = {}
+    defines = {}
+    pending = []
+    for path in paths:
+        if path in records:
+            logger.debug("using dependency record of '%s' from build", path)
+            defines[path] = records[path][0]
+            continue
+        names = read_defines_manifest(path)
+        if names is not None:
+            logger.debug("using defines manifest of '%s'", path)
+            defines[path] = [[name, []] for name in names]
+            continue
+        pending.append(path)
+
+    if pending:
+        for path, record in zip(pending, parse_artifacts(
+                pending, cache_dir=cache_dir, processes=processes)):
+            if record is not None:
+                records[path] = record
+                defines[path] = record[0]
+    return list(order_defines_with_deps(
+        (path, defines[path]) for path in paths if path in defines))
 
 
 def karma_requirejs(spec):
@@ -154,9 +300,19 @@ def karma_requirejs(spec):
     # and thus be able to be loaded synchronously by test modules.
     deps = sorted(spec.get('export_module_names', []))
 
-    if spec.get(ARTIFACT_PATHS):
-        # TODO have a flag of some sort for flagging this as optional.
-        deps.extend(process_artifacts(spec.get(ARTIFACT_PATHS)))
+    if spec.get(ARTIFACT_DEFINES) is not None:
+        logger.debug(
+            'using the provided list of module names defined by artifacts')
+        deps.extend(spec[ARTIFACT_DEFINES])
+    elif spec.get(ARTIFACT_PATHS):
+        # imported here as the toolchain module depends on this one.
+        from calmjs.rjs.toolchain import CACHE_DIR
+        from calmjs.rjs.toolchain import PARSE_WORKERS
+        deps.extend(process_artifacts(
+            spec.get(ARTIFACT_PATHS), spec.get(DEPENDENCY_RECORDS),
+            cache_dir=spec.get(CACHE_DIR),
+            processes=spec.get(PARSE_WORKERS),
+        ))
 
     test_prefix = spec.get(TEST_FILENAME_PREFIX, TEST_FILENAME_PREFIX_DEFAULT)
     tests = []
@@ -9,6 +9,7 @@ from os import getcwd
 from os.path import join
 from os.path import isdir
 
+from calmjs import dist as calmjs_dist
 from calmjs.registry import get
 from calmjs.dist import get_extras_calmjs
 from calmjs.dist import get_module_registry_dependencies
@@ -74,7 +75,94 @@ def acquire_method(methods, key, default=_default):
     return methods.get(key, methods.get(default))
 
 
-def get_calmjs_module_registry_for(package_names, method=_default):
+class MemoizedDistribution(object):
+    """
+    A proxy to a distribution, with the metadata read from it kept.
+    """
+
+    def __init__(self, dist):
+        self.dist = dist
+        self.has = {}
+        self.metadata = {}
+
+    def has_metadata(self, name):
+        if name not in self.has:
+            self.has[name] = self.dist.has_metadata(name)
+        return self.has[name]
+
+    def get_metadata(self, name):
+        if name not in self.metadata:
+            self.metadata[name] = self.dist.get_metadata(name)
+        return self.metadata[name]
+
+    def __getattr__(self, name):
+        return getattr(self.dist, name)
+
+    def __str__(self):
+        return str(self.dist)
+
+    def __repr__(self):
+        return repr(self.dist)
+
+
+class MemoizedWorkingSet(object):
+    """
+    A proxy to a working set, with the distributions found for the
+    requirements and the resolutions of the dependency graphs kept, and
+    the metadata read from the distributions kept by them, such that a
+    dependency graph is walked only once for all the registries and the
+    extras looked up through the functions provided by calmjs.dist.
+
+    Meant for the creation of a single spec, or of the specs for the
+    targets built together, as the changes made to the working set after
+    the lookups will not be reflected.
+    """
+
+    def __init__(self, working_set=None):
+        """
+        Arguments:
+
+        working_set
+            The working set to proxy; defaults to the one used by the
+            functions provided by calmjs.dist.
+        """
+
+        self.working_set = working_set or calmjs_dist.default_working_set
+        self.found = {}
+        self.resolved = {}
+        self.dists = {}
+
+    def memoized_dist(self, dist):
+        if dist is None:
+            return None
+        if dist not in self.dists:
+            self.dists[dist] = MemoizedDistribution(dist)
+        return self.dists[dist]
+
+    def find(self, req):
+        key = str(req)
+        if key not in self.found:
+            self.found[key] = self.memoized_dist(self.working_set.find(req))
+        return self.found[key]
+
+    def resolve(self, requirements, *a, **kw):
+        requirements = list(requirements)
+        key = tuple(str(req) for req in requirements)
+        if a or kw:
+            # not the plain resolution done by calmjs.dist.
+            return [self.memoized_dist(dist) for dist in (
+                self.working_set.resolve(requirements, *a, **kw))]
+        if key not in self.resolved:
+            self.resolved[key] = [self.memoized_dist(dist) for dist in (
+                self.working_set.resolve(requirements))]
+        return list(self.resolved[key])
+
+    def __getattr__(self, name):
+        return getattr(self.working_set, name)
+
+
+def get_calmjs_module_registry_for(
+        package_names, method=_default, working_set=None):
     """
     Acquire the module registries required for the package_names.
 
@@ -96,15 +184,21 @@ def get_calmjs_module_registry_for(package_names, method=_default):
             Produce an empty source map.
 
         All options not on above list defaults to 'all'
+    working_set
+        The working set to resolve the packages through, such as a
+        MemoizedWorkingSet shared with the other lookups.  Defaults to
+        the one used by calmjs.dist.
     """
 
     registries = acquire_method(
-        calmjs_module_registry_methods, method)(package_names)
+        calmjs_module_registry_methods, method)(
+            package_names, working_set=working_set)
     return registries
 
 
 def generate_transpile_source_maps(
-        package_names, registries=('calmjs.modules'), method=_default):
+        package_names, registries=('calmjs.modules'), method=_default,
+        working_set=None):
     """
     Invoke the module_registry_dependencies family of dist functions,
     with the specified registries, to produce the required source maps.
@@ -132,6 +226,10 @@ def generate_transpile_source_maps(
             Produce an empty source map.
 
         Defaults to 'all'.
+    working_set
+        The working set to resolve the packages through, such as a
+        MemoizedWorkingSet shared with the other lookups.  Defaults to
+        the one used by calmjs.dist.
     """
 
     source_map_methods = acquire_method(source_map_methods_list, method)
@@ -148,7 +246,8 @@ def generate_transpile_source_maps(
         for registry_name in registries:
             transpile_source_map.update(
                 (k, n_filter(v)) for k, v in source_f(
-                    package_names, registry_name=registry_name
+                    package_names, registry_name=registry_name,
+                    working_set=working_set,
                 ).items()
             )
 
@@ -156,7 +255,7 @@ def generate_transpile_source_maps(
 
 
 def generate_bundle_source_maps(
-        package_names, working_dir=None, method=_default):
+        package_names, working_dir=None, method=_default, working_set=None):
     """
     Acquire the bundle source maps through the calmjs registry system.
 
@@ -190,6 +289,10 @@ def generate_bundle_source_maps(
             under the appropriate keys.
 
         Defaults to 'all'.
+    working_set
+        The working set to resolve the packages through, such as a
+        MemoizedWorkingSet shared with the other lookups.  Defaults to
+        the one used by calmjs.dist.
     """
 
     working_dir = working_dir if working_dir else getcwd()
@@ -200,7 +303,8 @@ def generate_bundle_source_maps(
     # the extras keys will be treated as valid Node.js package manager
     # subdirectories.
     valid_pkgmgr_dirs = set(get('calmjs.extras_keys').iter_records())
-    extras_calmjs = acquire_extras_calmjs(package_names)
+    extras_calmjs = acquire_extras_calmjs(
+        package_names, working_set=working_set)
     bundle_source_map = {}
 
     for mgr in extras_calmjs:
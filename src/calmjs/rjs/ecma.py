@@ -3,24 +3,250 @@
 ECMA integration module.
 
 Provides a parse function for parsing a JavaScript source text into a
-source tree through the slimit module.
+source tree through the slimit module, and a lightweight tokenizer for
+use cases that do not require the complete tree.
+
+The slimit parsers hold the state of the parsing being done, so one is
+kept for every thread that parses.  These are built from the lexer and
+parser tables shipped with slimit, which are loaded once per process,
+such that only the first parser incurs that cost.
 """
 
-from slimit.parser import Parser
+import re
+import threading
+
+# the parsers for the threads.
+_local = threading.local()
+# the version of the installed parser, once looked up.
+_parser_version = []
+
+# keywords after which a ``/`` starts a regular expression literal,
+# rather than being a division operator.
+_REGEX_PRECEDING_KEYWORDS = frozenset([
+    'await', 'case', 'delete', 'do', 'else', 'in', 'instanceof', 'new',
+    'of', 'return', 'throw', 'typeof', 'void', 'yield',
+])
+# keywords for which the parenthesized expression that follows will not
+# be the end of an expression, e.g. ``if (x) /re/.test(y);``.
+_CONDITIONAL_KEYWORDS = frozenset(['for', 'if', 'while', 'with'])
+
+_IDENTIFIER_PART = r'(?:[\w$]|\\u[0-9a-fA-F]{4}|\\u\{[0-9a-fA-F]+\})'
+
+_token_re = re.compile(r"""
+(?P<ws>\s+)
+|(?P<comment>//[^\n\r]*|/\*.*?\*/)
+|(?P<name>(?:[^\W\d]|[$]|\\u[0-9a-fA-F]{4}|\\u\{[0-9a-fA-F]+\})%s*)
+|(?P<number>\.?\d(?:[eE][-+]|[\w.])*)
+|(?P<string>'[^'\\\n\r]*(?:\\.[^'\\\n\r]*)*'|"[^"\\\n\r]*(?:\\.[^"\\\n\r]*)*")
+|(?P<unterminated>/\*|['"])
+|(?P<punct>
+    >>>=|\.\.\.|===|!==|\*\*=|<<=|>>=|>>>|=>|&&|\|\||\+\+|--|<<|>>|\*\*
+    |[-+*/%%&|^<>!=]=
+    |[-+*/%%&|^<>!=~?:;,.(){}\[\]@#]
+)
+""" % _IDENTIFIER_PART, re.VERBOSE | re.DOTALL | re.UNICODE)
 
-_parser = None
+# the loops in these patterns are unrolled, as the alternations being
+# repeated for every character is very slow for the larger literals.
+_regex_re = re.compile(
+    r'/[^/\\\[\n\r]*(?:(?:\\.|\[[^\]\\\n\r]*(?:\\.[^\]\\\n\r]*)*\])'
+    r'[^/\\\[\n\r]*)*/%s*' % _IDENTIFIER_PART,
+    re.DOTALL | re.UNICODE,
+)
+
+# the body of a template literal up to the closing backtick or the
+# start of a substitution.
+_template_re = re.compile(
+    r'[^`\\$]*(?:(?:\\.|\$(?!\{))[^`\\$]*)*(`|\$\{)', re.DOTALL)
+
+
+def parser_version():
+    """
+    Return the version of the installed slimit distribution, to be used
+    as part of the keys for the results derived from the parsing, such
+    that those are not reused once slimit was upgraded.  This is read
+    from the metadata of the distribution as importing slimit is costly.
+    """
+
+    if not _parser_version:
+        try:
+            from importlib.metadata import version
+            from importlib.metadata import PackageNotFoundError
+        except ImportError:  # pragma: no cover
+            # python 2 or <3.8
+            from pkg_resources import DistributionNotFound
+            from pkg_resources import get_distribution
+            try:
+                result = get_distribution('slimit').version
+            except DistributionNotFound:
+                result = 'unknown'
+        else:
+            try:
+                result = version('slimit')
+            except PackageNotFoundError:
+                result = 'unknown'
+        _parser_version.append('slimit-%s' % result)
+    return _parser_version[0]
 
 
 # TODO name parse functions after the version of the expected input.
 
+def get_parser():
+    """
+    Return the slimit Parser for the current thread, creating it if the
+    thread does not have one yet.
+    """
+
+    parser = getattr(_local, 'parser', None)
+    if parser is None:
+        # imported here as loading the tables is costly.
+        from slimit.parser import Parser
+        # the tables are optimized, i.e. the ones provided by slimit
+        # are used as is instead of being checked and regenerated.
+        parser = _local.parser = Parser(
+            lex_optimize=True, yacc_optimize=True, yacc_debug=False)
+    return parser
+
+
+def _reset_parser(parser):
+    # clear the state that slimit leaves behind from the previous parse,
+    # as the tokens recorded for the automatic semicolon insertion would
+    # otherwise fail the parsing of the same source again, and a failed
+    # parse may leave behind the tokens it looked ahead for.
+    parser._error_tokens = {}
+    lexer = parser.lexer
+    lexer.prev_token = None
+    lexer.cur_token = None
+    lexer.next_tokens = []
+    lexer.lexer.lineno = 1
+    # also release the references to the source text and the tree from
+    # the previous parse, such that they need not outlive their use.
+    lexer.lexer.lexdata = None
+    parser.parser.symstack = None
+    parser.parser.statestack = None
+
+
 def parse(text):
     """
     Turn a valid JavaScript source string and turn it into a source tree
-    through the Parser provided by the slimit.parser module.
+    through the Parser provided by the slimit.parser module.  Safe to be
+    called from multiple threads concurrently.
+    """
+
+    parser = get_parser()
+    _reset_parser(parser)
+    try:
+        return parser.parse(text)
+    finally:
+        _reset_parser(parser)
+
+
+def _syntax_error(text, pos, msg):
+    return SyntaxError('%s at %d:%d' % (
+        msg, text.count('\n', 0, pos) + 1, pos - text.rfind('\n', 0, pos)))
+
+
+def tokenize(text, positions=False):
+    """
+    A lightweight tokenizer for JavaScript source text, for cases where
+    a complete source tree is not required.  The comments, string,
+    regular expression and template literals are all recognized so
+    that their contents will not be mistaken for code.
+
+    Produces 2-tuples of the token type and the raw value, for all the
+    tokens other than whitespaces and comments, or 3-tuples with the
+    offset of the token in text added if positions is True.  The type is one of
+    ``name`` (for identifiers and keywords), ``number``, ``string``,
+    ``regex``, ``template`` or ``punct`` (for punctuators).  A template
+    literal with substitutions will be produced as multiple template
+    tokens, with the tokens for the substitution expressions between
+    them.  Note that the ``${`` and the matching ``}`` that delimit the
+    substitutions are part of the template tokens.
+
+    A SyntaxError will be raised for unterminated comments and literals.
     """
 
-    global _parser
-    if _parser is None:
-        _parser = Parser()
+    # skip the byte order mark, if any.
+    pos = 1 if text[:1] == u'\ufeff' else 0
+    end = len(text)
+    # whether a '/' at the current position starts a regex literal
+    regex_allowed = True
+    # the brace depth for each of the nested template substitutions
+    templates = []
+    # whether the parentheses opened so far follow a conditional keyword
+    parens = []
+    last = None
+    match = _token_re.match
+
+    while pos < end:
+        char = text[pos]
+
+        if char == '`' or (char == '}' and templates and not templates[-1]):
+            m = _template_re.match(text, pos + 1)
+            if m is None:
+                raise _syntax_error(text, pos, 'unterminated template literal')
+            if char == '}':
+                templates.pop()
+            if m.group(1) == '${':
+                templates.append(0)
+                regex_allowed = True
+            else:
+                regex_allowed = False
+            if positions:
+                yield 'template', text[pos:m.end()], pos
+            else:
+                yield 'template', text[pos:m.end()]
+            pos = m.end()
+            continue
+
+        if char == '/' and regex_allowed and text[pos + 1:pos + 2] not in (
+                '/', '*'):
+            m = _regex_re.match(text, pos)
+            if m is not None:
+                if positions:
+                    yield 'regex', m.group(), pos
+                else:
+                    yield 'regex', m.group()
+                pos = m.end()
+                regex_allowed = False
+                continue
+
+        m = match(text, pos)
+        if m is None:
+            raise _syntax_error(
+                text, pos, 'unexpected character %r' % text[pos])
+        kind = m.lastgroup
+        pos = m.end()
+
+        if kind in ('ws', 'comment'):
+            continue
+        if kind == 'unterminated':
+            raise _syntax_error(text, m.start(), 'unterminated %s' % (
+                'comment' if m.group() == '/*' else 'string literal'))
+
+        value = m.group()
+        if kind == 'punct':
+            if templates:
+                if value == '{':
+                    templates[-1] += 1
+                elif value == '}':
+                    templates[-1] -= 1
+            if value == '(':
+                parens.append(last in _CONDITIONAL_KEYWORDS)
+                regex_allowed = True
+            elif value == ')':
+                regex_allowed = parens.pop() if parens else False
+            else:
+                regex_allowed = value not in (']', '}')
+        elif kind == 'name':
+            regex_allowed = value in _REGEX_PRECEDING_KEYWORDS
+        else:
+            regex_allowed = False
+        last = value
+        if positions:
+            yield kind, value, m.start()
+        else:
+            yield kind, value
 
-    return _parser.parse(text)
+    if templates:
+        raise _syntax_error(text, pos, 'unterminated template literal')
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+A queryable store of the module dependency graph of a build.
+
+The assemble step of the RJSToolchain works out the module names that
+every target in the build directory requires; the ModuleGraph persists
+those, along with what is known about every module, into an indexed
+SQLite database such that the graph can be inspected after the build
+(e.g. for the decisions on what to split out of a bundle) without any
+of the sources being parsed again.
+"""
+
+import logging
+import os
+import sqlite3
+from os.path import exists
+
+logger = logging.getLogger(__name__)
+
+# increment this when the schema is changed.
+MODULE_GRAPH_VERSION = 1
+
+# the statuses of the modules.
+OK = 'ok'
+EMPTIED = 'emptied'
+MISSING = 'missing'
+
+# the columns of the modules table after the id, in the order of the
+# values of the records passed to ModuleGraph.create.
+MODULE_COLUMNS = (
+    'modname', 'source', 'target', 'kind', 'plugin', 'package', 'size',
+    'status',
+)
+
+_SCHEMA = """
+CREATE TABLE modules (
+    id INTEGER PRIMARY KEY,
+    modname TEXT NOT NULL UNIQUE,
+    source TEXT,
+    target TEXT,
+    kind TEXT,
+    plugin TEXT,
+    package TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL
+);
+CREATE TABLE edges (
+    source_id INTEGER NOT NULL,
+    target_id INTEGER NOT NULL,
+    PRIMARY KEY (source_id, target_id)
+) WITHOUT ROWID;
+"""
+
+# created after the rows are inserted, as that is faster.
+_INDEXES = """
+CREATE INDEX edges_target_id ON edges (target_id, source_id);
+CREATE INDEX modules_package ON modules (package);
+CREATE INDEX modules_status ON modules (status);
+"""
+
+# the ids of the modules reachable from the module with the id bound
+# as the parameter, following the edges from the key to the start.
+_REACHABLE = """
+WITH RECURSIVE reachable(id) AS (
+    SELECT %(start)s FROM edges WHERE %(key)s = ?
+    UNION
+    SELECT edges.%(start)s FROM edges
+    JOIN reachable ON edges.%(key)s = reachable.id
+)
+"""
+
+
+def module_package(modname, source):
+    """
+    Derive the name of the package providing the module.  For sources
+    from a node_modules directory this is the name of the npm package,
+    otherwise the dotted name of the namespace of the module name (the
+    name of the Python package for the modules declared through the
+    calmjs module registries).
+    """
+
+    parts = (source or '').replace(os.sep, '/').split('/')
+    if 'node_modules' in parts:
+        idx = len(parts) - parts[::-1].index('node_modules')
+        parts = parts[idx:idx + 2]
+        if parts and parts[0].startswith('@'):
+            return '/'.join(parts)
+        return parts[0] if parts else None
+    modname = modname.split('!', 1)[-1]
+    if '/' not in modname:
+        return None
+    return '.'.join(modname.split('/')[:-1])
+
+
+class ModuleGraph(object):
+    """
+    The module dependency graph stored at the path of a SQLite database.
+    """
+
+    def __init__(self, path):
+        if not exists(path):
+            raise IOError("module graph '%s' does not exist" % path)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        version = self.connection.execute('PRAGMA user_version').fetchone()
+        if version[0] != MODULE_GRAPH_VERSION:
+            self.close()
+            raise ValueError(
+                "module graph '%s' has an incompatible version" % path)
+
+    @classmethod
+    def create(cls, path, modules, edges):
+        """
+        Write the graph to path, replacing any existing one there, and
+        return the ModuleGraph for it.
+
+        Arguments:
+
+        path
+            The path to the database.
+        modules
+            An iterable of tuples of the values for the MODULE_COLUMNS
+            of every module.
+        edges
+            An iterable of 2-tuples of the module name that requires the
+            other module name; both must be present in modules.
+        """
+
+        if exists(path):
+            os.remove(path)
+        connection = sqlite3.connect(path)
+        try:
+            connection.executescript(_SCHEMA)
+            with connection:
+                ids = {}
+                for idx, module in enumerate(modules, 1):
+                    ids[module[0]] = idx
+                    connection.execute(
+                        'INSERT INTO modules VALUES (?%s)' % (
+                            ', ?' * len(MODULE_COLUMNS)),
+                        (idx,) + tuple(module),
+                    )
+                connection.executemany(
+                    'INSERT OR IGNORE INTO edges VALUES (?, ?)',
+                    ((ids[source], ids[target]) for source, target in edges),
+                )
+            connection.executescript(_INDEXES)
+            connection.execute(
+                'PRAGMA user_version = %d' % MODULE_GRAPH_VERSION)
+        finally:
+            connection.close()
+        return cls(path)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _names(self, query, *args):
+        return [row[0] for row in self.connection.execute(query, args)]
+
+    def modnames(self, status=None):
+        """
+        Return the sorted list of all the module names, or only those
+        with the provided status.
+        """
+
+        if status is None:
+            return self._names('SELECT modname FROM modules ORDER BY modname')
+        return self._names(
+            'SELECT modname FROM modules WHERE status = ? ORDER BY modname',
+            status,
+        )
+
+    def module(self, modname):
+        """
+        Return the dict of the MODULE_COLUMNS for the module, or None if
+        it is not in the graph.
+        """
+
+        row = self.connection.execute(
+            'SELECT %s FROM modules WHERE modname = ?' % ', '.join(
+                MODULE_COLUMNS), (modname,)).fetchone()
+        return None if row is None else dict(zip(MODULE_COLUMNS, row))
+
+    def _id(self, modname):
+        row = self.connection.execute(
+            'SELECT id FROM modules WHERE modname = ?', (modname,)).fetchone()
+        return None if row is None else row[0]
+
+    def requires(self, modname):
+        """
+        Return the names of the modules the module requires directly.
+        """
+
+        return self._names(
+            'SELECT target.modname FROM modules AS source '
+            'JOIN edges ON edges.source_id = source.id '
+            'JOIN modules AS target ON target.id = edges.target_id '
+            'WHERE source.modname = ? ORDER BY target.modname',
+            modname,
+        )
+
+    def required_by(self, modname):
+        """
+        Return the names of the modules that require the module directly.
+        """
+
+        return self._names(
+            'SELECT source.modname FROM modules AS target '
+            'JOIN edges ON edges.target_id = target.id '
+            'JOIN modules AS source ON source.id = edges.source_id '
+            'WHERE target.modname = ? ORDER BY source.modname',
+            modname,
+        )
+
+    def reachable(self, modname):
+        """
+        Return the names of all the modules the module requires, both
+        directly and transitively.
+        """
+
+        return self._names(_REACHABLE % {
+            'start': 'target_id', 'key': 'source_id'} + (
+            'SELECT modname FROM modules '
+            'WHERE id IN (SELECT id FROM reachable) ORDER BY modname'),
+            self._id(modname),
+        )
+
+    def dependents(self, modname):
+        """
+        Return the names of all the modules that require the module,
+        both directly and transitively.
+        """
+
+        return self._names(_REACHABLE % {
+            'start': 'source_id', 'key': 'target_id'} + (
+            'SELECT modname FROM modules '
+            'WHERE id IN (SELECT id FROM reachable) ORDER BY modname'),
+            self._id(modname),
+        )
+
+    def reachable_size(self, modname):
+        """
+        Return the total size of the module and all the modules that
+        are reachable from it.
+        """
+
+        module_id = self._id(modname)
+        return self.connection.execute(_REACHABLE % {
+            'start': 'target_id', 'key': 'source_id'} + (
+            'SELECT COALESCE(SUM(size), 0) FROM modules '
+            'WHERE id IN (SELECT id FROM reachable) OR id = ?'),
+            (module_id, module_id),
+        ).fetchone()[0]
+
+    def package_sizes(self):
+        """
+        Return a list of the (package, module count, total size) for all
+        the packages, ordered by the largest total size first.
+        """
+
+        return [tuple(row) for row in self.connection.execute(
+            'SELECT package, COUNT(*), SUM(size) FROM modules '
+            'GROUP BY package ORDER BY SUM(size) DESC, package'
+        )]
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+A linker for development builds that does not require r.js.
+
+After the assemble step of the RJSToolchain, the build directory holds
+every module that goes into the export target, along with the build
+manifest that is normally passed to r.js.  The Linker reads the same
+manifest and produces what r.js would with optimization disabled: the
+modules are concatenated in the order of their dependencies, with their
+anonymous define calls named, the resources for the text loader plugin
+inlined, the shimmed modules wrapped and the modules mapped to empty:
+left out.
+
+Only the features of r.js used by the manifests written by the
+RJSToolchain are supported; a LinkerError is raised for everything else
+(such as loader plugins other than text), for which r.js has to be used.
+"""
+
+import codecs
+import json
+import logging
+from os.path import dirname
+from os.path import isabs
+from os.path import join
+
+from .dist import EMPTY
+from .ecma import tokenize
+from .requirejs import amd_requires_extractors
+from .requirejs import strip_quotes
+from .requirejs import strip_slashes
+from .worker import load_build_config
+
+logger = logging.getLogger(__name__)
+
+# the module names provided by the AMD loader.
+RESERVED_MODNAMES = ('require', 'exports', 'module',)
+# the only loader plugin that can have its resources inlined.
+TEXT_PLUGIN = 'text'
+
+_SHIM_WRAPPER = """(function(root) {
+define(%(name)s, %(deps)s, function() {
+  return (function() {
+%(text)s
+%(exports)s
+  }).apply(root, arguments);
+});
+}(this));
+"""
+
+
+class LinkerError(ValueError):
+    """
+    The build cannot be done by the Linker.
+    """
+
+
+def normalize(modname, parent=None):
+    """
+    Resolve a relative module name against the name of the module that
+    required it, like the AMD loader does.
+    """
+
+    if parent is None or not modname.startswith('.'):
+        return modname
+    parts = parent.split('/')[:-1]
+    for part in modname.split('/'):
+        if part == '..':
+            if not parts:
+                raise LinkerError(
+                    "module name '%s' required by '%s' is outside of the "
+                    "top level" % (modname, parent))
+            parts.pop()
+        elif part != '.':
+            parts.append(part)
+    return '/'.join(parts)
+
+
+def find_defines(text):
+    """
+    Return a list of 2-tuples for all the define calls in the source
+    text, of the module name (None if the define is anonymous) and the
+    offset right after the opening parenthesis of the call.
+    """
+
+    tokens = list(tokenize(text, positions=True))
+    results = []
+    for idx, (kind, value, pos) in enumerate(tokens):
+        if not (value == '(' and kind == 'punct' and idx and
+                tokens[idx - 1][:2] == ('name', 'define')):
+            continue
+        if idx > 1 and tokens[idx - 2][1] in ('.', 'function', 'new'):
+            continue
+        arg = tokens[idx + 1] if idx + 1 < len(tokens) else None
+        name = None
+        if (arg and arg[0] == 'string' and idx + 2 < len(tokens) and
+                tokens[idx + 2][1] == ','):
+            name = strip_slashes(strip_quotes(arg[1]))
+        results.append((name, pos + 1))
+    return results
+
+
+class Linker(object):
+    """
+    Links the modules specified by a build config written by the
+    RJSToolchain into the output specified by it.
+    """
+
+    def __init__(self, build_config, base_dir, engine='scan'):
+        """
+        Arguments:
+
+        build_config
+            The build config, as passed to r.js.
+        base_dir
+            The directory that the baseUrl and the out in the build
+            config are relative to, i.e. the one with the manifest.
+        engine
+            The implementation for the extraction of the module names
+            required by the modules; one of the amd_requires_extractors.
+        """
+
+        self.config = build_config
+        self.base_dir = base_dir
+        self.base_url = join(base_dir, build_config.get('baseUrl', ''))
+        self.paths = build_config.get('paths', {})
+        self.shim = build_config.get('shim', {})
+        self.extract = amd_requires_extractors[engine]
+        # the module name to the 2-tuple of its linked source text and
+        # the list of the module names it requires.
+        self.modules = {}
+
+    def is_empty(self, modname):
+        return self.paths.get(modname) == EMPTY
+
+    def resolve(self, modname, ext='.js'):
+        """
+        Return the path to the file for the module name, with the paths
+        from the build config applied.
+        """
+
+        parts = modname.split('/')
+        for idx in range(len(parts), 0, -1):
+            target = self.paths.get('/'.join(parts[:idx]))
+            if target is not None:
+                parts = target.split('/') + parts[idx:]
+                break
+        path = '/'.join(parts)
+        if path.endswith('?'):
+            path = path[:-1]
+        elif not path.endswith('.js'):
+            path += ext
+        return path if isabs(path) else join(self.base_url, *path.split('/'))
+
+    def read(self, modname, ext='.js'):
+        path = self.resolve(modname, ext)
+        try:
+            with codecs.open(path, encoding='utf8') as fd:
+                return fd.read()
+        except (IOError, OSError):
+            raise LinkerError(
+                "module '%s' not found at '%s'" % (modname, path))
+
+    def load_resource(self, modname):
+        plugin, resource = modname.split('!', 1)
+        if plugin != TEXT_PLUGIN:
+            raise LinkerError(
+                "loader plugin '%s' required for '%s' is not supported" % (
+                    plugin, modname))
+        text = "define(%s, function () { return %s; });\n" % (
+            json.dumps(modname), json.dumps(self.read(resource, ext='')))
+        return text, [plugin]
+
+    def load_module(self, modname):
+        text = self.read(modname)
+        try:
+            defines = find_defines(text)
+            requires = [normalize(name, modname) for name in self.extract(
+                text)]
+        except SyntaxError as e:
+            raise LinkerError(
+                "syntax error in module '%s': %s" % (modname, e))
+
+        anonymous = [pos for name, pos in defines if name is None]
+        if len(anonymous) > 1:
+            raise LinkerError(
+                "module '%s' has multiple anonymous define calls" % modname)
+        if anonymous:
+            pos = anonymous[0]
+            text = text[:pos] + json.dumps(modname) + ', ' + text[pos:]
+        elif modname in (name for name, pos in defines):
+            pass
+        elif modname in self.shim:
+            shim = self.shim[modname]
+            if isinstance(shim, list):
+                shim = {'deps': shim}
+            deps = shim.get('deps', [])
+            requires.extend(deps)
+            exports = shim.get('exports')
+            if self.config.get('wrapShim'):
+                text = _SHIM_WRAPPER % {
+                    'name': json.dumps(modname),
+                    'deps': json.dumps(deps),
+                    'text': text,
+                    'exports': 'return %s;' % exports if exports else '',
+                }
+            else:
+                text += '\ndefine(%s, %s, function () { %s });\n' % (
+                    json.dumps(modname), json.dumps(deps),
+                    'return %s;' % exports if exports else '')
+        else:
+            # like r.js, so that the module is not loaded again.
+            text += '\ndefine(%s, function(){});\n' % json.dumps(modname)
+        return text, requires
+
+    def load(self, modname):
+        """
+        Return the 2-tuple of the linked source text for the module and
+        the list of the module names it requires.
+        """
+
+        if modname not in self.modules:
+            if '!' in modname:
+                self.modules[modname] = self.load_resource(modname)
+            else:
+                self.modules[modname] = self.load_module(modname)
+        return self.modules[modname]
+
+    def order(self, modnames, skip=()):
+        """
+        Return the list of the module names with all the modules they
+        require, both directly and transitively, with every module after
+        the ones it requires.  The modules mapped to empty: and the ones
+        in skip are left out.
+        """
+
+        results = []
+        seen = set(skip)
+        seen.update(RESERVED_MODNAMES)
+        for root in modnames:
+            if root in seen or self.is_empty(root):
+                continue
+            seen.add(root)
+            stack = [(root, iter(self.load(root)[1]))]
+            while stack:
+                modname, requires = stack[-1]
+                for required in requires:
+                    if required in seen or self.is_empty(required):
+                        continue
+                    seen.add(required)
+                    stack.append((required, iter(self.load(required)[1])))
+                    break
+                else:
+                    stack.pop()
+                    results.append(modname)
+        return results
+
+    def link(self):
+        """
+        Write the output for the build config, returning the list of the
+        module names written to it.
+        """
+
+        include = self.config.get('include', [])
+        if self.config.get('name'):
+            include = [self.config['name']] + include
+        excluded = self.order(self.config.get('exclude', []))
+        modnames = self.order(include, excluded)
+
+        wrap = self.config.get('wrap')
+        if wrap is True:
+            wrap = {'start': '(function () {\n', 'end': '\n}());\n'}
+        elif wrap and not (set(wrap) <= {'start', 'end'}):
+            raise LinkerError('only the start and end of wrap are supported')
+
+        out = join(self.base_dir, self.config['out'])
+        with codecs.open(out, 'w', encoding='utf8') as fd:
+            if wrap:
+                fd.write(wrap.get('start', ''))
+            for modname in modnames:
+                text = self.modules[modname][0]
+                fd.write(text if text.endswith('\n') else text + '\n')
+                fd.write('\n')
+            if wrap:
+                fd.write(wrap.get('end', ''))
+        logger.info("linked %d module(s) into '%s'", len(modnames), out)
+        return modnames
+
+
+def link_build_manifest(path, engine='scan'):
+    """
+    Do the build specified by the build manifest at path, returning the
+    list of the module names written to the output.
+    """
+
+    return Linker(load_build_config(path), dirname(path), engine).link()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Minification of the individual modules of a build.
+
+Rather than having r.js minify the complete export target in a single
+pass for every build, the modules in the build directory are minified
+one at a time, such that the work can be distributed across a pool of
+processes and the results cached by the digest of the module text;
+r.js then only has to concatenate the minified modules.
+"""
+
+import codecs
+import logging
+import os
+from os.path import dirname
+from os.path import exists
+
+from calmjs.rjs.ecma import parse
+from calmjs.rjs.requirejs import process_paths
+
+logger = logging.getLogger(__name__)
+
+# increment this when the output of the minifiers is changed.
+MINIFIER_VERSION = '1'
+
+
+def minify_slimit(text):
+    """
+    Minify the text through the minifier provided by slimit.  The names
+    are not mangled, as the AMD loader finds the CommonJS requires of a
+    module by scanning the text of its factory for calls to require.
+    """
+
+    # imported here as slimit is costly to import.
+    from slimit.visitors.minvisitor import ECMAMinifier
+    return [ECMAMinifier().visit(parse(text))]
+
+
+# the available minifiers; each takes the text of a module and returns
+# a list with the minified text as the only item, such that they can be
+# used through process_paths and the ContentCache.
+minifiers = {
+    'slimit': minify_slimit,
+}
+
+
+def minify_paths(paths, targets, minifier, cache=None, processes=None):
+    """
+    Minify the modules at the paths into the targets, returning a list
+    of whether each of the paths was minified.  The failures are logged.
+
+    Arguments:
+
+    paths
+        The paths to the modules.
+    targets
+        The paths to write the minified modules to, in the same order
+        as the paths.
+    minifier
+        One of the minifiers, or a function that behaves the same way.
+    cache
+        An optional ContentCache for the minified texts.
+    processes
+        The number of processes to minify with, as for process_paths.
+    """
+
+    if cache is None:
+        results = process_paths(paths, minifier, processes=processes)
+    else:
+        results = cache.process_paths(paths, minifier, processes=processes)
+
+    for target, result in zip(targets, results):
+        if result is None:
+            continue
+        if not exists(dirname(target)):
+            os.makedirs(dirname(target))
+        with codecs.open(target, 'w', encoding='utf8') as fd:
+            fd.write(result[0])
+    return [result is not None for result in results]
@@ -39,45 +39,65 @@ class LoaderPluginRegistry(BaseRegistry):
     # through a new generic base registry class of some sort.
 
     def _init(self):
+        # the entry points are only grouped by name here; the handlers
+        # are imported and constructed on the first lookup of the name.
+        self._entry_points = {}
         for entry_point in self.raw_entry_points:
-            try:
-                cls = entry_point.load()
-            except ImportError:
-                logger.warning(
-                    "registry '%s' failed to load loader plugin handler for "
-                    "entry point '%s'", self.registry_name, entry_point,
-                )
-                continue
-
-            if not issubclass(cls, LoaderPluginHandler):
-                logger.warning(
-                    "entry point '%s' does not lead to a valid loader plugin "
-                    "handler class", entry_point
-                )
-                continue
+            self._entry_points.setdefault(entry_point.name, []).append(
+                entry_point)
+
+    def _load_handler(self, entry_point):
+        try:
+            cls = entry_point.load()
+        except ImportError:
+            logger.warning(
+                "registry '%s' failed to load loader plugin handler for "
+                "entry point '%s'", self.registry_name, entry_point,
+            )
+            return
+
+        if not (isinstance(cls, type) and issubclass(
+                cls, LoaderPluginHandler)):
+            logger.warning(
+                "entry point '%s' does not lead to a valid loader plugin "
+                "handler class", entry_point
+            )
+            return
+
+        try:
+            return cls(self, entry_point.name)
+        except Exception:
+            logger.exception(
+                "the loader plugin class registered at '%s' failed "
+                "to be instantiated with the following exception",
+                entry_point,
+            )
 
-            try:
-                inst = cls(self, entry_point.name)
-            except Exception:
-                logger.exception(
-                    "the loader plugin class registered at '%s' failed "
-                    "to be instantiated with the following exception",
-                    entry_point,
-                )
+    def get_record(self, name):
+        if name in self.records:
+            return self.records[name]
+
+        # the later entry points override the earlier ones that were
+        # successfully constructed, as they would have been if they
+        # were all loaded up front.
+        inst = None
+        for entry_point in self._entry_points.pop(name, ()):
+            handler = self._load_handler(entry_point)
+            if handler is None:
                 continue
-
-            if entry_point.name in self.records:
-                old = type(self.records[entry_point.name])
+            if inst is not None:
+                old = type(inst)
                 logger.warning(
                     "loader plugin handler for '%s' was already registered to "
                     "an instance of '%s:%s'; '%s' will now override this "
                     "registration",
-                    entry_point.name, old.__module__, old.__name__, entry_point
+                    name, old.__module__, old.__name__, entry_point
                 )
-            self.records[entry_point.name] = inst
+            inst = handler
 
-    def get_record(self, name):
-        return self.records.get(name)
+        # failures are also recorded, such that they are not repeated.
+        self.records[name] = inst
+        return inst
 
     def _mapping_to_config_paths(self, mapping, method_prefix):
         """
@@ -10,11 +10,26 @@ import logging
 import re
 from functools import partial
 
-from slimit import ast
-
 from calmjs.rjs.ecma import parse
+from calmjs.rjs.ecma import tokenize
 
 logger = logging.getLogger(__name__)
+# the version of the output produced by the extraction functions, used
+# as part of the keys for the results persisted by calmjs.rjs.cache; it
+# must be incremented whenever those outputs change for a given input.
+EXTRACTOR_VERSION = '2'
+# the spec key for the mapping of the paths of the sources that were
+# parsed in a build to their records of dependencies, as produced by
+# extract_dependencies, such that they are parsed once for a build.
+DEPENDENCY_RECORDS = 'dependency_records'
+# the spec key for the list of module names defined by the artifacts to
+# be used for the karma test runner in place of the extraction of those
+# names from the artifacts; an empty list skips the extraction.
+ARTIFACT_DEFINES = 'artifact_defines'
+# the spec key for writing the manifest of the modules defined in the
+# export target next to it once built.
+DEFINES_MANIFEST = 'defines_manifest'
+
 strip_quotes = partial(re.compile('([\"\'])(.*)(\\1)').sub, '\\2')
 strip_slashes = partial(re.compile(r'\\(.)').sub, '\\1')
 
@@ -25,24 +40,42 @@ def to_str(ast_string):
 
 def extract_function_argument_visitor(
         node, f_name, f_argn, f_argt, visitor=None):
+    """
+    Produce the values of the f_argn argument of type f_argt from the
+    calls to the function named f_name within node, not going into the
+    calls to any function named by an identifier.
+
+    The tree is traversed with an explicit stack of the iterators of
+    the nodes being visited, rather than recursively through nested
+    generators, such that the cost of every node does not grow with its
+    depth and deeply nested trees will not exhaust the recursion limit.
+    If a visitor is provided, the children not matched will be passed
+    to that instead for the production of the values within.
+    """
 
-    if visitor is None:
-        visitor = extract_function_argument_visitor
+    from slimit import ast
 
-    for child in node:
-        # only skimming the top function, not going in.
-        if isinstance(child, ast.FunctionCall) and isinstance(
-                child.identifier, ast.Identifier):
-            if child.identifier.value == f_name and f_argn < len(
-                    child.args) and isinstance(child.args[f_argn], f_argt):
-                yield to_str(child.args[f_argn])
+    stack = [iter(node)]
+    while stack:
+        for child in stack[-1]:
+            # only skimming the top function, not going in.
+            if isinstance(child, ast.FunctionCall) and isinstance(
+                    child.identifier, ast.Identifier):
+                if child.identifier.value == f_name and f_argn < len(
+                        child.args) and isinstance(child.args[f_argn], f_argt):
+                    yield to_str(child.args[f_argn])
+            elif visitor is None:
+                # visit the child, then resume with the remaining ones.
+                stack.append(iter(child))
+                break
+            else:
+                for value in visitor(child, f_name, f_argn, f_argt):
+                    yield value
         else:
-            # yield from visit(child)
-            for value in visitor(child, f_name, f_argn, f_argt):
-                yield value
+            stack.pop()
 
 
-def extract_function_argument(text, f_name, f_argn, f_argt=ast.String):
+def extract_function_argument(text, f_name, f_argn, f_argt=None):
     """
     Extract a specific argument from a specific function name.
 
@@ -58,6 +91,9 @@ def extract_function_argument(text, f_name, f_argn, f_argt=ast.String):
         The argument type from slimit.ast; default: slimit.ast.String
     """
 
+    if f_argt is None:
+        from slimit.ast import String as f_argt
+
     tree = parse(text)
     return list(extract_function_argument_visitor(
         tree, f_name, f_argn, f_argt))
@@ -86,63 +122,90 @@ def extract_requires(text):
     return extract_function_argument(text, 'require', 0)
 
 
-def extract_defines_with_deps_visitor(node_map):
+def order_defines_with_deps(named_defines):
     """
-    For the execution of tests against a pre-built artifact, there is no
-    way to tell requirejs that all the modules are already available
-    synchronously through the provided artifact files.  This function
-    will build a dictionary with keys being the module name and value
-    being a list of module names it requires synchronously.
+    Produce the names of the defined modules, ordered such that every
+    module comes after the modules it requires synchronously.  Where
+    the modules require each other in a cycle, a warning is logged and
+    the requirement that closes the cycle is ignored.
+
+    Arguments:
+
+    named_defines
+        An iterable of 2-tuples of the name of the source (for the
+        logging) and the list of the [modname, requires] of the modules
+        defined within, as produced by extract_dependencies.
     """
 
     defines = {}
-    yielded = set()
 
-    def extract_defines_visitor(node, node_name):
-        f_name = 'define'
-        f_argn = 0
-        f_argt = ast.String
-
-        for child in node:
-            if isinstance(child, ast.FunctionCall) and isinstance(
-                    child.identifier, ast.Identifier):
-                if child.identifier.value == f_name and f_argn < len(
-                        child.args) and isinstance(child.args[f_argn], f_argt):
-                    modname = to_str(child.args[f_argn])
-                    moddeps = list(extract_function_argument_visitor(
-                        child, 'require', 0, ast.String))
-                    if modname in defines:
+    # first flatten it into a dependency map
+    for node_name, node_defines in named_defines:
+        for modname, moddeps in node_defines:
+            if modname in defines:
+                logger.warning(
+                    "module '%s' defined again in '%s'",
+                    modname, node_name,
+                )
+                # don't do anything more since requirejs doesn't
+                # permit redefinition in general.
+                continue
+            defines[modname] = moddeps
+
+    # then do a depth first traversal of that map to generate the values
+    # in the correct order, with the path of the modules currently being
+    # visited tracked for the detection of cycles.
+    yielded = set()
+    missing = set()
+    for root in defines:
+        if root in yielded:
+            continue
+        path = [root]
+        visiting = {root}
+        stack = [iter(defines[root])]
+        while stack:
+            for modname in stack[-1]:
+                if modname in yielded:
+                    continue
+                if modname not in defines:
+                    if modname not in missing:
+                        missing.add(modname)
                         logger.warning(
-                            "module '%s' defined again in '%s'",
-                            modname, node_name,
+                            "module '%s' required but seems to be missing",
+                            modname,
                         )
-                        # don't do anything more since requirejs doesn't
-                        # permit redefinition in general.
-                        continue
-                    defines[modname] = moddeps
+                    continue
+                if modname in visiting:
+                    logger.warning(
+                        "circular dependency between modules: %s",
+                        ' -> '.join(path[path.index(modname):] + [modname]),
+                    )
+                    continue
+                path.append(modname)
+                visiting.add(modname)
+                stack.append(iter(defines[modname]))
+                break
             else:
-                extract_defines_visitor(child, node_name)
-
-    # first flatten it into a dependency map
-    for node_name, node in node_map:
-        extract_defines_visitor(node, node_name)
-
-    # then process that map to generate the values in correct order.
-    def process_defines(modname):
-        if modname not in yielded:
-            for modname_ in defines.get(modname, ()):
-                for mn in process_defines(modname_):
-                    yield mn
-            if modname in defines:
+                stack.pop()
+                modname = path.pop()
+                visiting.discard(modname)
                 yielded.add(modname)
                 yield modname
-            else:
-                logger.warning(
-                    "module '%s' required but seems to be missing", modname)
 
-    for modname in defines.keys():
-        for mn in process_defines(modname):
-            yield mn
+
+def extract_defines_with_deps_visitor(node_map):
+    """
+    For the execution of tests against a pre-built artifact, there is no
+    way to tell requirejs that all the modules are already available
+    synchronously through the provided artifact files.  This function
+    will build a dictionary with keys being the module name and value
+    being a list of module names it requires synchronously.
+    """
+
+    return order_defines_with_deps(
+        (node_name, extract_dependencies_visitor(node)[0])
+        for node_name, node in node_map
+    )
 
 
 def extract_defines_with_deps(text):
@@ -151,30 +214,43 @@ def extract_defines_with_deps(text):
 
 
 def extract_defines_with_deps_from_paths(paths):
-    items = []
+    """
+    Produce the list of the names of the modules defined in the sources
+    at paths, ordered as per order_defines_with_deps.
 
-    def append_tree(path, text):
-        items.append((path, parse(text)))
+    Each source is parsed and has its defines extracted before the next
+    one is read, with only those defines kept, such that the memory
+    needed is bounded by the tree of the largest source rather than the
+    trees of all of them.
+    """
 
-    for path in paths:
-        process_path(path, partial(append_tree, path))
+    def named_defines():
+        for path in paths:
+            record = process_path(path, extract_dependencies)
+            if record is not None:
+                yield path, record[0]
 
-    return list(extract_defines_with_deps_visitor(items))
+    return list(order_defines_with_deps(named_defines()))
 
 
-def extract_all_amd_requires(text):
+def extract_all_amd_requires_visitor(node):
     """
-    Extract all require and define calls from unbundled JavaScript
-    source files in both AMD and CommonJS syntax.
+    Produce the names from all the require and define calls within node
+    in both AMD and CommonJS syntax.
     """
 
+    from slimit import ast
+
     f_names = ('require', 'define',)
     # reserved modules
     define_wrapped = dict(enumerate(('require', 'exports', 'module',)))
     reserved = ['module']
 
-    def visit(node):
-        for child in node:
+    # the iterators of the nodes being visited, in place of the recursion
+    # of nested generators.
+    stack = [iter(node)]
+    while stack:
+        for child in stack[-1]:
             if isinstance(child, ast.FunctionCall) and isinstance(
                     child.identifier, ast.Identifier):
                 if not child.args:
@@ -208,31 +284,487 @@ def extract_all_amd_requires(text):
                     if not cond:
                         continue
 
-                    for i, node in enumerate(child.args[pos]):
-                        if isinstance(node, ast.String):
-                            result = to_str(node)
+                    for i, item in enumerate(child.args[pos]):
+                        if isinstance(item, ast.String):
+                            result = to_str(item)
                             if ((result not in reserved) and (
                                     result != define_wrapped.get(i))):
                                 yield result
 
-            # yield from visit(child)
-            for value in visit(child):
-                yield value
+            # visit the child, then resume with the remaining ones.
+            stack.append(iter(child))
+            break
+        else:
+            stack.pop()
+
+
+def extract_all_amd_requires(text):
+    """
+    Extract all require and define calls from unbundled JavaScript
+    source files in both AMD and CommonJS syntax.
+    """
 
     tree = parse(text)
-    return visit(tree)
+    return extract_all_amd_requires_visitor(tree)
 
 
-def process_path(path, f):
+def extract_dependencies_visitor(node):
     """
-    Take the path and process it through one of the above functions
+    Produce the record of the dependencies within node through a single
+    traversal, in place of the separate traversals done by the visitors
+    above.  The record is a list of two items: the list of [modname,
+    requires] for every module defined within, with the names of the
+    modules it requires synchronously, as used by
+    extract_defines_with_deps_visitor; and the list of the names from
+    all the require and define calls, as produced by
+    extract_all_amd_requires_visitor.
+    """
+
+    from slimit import ast
+
+    f_names = ('require', 'define',)
+    # reserved modules
+    define_wrapped = dict(enumerate(('require', 'exports', 'module',)))
+    reserved = ['module']
+    defines = []
+    requires = []
+
+    # along with the iterators of the nodes being visited, track whether
+    # the defines are still to be found (as like the other visitors,
+    # that does not go into function calls), and the list for the
+    # requires of the define being visited, if any.
+    stack = [(iter(node), True, None)]
+    while stack:
+        children, top, moddeps = stack[-1]
+        for child in children:
+            if not (isinstance(child, ast.FunctionCall) and isinstance(
+                    child.identifier, ast.Identifier)):
+                stack.append((iter(child), top, moddeps))
+                break
+
+            args = child.args
+            f_name = child.identifier.value
+            is_string = bool(args) and isinstance(args[0], ast.String)
+            if moddeps is not None and is_string and f_name == 'require':
+                moddeps.append(to_str(args[0]))
+
+            child_deps = None
+            if top and is_string and f_name == 'define':
+                child_deps = []
+                defines.append([to_str(args[0]), child_deps])
+
+            if not args:
+                continue
+
+            if is_string and f_name == 'require':
+                # only yield names just from require
+                requires.append(to_str(args[0]))
+                continue
+
+            # either require or define
+            standard_amd = ((
+                len(args) >= 2 and
+                isinstance(args[0], ast.Array) and
+                isinstance(args[1], ast.FuncExpr) and
+                f_name in f_names
+            ), 0)
+            # only for define
+            named_define = ((
+                len(args) >= 3 and
+                is_string and
+                isinstance(args[1], ast.Array) and
+                isinstance(args[2], ast.FuncExpr) and
+                f_name == 'define'
+            ), 1)
+
+            for cond, pos in (standard_amd, named_define):
+                if not cond:
+                    continue
+                for i, item in enumerate(args[pos]):
+                    if isinstance(item, ast.String):
+                        result = to_str(item)
+                        if ((result not in reserved) and (
+                                result != define_wrapped.get(i))):
+                            requires.append(result)
+
+            stack.append((iter(child), False, child_deps))
+            break
+        else:
+            stack.pop()
+
+    return [defines, requires]
+
+
+def extract_dependencies(text):
+    """
+    Produce the record of the dependencies for the source text; see
+    extract_dependencies_visitor.
+    """
+
+    return extract_dependencies_visitor(parse(text))
+
+
+# The following are the token based implementations of the above
+# extraction functions.  Rather than constructing the complete source
+# tree, only the tokens are produced and the function calls of interest
+# are matched from them; this is many times faster, especially for the
+# larger sources such as the vendored bundles.  The results should be
+# identical to the tree based implementations for valid sources.
+
+# words that cannot be the identifier for a function call, as these may
+# be followed by a parenthesized expression.
+_RESERVED_WORDS = frozenset([
+    'await', 'break', 'case', 'catch', 'class', 'const', 'continue',
+    'debugger', 'default', 'delete', 'do', 'else', 'enum', 'export',
+    'extends', 'false', 'finally', 'for', 'function', 'if', 'implements',
+    'import', 'in', 'instanceof', 'interface', 'let', 'new', 'null',
+    'package', 'private', 'protected', 'public', 'return', 'static',
+    'super', 'switch', 'this', 'throw', 'true', 'try', 'typeof', 'var',
+    'void', 'while', 'with', 'yield',
+])
+_BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+
+class TokenScanner(object):
+    """
+    The tokens of a source text, along with the location of the closing
+    bracket for every opening bracket, and helpers for matching the
+    expressions from the tokens between them that are of interest to
+    the scan functions.
+
+    Expressions are referenced by a 2-tuple of the index of its first
+    token and the index after its last token.
+    """
+
+    def __init__(self, text):
+        types = self.types = []
+        values = self.values = []
+        # the index of the matching bracket for every bracket.
+        match = self.match = []
+        stack = []
+        for idx, (kind, value) in enumerate(tokenize(text)):
+            types.append(kind)
+            values.append(value)
+            match.append(None)
+            if kind != 'punct':
+                continue
+            if value in ('(', '[', '{'):
+                stack.append(idx)
+            elif value in _BRACKETS:
+                if not stack or values[stack[-1]] != _BRACKETS[value]:
+                    raise SyntaxError("unexpected '%s' in source" % value)
+                start = stack.pop()
+                match[start] = idx
+                match[idx] = start
+        if stack:
+            raise SyntaxError("unclosed '%s' in source" % values[stack[-1]])
+
+    def unwrap(self, start, end):
+        """
+        Strip the parentheses that enclose the entire expression.
+        """
+
+        values, match = self.values, self.match
+        while (end - start > 1 and values[start] == '(' and
+                match[start] == end - 1):
+            start += 1
+            end -= 1
+        return start, end
+
+    def split(self, start, end):
+        """
+        Split the tokens by the commas that are not inside brackets,
+        producing a list of expressions.  A trailing comma does not
+        produce an expression.
+        """
+
+        values, match = self.values, self.match
+        results = []
+        idx = first = start
+        while idx < end:
+            value = values[idx]
+            if value in ('(', '[', '{'):
+                idx = match[idx]
+            elif value == ',':
+                results.append((first, idx))
+                first = idx + 1
+            idx += 1
+        if first < end:
+            results.append((first, end))
+        return results
+
+    def arguments(self, idx):
+        """
+        Produce the list of arguments for the function call with its
+        opening parenthesis at idx.
+        """
+
+        return [self.unwrap(*arg) for arg in self.split(
+            idx + 1, self.match[idx])]
+
+    def callee(self, idx):
+        """
+        For the opening parenthesis at idx, if it is of a function call
+        with its callee being an identifier, return the name of that
+        identifier, otherwise None.
+        """
+
+        types, values = self.types, self.values
+        prev = idx - 1
+        if prev < 0:
+            return None
+        if types[prev] == 'name':
+            if values[prev] in _RESERVED_WORDS or (prev and values[
+                    prev - 1] in ('.', 'function', 'new')):
+                # not a call, or not a call to just an identifier.
+                return None
+            return values[prev]
+        if values[prev] == ')':
+            # the identifier may be enclosed in parentheses.
+            start = self.match[prev]
+            if self.is_call(start):
+                return None
+            start, end = self.unwrap(start, idx)
+            if end - start == 1:
+                return self.callee(end)
+        return None
+
+    def is_call(self, idx):
+        """
+        Whether the opening parenthesis at idx is of a function call.
+        """
+
+        types, values = self.types, self.values
+        prev = idx - 1
+        if prev < 0 or types[prev] not in ('name', 'punct'):
+            return False
+        if types[prev] == 'name':
+            return values[prev] not in _RESERVED_WORDS
+        return values[prev] in (')', ']')
+
+    def is_string(self, start, end):
+        return end - start == 1 and self.types[start] == 'string'
+
+    def is_array(self, start, end):
+        return self.values[start] == '[' and self.match[start] == end - 1
+
+    def is_function(self, start, end):
+        types, values, match = self.types, self.values, self.match
+        if not (types[start] == 'name' and values[start] == 'function'):
+            return False
+        idx = start + 1
+        if idx < end and types[idx] == 'name':
+            idx += 1
+        if idx < end and values[idx] == '(':
+            idx = match[idx] + 1
+        return idx < end and values[idx] == '{' and match[idx] == end - 1
+
+    def to_str(self, start, end):
+        return strip_slashes(strip_quotes(self.values[start]))
+
+
+def scan_function_argument(text, f_name, f_argn):
+    """
+    The token based implementation of extract_function_argument, for
+    the extraction of string literal arguments only.
+    """
+
+    scanner = TokenScanner(text)
+    values = scanner.values
+    results = []
+    idx = 0
+    while idx < len(values):
+        if values[idx] != '(' or scanner.callee(idx) is None:
+            idx += 1
+            continue
+        if scanner.callee(idx) == f_name:
+            args = scanner.arguments(idx)
+            if f_argn < len(args) and scanner.is_string(*args[f_argn]):
+                results.append(scanner.to_str(*args[f_argn]))
+        # like the tree based version, do not go into function calls.
+        idx = scanner.match[idx] + 1
+    return results
+
+
+def scan_defines(text):
+    """
+    The token based implementation of extract_defines.
+    """
+
+    return scan_function_argument(text, 'define', 0)
+
+
+def scan_requires(text):
+    """
+    The token based implementation of extract_requires.
+    """
+
+    return scan_function_argument(text, 'require', 0)
+
+
+def scan_all_amd_requires(text):
+    """
+    The token based implementation of extract_all_amd_requires.
+    """
+
+    f_names = ('require', 'define',)
+    # reserved modules
+    define_wrapped = dict(enumerate(('require', 'exports', 'module',)))
+    reserved = ['module']
+
+    scanner = TokenScanner(text)
+    values = scanner.values
+    is_array = scanner.is_array
+    is_function = scanner.is_function
+    is_string = scanner.is_string
+    results = []
+    idx = 0
+
+    while idx < len(values):
+        if values[idx] != '(':
+            idx += 1
+            continue
+        name = scanner.callee(idx)
+        if name not in f_names:
+            idx += 1
+            continue
+
+        args = scanner.arguments(idx)
+        if not args:
+            idx = scanner.match[idx] + 1
+            continue
+
+        if name == 'require' and is_string(*args[0]):
+            # only yield names just from require, and the tree based
+            # version does not go further into this call.
+            results.append(scanner.to_str(*args[0]))
+            idx = scanner.match[idx] + 1
+            continue
+
+        standard_amd = ((
+            len(args) >= 2 and
+            is_array(*args[0]) and
+            is_function(*args[1])
+        ), 0)
+        named_define = ((
+            len(args) >= 3 and
+            is_string(*args[0]) and
+            is_array(*args[1]) and
+            is_function(*args[2]) and
+            name == 'define'
+        ), 1)
+
+        for cond, pos in (standard_amd, named_define):
+            if not cond:
+                continue
+            start, end = args[pos]
+            for i, item in enumerate(scanner.split(start + 1, end - 1)):
+                item = scanner.unwrap(*item)
+                if is_string(*item):
+                    result = scanner.to_str(*item)
+                    if ((result not in reserved) and (
+                            result != define_wrapped.get(i))):
+                        results.append(result)
+
+        # continue with the tokens inside this call.
+        idx += 1
+
+    return results
+
+
+# the available implementations for the extraction of all the AMD and
+# CommonJS requires from a source text.
+amd_requires_extractors = {
+    'ast': extract_all_amd_requires,
+    'scan': scan_all_amd_requires,
+}
+
+# the implementations that produce the complete record of dependencies
+# in place of the above, for the engines that support it; the requires
+# are the second item of the record.
+dependency_extractors = {
+    'ast': extract_dependencies,
+}
+
+
+def _process_path(path, f):
+    """
+    Process the path with f, returning a 2-tuple of the result and the
+    arguments for the error log message, one of which will be None.
     """
 
     try:
         with open(path) as fd:
             text = fd.read()
-        return f(text)
+        return f(text), None
     except (OSError, IOError) as e:
-        logger.error("failed to read '%s': %s: %s", path, type(e).__name__, e)
+        return None, (
+            "failed to read '%s': %s: %s", path, type(e).__name__, str(e))
     except SyntaxError as e:
-        logger.error("syntax error in '%s': %s", path, e)
+        return None, ("syntax error in '%s': %s", path, str(e))
+
+
+def _process_path_to_list(args):
+    # the worker function for process_paths; the result is turned into
+    # a list as generators cannot be returned from another process.
+    result, error = _process_path(*args)
+    return (None if result is None else list(result)), error
+
+
+def process_path(path, f):
+    """
+    Take the path and process it through one of the above functions
+    """
+
+    result, error = _process_path(path, f)
+    if error:
+        logger.error(*error)
+    return result
+
+
+def process_paths(paths, f, processes=None):
+    """
+    Take a list of paths and process them through one of the above
+    functions, returning a list of results in the same order as the
+    paths provided, with the result for each of the path turned into a
+    list, or None if the processing failed.
+
+    If processes is greater than 1, the paths will be processed by a
+    pool of that many processes; f must be a function that can be
+    pickled (i.e. defined at the module level).  A processes value of 0
+    will create a pool with as many processes as there are CPUs.  The
+    processes are spawned rather than forked if there are other threads
+    running (e.g. when multiple targets are built at once), as forking
+    then could leave the locks held by those threads locked for good in
+    the children; where that is not supported, the paths are processed
+    in this process instead.
+    """
+
+    import multiprocessing
+    import threading
+
+    args = [(path, f) for path in paths]
+    if processes == 0:
+        processes = multiprocessing.cpu_count()
+    Pool = None
+    if processes and processes > 1 and len(args) > 1:
+        Pool = multiprocessing.Pool
+        if threading.active_count() > 1:
+            get_context = getattr(multiprocessing, 'get_context', None)
+            Pool = get_context('spawn').Pool if get_context else None
+    if Pool:
+        pool = Pool(min(processes, len(args)))
+        try:
+            results = pool.map(_process_path_to_list, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_process_path_to_list(arg) for arg in args]
+
+    # errors are logged here as the handlers are not available in the
+    # child processes.
+    for result, error in results:
+        if error:
+            logger.error(*error)
+    return [result for result, error in results]
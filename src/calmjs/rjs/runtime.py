@@ -3,14 +3,73 @@
 The calmjs runtime collection
 """
 
+import logging
+import shutil
+from argparse import ArgumentTypeError
+from os.path import realpath
+from tempfile import mkdtemp
+
 from calmjs.runtime import SourcePackageToolchainRuntime
+from calmjs.toolchain import BUILD_DIR
+from calmjs.toolchain import EXPORT_TARGET
+from calmjs.toolchain import EXPORT_TARGET_OVERWRITE
+from calmjs.toolchain import SOURCE_PACKAGE_NAMES
 
 from calmjs.rjs.dist import extras_calmjs_methods
 from calmjs.rjs.dist import source_map_methods_list
 from calmjs.rjs.dist import calmjs_module_registry_methods
+from calmjs.rjs.dist import MemoizedWorkingSet
+from calmjs.rjs.cli import build_targets
 from calmjs.rjs.cli import create_spec
 from calmjs.rjs.cli import default_toolchain
+from calmjs.rjs.requirejs import ARTIFACT_DEFINES
+from calmjs.rjs.requirejs import DEFINES_MANIFEST
+from calmjs.rjs.requirejs import amd_requires_extractors
+from calmjs.rjs.minify import minifiers
+from calmjs.rjs.toolchain import CACHE_DIR
+from calmjs.rjs.toolchain import EXTRACT_ENGINE
+from calmjs.rjs.toolchain import HASHED_ARTIFACTS
+from calmjs.rjs.toolchain import INCREMENTAL
+from calmjs.rjs.toolchain import MINIFY
+from calmjs.rjs.toolchain import MODULE_GRAPH
+from calmjs.rjs.toolchain import PARSE_WORKERS
+from calmjs.rjs.toolchain import PYTHON_LINKER
+from calmjs.rjs.toolchain import RJS_WORKER
 from calmjs.rjs.toolchain import STUB_MISSING_WITH_EMPTY
+from calmjs.rjs.toolchain import TRACE
+from calmjs.rjs.watch import SpecWatcher
+from calmjs.rjs.watch import spec_factory_from
+
+logger = logging.getLogger(__name__)
+
+
+def parse_target(value):
+    """
+    Parse the value for the --target argument into the export target
+    and the list of package names.
+    """
+
+    export_target, sep, package_names = value.partition('=')
+    package_names = [name for name in package_names.split(',') if name]
+    if not (export_target and sep):
+        raise ArgumentTypeError(
+            "'%s' is not in the form EXPORT_TARGET=PACKAGE[,PACKAGE...]" %
+            value)
+    return export_target, package_names
+
+
+def parse_bundle(value):
+    """
+    Parse the value for the --bundle argument into the bundle name and
+    the list of entry module names.
+    """
+
+    name, sep, modnames = value.partition('=')
+    modnames = [modname for modname in modnames.split(',') if modname]
+    if not (name and sep and modnames):
+        raise ArgumentTypeError(
+            "'%s' is not in the form NAME=MODULE[,MODULE...]" % value)
+    return name, modnames
 
 
 class RJSRuntime(SourcePackageToolchainRuntime):
@@ -98,6 +157,143 @@ class RJSRuntime(SourcePackageToolchainRuntime):
             help='disable indentation of transpile sources',
         )
 
+        argparser.add_argument(
+            '--cache-dir', default=None,
+            dest=CACHE_DIR,
+            help='directory for persisting the dependency information '
+                 'parsed from the compiled sources, so that unchanged '
+                 'sources are not parsed again in subsequent builds',
+        )
+
+        argparser.add_argument(
+            '--parse-workers', default=None, type=int,
+            dest=PARSE_WORKERS, metavar='N',
+            help='the number of processes to use for parsing the compiled '
+                 'sources; 0 to use the number of available CPUs; default is '
+                 'to parse in the current process',
+        )
+
+        argparser.add_argument(
+            '--extract-engine', default=None,
+            dest=EXTRACT_ENGINE,
+            choices=sorted(amd_requires_extractors.keys()),
+            help='the implementation for extracting the required module '
+                 'names from the compiled sources; default: ast',
+        )
+
+        argparser.add_argument(
+            '--incremental',
+            dest=INCREMENTAL, action='store_true',
+            help='only rebuild what had changed since the previous build '
+                 'done in the same build directory; requires --build-dir',
+        )
+
+        argparser.add_argument(
+            '--rjs-worker',
+            dest=RJS_WORKER, action='store_true',
+            help='run r.js in a persistent Node.js process, so that '
+                 'subsequent builds (e.g. with --watch) will not pay for '
+                 'its startup again',
+        )
+
+        argparser.add_argument(
+            '--python-linker',
+            dest=PYTHON_LINKER, action='store_true',
+            help='link the modules in the build directory in Python in '
+                 'place of r.js, for fast unoptimized development builds; '
+                 'r.js is still used for builds that need its features',
+        )
+
+        argparser.add_argument(
+            '--minify', default=None, nargs='?', const='slimit',
+            dest=MINIFY, metavar='ENGINE',
+            choices=sorted(minifiers.keys()),
+            help='minify every module on its own before linking, across '
+                 'the --parse-workers and cached in the --cache-dir, '
+                 'such that only the changed modules are minified again; '
+                 'default engine: slimit',
+        )
+
+        argparser.add_argument(
+            '--hashed-artifacts', default=None, nargs='?', const=True,
+            dest=HASHED_ARTIFACTS, metavar='PATH',
+            help='also write the export target and the bundles to file '
+                 'names with the digest of their contents, precompressed '
+                 'with gzip (and brotli if available), with the manifest '
+                 'of them written to PATH, or next to the export target '
+                 'if PATH is omitted',
+        )
+
+        argparser.add_argument(
+            '--trace', default=None, nargs='?', const=True,
+            dest=TRACE, metavar='PATH',
+            help='write the time spent by the phases of the build and '
+                 'for every module as a Chrome trace event file to PATH, '
+                 'or next to the export target if PATH is omitted, and '
+                 'log the slowest modules',
+        )
+
+        argparser.add_argument(
+            '--bundle', default=None,
+            dest='bundles', action='append', type=parse_bundle,
+            metavar='NAME=MODULE[,MODULE...]',
+            help='split the modules reachable from only the listed entry '
+                 'modules into a separate bundle file named after the '
+                 'export target with NAME inserted before its extension, '
+                 'with the export target becoming the common layer; may '
+                 'be specified multiple times',
+        )
+
+        argparser.add_argument(
+            '--module-graph', default=None, nargs='?', const=True,
+            dest=MODULE_GRAPH, metavar='PATH',
+            help='write the graph of the modules in the build and the '
+                 'modules they require as a SQLite database to PATH, or '
+                 'inside the build directory if PATH is omitted',
+        )
+
+        argparser.add_argument(
+            '--defines-manifest',
+            dest=DEFINES_MANIFEST, action='store_true',
+            help='write the manifest of the modules defined in the export '
+                 'target next to it, such that the tests run against it '
+                 'as an artifact will not need to parse it',
+        )
+
+        argparser.add_argument(
+            '--skip-artifact-defines', default=None,
+            dest=ARTIFACT_DEFINES, action='store_const', const=[],
+            help='do not extract the modules defined in the artifacts '
+                 'for loading before the tests are run',
+        )
+
+        argparser.add_argument(
+            '--target', default=None,
+            dest='targets', action='append', type=parse_target,
+            metavar='EXPORT_TARGET=PACKAGE[,PACKAGE...]',
+            help='build the export target from the comma separated list '
+                 'of packages, in addition to the packages specified as '
+                 'the positional arguments; may be specified multiple '
+                 'times to build multiple targets sharing the build '
+                 'directory, with the r.js links done concurrently',
+        )
+
+        argparser.add_argument(
+            '--link-jobs', default=None, type=int,
+            dest='link_jobs', metavar='N',
+            help='the maximum number of concurrent r.js links when '
+                 'building multiple targets; default is the number of '
+                 'available CPUs',
+        )
+
+        argparser.add_argument(
+            '--watch',
+            dest='watch', action='store_true',
+            help='keep running after the build, and rebuild incrementally '
+                 'whenever the sources change; modules added to the '
+                 'packages will require a restart to be picked up',
+        )
+
     def create_spec(
             self, source_package_names=(), export_target=None,
             stub_missing_with_empty=False,
@@ -107,6 +303,20 @@ class RJSRuntime(SourcePackageToolchainRuntime):
             source_registry_method='all',
             source_map_method='all', bundle_map_method='all',
             transpile_no_indent=False,
+            cache_dir=None,
+            parse_workers=None,
+            extract_engine=None,
+            incremental=False,
+            rjs_worker=False,
+            python_linker=False,
+            minify=None,
+            hashed_artifacts=None,
+            trace=None,
+            artifact_defines=None,
+            defines_manifest=False,
+            module_graph=None,
+            bundles=None,
+            working_set=None,
             toolchain=None, **kwargs):
         """
         Accept all arguments, but also the explicit set of arguments
@@ -126,7 +336,80 @@ class RJSRuntime(SourcePackageToolchainRuntime):
             source_map_method=source_map_method,
             bundle_map_method=bundle_map_method,
             transpile_no_indent=transpile_no_indent,
+            cache_dir=cache_dir,
+            parse_workers=parse_workers,
+            extract_engine=extract_engine,
+            incremental=incremental,
+            rjs_worker=rjs_worker,
+            python_linker=python_linker,
+            minify=minify,
+            hashed_artifacts=hashed_artifacts,
+            trace=trace,
+            artifact_defines=artifact_defines,
+            defines_manifest=defines_manifest,
+            module_graph=module_graph,
+            bundles=dict(bundles) if bundles else None,
+            working_set=working_set,
+        )
+
+    def run_targets(self, targets, link_jobs=None, **kwargs):
+        """
+        Build all the targets, with the source package names specified
+        included for every target.  The packages are resolved through a
+        MemoizedWorkingSet shared by the specs of all the targets.
+        """
+
+        package_names = list(kwargs.pop(SOURCE_PACKAGE_NAMES, None) or [])
+        kwargs.pop(EXPORT_TARGET, None)
+        kwargs['working_set'] = MemoizedWorkingSet()
+        specs = [
+            self.kwargs_to_spec(**dict(
+                kwargs, export_target=export_target,
+                source_package_names=package_names + target_package_names,
+            )) for export_target, target_package_names in targets
+        ]
+        return build_targets(
+            specs, build_dir=kwargs.get(BUILD_DIR), link_jobs=link_jobs,
+            toolchain=self.toolchain,
         )
 
+    def run(self, argparser=None, watch=False, targets=None, link_jobs=None,
+            **kwargs):
+        """
+        Build once, unless watch is specified, where the build will be
+        redone incrementally every time the sources changed until the
+        process is interrupted.  If targets are specified, those are
+        built instead, with a list of the specs returned.
+        """
+
+        if targets:
+            if watch:
+                logger.error('--watch cannot be used with --target')
+                return None
+            return self.run_targets(targets, link_jobs=link_jobs, **kwargs)
+
+        if not watch:
+            return super(RJSRuntime, self).run(argparser=argparser, **kwargs)
+
+        kwargs[INCREMENTAL] = True
+        tempdir = None
+        if not kwargs.get(BUILD_DIR):
+            # the build directory must persist across the builds.
+            tempdir = kwargs[BUILD_DIR] = realpath(mkdtemp())
+
+        # the subsequent builds must not prompt for the overwrite of the
+        # export target produced by the previous build.
+        rebuild_kwargs = dict(kwargs)
+        rebuild_kwargs[EXPORT_TARGET_OVERWRITE] = True
+
+        try:
+            spec = self.kwargs_to_spec(**kwargs)
+            return SpecWatcher(self.toolchain, spec_factory_from(
+                spec, lambda s: self.prepare_spec(s, **rebuild_kwargs)),
+            ).run()
+        finally:
+            if tempdir:
+                shutil.rmtree(tempdir)
+
 
 default = RJSRuntime(default_toolchain)
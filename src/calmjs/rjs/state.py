@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Build state tracking for incremental builds.
+
+The state is a manifest persisted inside the build directory, recording
+for every step that produced something in there (e.g. the transpilation
+of a source file into its target) the files it was derived from, the
+files it produced, and optionally the result of that step.  A later
+build using the same build directory can then skip the steps where none
+of these files have changed.
+
+Files are first compared by their modification time and size; only
+where those differ will the digest of the contents be compared, such
+that a file being rewritten with identical contents is not considered
+to be changed.
+"""
+
+import errno
+import json
+import logging
+import os
+import threading
+from os.path import isdir
+from os.path import join
+
+from calmjs.rjs.cache import text_digest
+
+logger = logging.getLogger(__name__)
+
+# increment this when the records are no longer compatible, or when the
+# outputs produced by this package for identical inputs had changed.
+BUILD_STATE_VERSION = 1
+
+
+def file_stamp(path):
+    """
+    Return the [mtime, size] for the path, or None if not a file.
+    """
+
+    try:
+        st = os.stat(path)
+    except (OSError, IOError):
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def file_digest(path):
+    try:
+        with open(path, 'rb') as fd:
+            return text_digest(fd.read())
+    except (OSError, IOError):
+        return None
+
+
+def walk_files(path):
+    """
+    Return a sorted list of all the files at path, which is just the
+    path itself if that is a file.
+    """
+
+    if not isdir(path):
+        return [path]
+    return sorted(
+        join(root, name) for root, dirs, files in os.walk(path)
+        for name in files
+    )
+
+
+class BuildState(object):
+    """
+    The records of the steps done in a build directory.
+
+    Each record is stored at a key that uniquely identify the step, and
+    is a dict with the following keys:
+
+    sources
+        A mapping of the paths of the input files to their [mtime, size,
+        digest].
+    targets
+        A mapping of the paths of the files produced to their [mtime,
+        size].
+    extra
+        Any other JSON serializable value that affects the outcome, such
+        as the options used; the step must be done again if changed.
+    result
+        The JSON serializable result produced by the step, if any.
+    """
+
+    def __init__(self, path, records=None, parent=None):
+        """
+        Arguments:
+
+        path
+            The path to where the state will be saved; may be None for
+            a state that will not be saved.
+        records
+            The initial records.
+        parent
+            The state this was forked from.
+        """
+
+        self.path = path
+        self.records = {} if records is None else records
+        self.parent = parent
+        self.lock = parent.lock if parent else threading.RLock()
+        # keys of records that were verified or updated in this build.
+        self.touched = set()
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load the state from path; an empty state will be returned if it
+        cannot be read or was written by an incompatible version.
+        """
+
+        try:
+            with open(path) as fd:
+                data = json.load(fd)
+        except (OSError, IOError) as e:
+            if e.errno != errno.ENOENT:
+                logger.warning(
+                    "failed to read build state '%s': %s: %s",
+                    path, type(e).__name__, e,
+                )
+            return cls(path)
+        except ValueError:
+            logger.warning("ignoring corrupted build state '%s'", path)
+            return cls(path)
+
+        if not (isinstance(data, dict) and
+                data.get('version') == BUILD_STATE_VERSION):
+            logger.debug("ignoring incompatible build state '%s'", path)
+            return cls(path)
+        return cls(path, data.get('records', {}))
+
+    def fork(self):
+        """
+        Return a new state sharing the records with this one, but with
+        the touched records tracked separately, for the builds of
+        multiple targets that share a build directory.  The forked
+        state will save through this one, and will not prune, as that
+        should only be done by this one once all the builds are done.
+        """
+
+        return type(self)(self.path, self.records, parent=self)
+
+    def _touch(self, key):
+        self.touched.add(key)
+        if self.parent:
+            self.parent._touch(key)
+
+    def save(self):
+        if self.parent:
+            return self.parent.save()
+        if self.path is None:
+            return
+        data = {
+            'version': BUILD_STATE_VERSION,
+            'records': self.records,
+        }
+        try:
+            with self.lock, open(self.path, 'w') as fd:
+                json.dump(data, fd, indent=1, sort_keys=True)
+        except (OSError, IOError) as e:
+            logger.warning(
+                "failed to write build state '%s': %s: %s",
+                self.path, type(e).__name__, e,
+            )
+
+    def prune(self):
+        """
+        Remove the records that were not touched in this build.
+        """
+
+        if self.parent:
+            return
+        with self.lock:
+            for key in set(self.records) - self.touched:
+                del self.records[key]
+
+    def is_current(self, key, sources, targets=(), extra=None):
+        """
+        Return True if there is a record at key that was produced by the
+        provided sources and targets with identical contents and extra
+        value.
+        """
+
+        record = self.records.get(key)
+        if (not record or record.get('extra') != extra or
+                sorted(record['sources']) != sorted(sources) or
+                sorted(record['targets']) != sorted(targets)):
+            return False
+
+        for path in targets:
+            if file_stamp(path) != record['targets'][path]:
+                return False
+
+        for path in sources:
+            recorded = record['sources'][path]
+            stamp = file_stamp(path)
+            if stamp == recorded[:2]:
+                continue
+            if stamp is None or file_digest(path) != recorded[2]:
+                return False
+            # same contents; avoid the digest for subsequent checks.
+            recorded[:2] = stamp
+
+        self._touch(key)
+        return True
+
+    def result(self, key):
+        """
+        Return the result recorded at key, or None if there is none.
+        """
+
+        return self.records.get(key, {}).get('result')
+
+    def update(self, key, sources, targets=(), extra=None, result=None):
+        """
+        Record the step at key as done with the provided sources and
+        targets in their current state.
+        """
+
+        record = {
+            'sources': {
+                path: (file_stamp(path) or [None, None]) + [file_digest(path)]
+                for path in sources
+            },
+            'targets': {path: file_stamp(path) for path in targets},
+            'extra': extra,
+            'result': result,
+        }
+        with self.lock:
+            self.records[key] = record
+        self._touch(key)
+
+    def touched_paths(self):
+        """
+        Return a sorted list of all the source and target paths of the
+        records touched in this build.
+        """
+
+        paths = set()
+        for key in self.touched:
+            record = self.records[key]
+            paths.update(record['sources'])
+            paths.update(record['targets'])
+        return sorted(paths)
@@ -0,0 +1,794 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the various steps done by the RJSToolchain.
+
+These are meant to be run manually to measure the effects of changes,
+through ``python -m calmjs.rjs.testing.benchmark``.  The pipeline
+benchmark works offline on a synthetic set of packages and module
+registry that is generated into a temporary directory, such that the
+results are reproducible for any given number and size of modules.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import codecs
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from functools import partial
+from io import StringIO
+from os.path import join
+from tempfile import mkdtemp
+
+from pkg_resources import WorkingSet
+
+from calmjs.dist import EXTRAS_CALMJS_JSON
+from calmjs.module import ModuleRegistry
+from calmjs.registry import get
+from calmjs.toolchain import Spec
+from calmjs.toolchain import ARTIFACT_PATHS
+from calmjs.vlqsm import SourceWriter
+from slimit import ast
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+try:
+    from calmjs.dev.karma import KARMA_CONFIG
+except ImportError:  # pragma: no cover
+    KARMA_CONFIG = None
+
+from calmjs.rjs.cli import create_spec
+from calmjs.rjs.dist import MemoizedWorkingSet
+from calmjs.rjs.dev import karma_requirejs
+from calmjs.rjs.ecma import parse
+from calmjs.rjs.requirejs import extract_all_amd_requires_visitor
+from calmjs.rjs.requirejs import extract_function_argument_visitor
+from calmjs.rjs.requirejs import to_str
+from calmjs.rjs.toolchain import RJSToolchain
+from calmjs.rjs.toolchain import _null_transpiler
+from calmjs.rjs.toolchain import _transpile_generic_to_umd_node_amd_compat_rjs
+from calmjs.rjs.umdjs import UMD_NODE_AMD_HEADER
+from calmjs.rjs.umdjs import UMD_NODE_AMD_FOOTER
+from calmjs.rjs.umdjs import UMD_NODE_AMD_INDENT
+
+KB = 1 << 10
+MB = 1 << 20
+
+# the phases measured by the pipeline benchmark, in order.
+PHASES = (
+    'create_spec', 'transpile', 'bundle', 'plugin', 'assemble', 'karma')
+DEFAULT_MODULE_COUNTS = (10, 100, 1000)
+# the named presets of the module counts and the module size for the
+# pipeline benchmark; the scaling one goes up to the sizes of the large
+# projects, and the large one has every module span megabytes.
+PIPELINE_PRESETS = {
+    'default': (DEFAULT_MODULE_COUNTS, 0),
+    'scaling': ((10, 100, 1000, 10000), 0),
+    'large': ((10, 100), 2 * MB),
+}
+DEFAULT_VISIT_DEPTHS = (10, 100, 1000)
+# the modules that should only be imported once they are needed.
+STARTUP_DEFERRED_MODULES = ('slimit', 'ply', 'multiprocessing', 'ctypes')
+
+STARTUP_SCRIPT = '''
+import json, sys, time
+t = time.time()
+import %(module)s
+t = time.time() - t
+from calmjs.rjs.cli import default_toolchain
+print(json.dumps({
+    'time': t,
+    'modules': sorted(set(
+        name.split('.')[0] for name in sys.modules
+        if name.split('.')[0] in %(deferred)r
+    )),
+    'registry': default_toolchain._loader_plugin_registry is not None,
+}))
+'''
+# the number of modules declared by each of the synthetic packages.
+MODULES_PER_PACKAGE = 100
+BENCHMARK_REGISTRY_NAME = 'calmjs.rjs.testing.benchmark'
+
+SOURCE_TEMPLATE = """\
+var mod%(i)d = require('example/mod%(i)d');
+
+exports.func%(i)d = function(value) {
+    // apply mod%(i)d to the value
+    if (value) {
+        return mod%(i)d.apply(value, %(i)d);
+    }
+
+    return null;
+};
+"""
+
+# the body for padding the synthetic modules to the requested size.
+FILLER_TEMPLATE = """\
+function func%(i)d(value) {
+    // scale the value by %(i)d
+    if (value) {
+        return value * %(i)d;
+    }
+
+    return null;
+}
+"""
+
+
+# The original line based implementations of the transpilers, as the
+# baseline for the block based implementations.
+
+def line_null_transpiler(spec, reader, writer):
+    line = reader.readline()
+    while line:
+        writer.write(line)
+        line = reader.readline()
+
+
+def line_umd_transpiler(spec, reader, writer):
+    level = UMD_NODE_AMD_INDENT
+    indent = '' if spec.get('transpile_no_indent') else ' ' * level
+    _states = {
+        'pad': 3,  # length of the header to track
+    }
+
+    def write_line(line):
+        contents = line.strip()
+        if _states['pad']:
+            if not contents:
+                writer.discard(line)
+                _states['pad'] -= 1
+                return
+            _states['pad'] = 0
+        if contents:
+            writer.write_padding(indent)
+        writer.write(line)
+
+    line = reader.readline()
+    if line.strip() in ("'use strict';", '"use strict";'):
+        header_lines = iter(UMD_NODE_AMD_HEADER.splitlines(True))
+        writer.write_padding(next(header_lines))
+        writer.write_padding(next(header_lines))
+        writer.write_padding(indent)
+        writer.write(line)
+        writer.write_padding(next(header_lines))
+    else:
+        writer.write_padding(UMD_NODE_AMD_HEADER)
+        write_line(line)
+
+    while line:
+        line = reader.readline()
+        write_line(line)
+
+    writer.write_padding(UMD_NODE_AMD_FOOTER)
+
+
+# The original recursive implementations of the visitors, as the
+# baseline for the iterative implementations.
+
+def recursive_function_argument_visitor(node, f_name, f_argn, f_argt):
+    return extract_function_argument_visitor(
+        node, f_name, f_argn, f_argt,
+        visitor=recursive_function_argument_visitor,
+    )
+
+
+def recursive_all_amd_requires_visitor(node):
+    f_names = ('require', 'define',)
+    define_wrapped = dict(enumerate(('require', 'exports', 'module',)))
+    reserved = ['module']
+
+    def visit(node):
+        for child in node:
+            if isinstance(child, ast.FunctionCall) and isinstance(
+                    child.identifier, ast.Identifier):
+                if not child.args:
+                    continue
+
+                args = child.args
+                standard_amd = ((
+                    len(child.args) >= 2 and
+                    isinstance(args[0], ast.Array) and
+                    isinstance(args[1], ast.FuncExpr) and
+                    child.identifier.value in f_names
+                ), 0)
+                named_define = ((
+                    len(child.args) >= 3 and
+                    isinstance(args[0], ast.String) and
+                    isinstance(args[1], ast.Array) and
+                    isinstance(args[2], ast.FuncExpr) and
+                    child.identifier.value == 'define'
+                ), 1)
+
+                if (isinstance(args[0], ast.String) and
+                        child.identifier.value == 'require'):
+                    yield to_str(args[0])
+                    continue
+
+                for cond, pos in (standard_amd, named_define):
+                    if not cond:
+                        continue
+                    for i, item in enumerate(child.args[pos]):
+                        if isinstance(item, ast.String):
+                            result = to_str(item)
+                            if ((result not in reserved) and (
+                                    result != define_wrapped.get(i))):
+                                yield result
+
+            for value in visit(child):
+                yield value
+
+    return visit(node)
+
+
+def generate_nested_source(depth):
+    """
+    Generate a JavaScript source of function expressions nested to the
+    specified depth, each defining a module and requiring another, like
+    the vendored bundles wrapped in layers of closures.
+    """
+
+    opening = (
+        "(function(root) {\n"
+        "    define('nested/mod%(i)d', ['nested/dep%(i)d'], function() {});\n"
+        "    var dep%(i)d = require('nested/dep%(i)d');\n"
+    )
+    return ''.join(opening % {'i': i} for i in range(depth)) + (
+        '}(this));\n' * depth)
+
+
+def generate_source(size, template=SOURCE_TEMPLATE):
+    """
+    Generate a JavaScript source of at least size characters from the
+    repetition of the template.
+    """
+
+    chunks = []
+    length = 0
+    i = 0
+    while length < size:
+        chunk = template % {'i': i}
+        chunks.append(chunk)
+        length += len(chunk)
+        i += 1
+    return ''.join(chunks)
+
+
+def parse_size(value):
+    """
+    Parse a size in bytes, with an optional k or M suffix.
+    """
+
+    match = re.match(r'^(\d+(?:\.\d+)?)([kKmM]?)$', value.strip())
+    if not match:
+        raise ValueError('invalid size: %r' % value)
+    number, unit = match.groups()
+    return int(float(number) * {'': 1, 'k': KB, 'm': MB}[unit.lower()])
+
+
+def best_time(f, repeat=3):
+    """
+    Return the lowest wall time in seconds of the repeated calls to f.
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def bench_transpile(size=4 * MB, repeat=3):
+    """
+    Compare the line based transpilers against the block based ones
+    with a generated source file of size characters, read the same way
+    as done by the toolchain.
+
+    Returns a list of 3-tuples of the name of the transpiler, the time
+    taken by the line based and the block based implementations.
+    """
+
+    tmpdir = mkdtemp()
+    try:
+        source = join(tmpdir, 'source.js')
+        with open(source, 'wb') as fd:
+            fd.write(generate_source(size).encode('utf-8'))
+        return _bench_transpile(source, repeat)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def _bench_transpile(source, repeat):
+    results = []
+    for name, line, block in (
+            ('null', line_null_transpiler, _null_transpiler),
+            ('umd', line_umd_transpiler,
+                _transpile_generic_to_umd_node_amd_compat_rjs)):
+        def run(transpiler):
+            writer = SourceWriter(StringIO())
+            with codecs.open(source, 'r', encoding='utf-8') as reader:
+                transpiler(Spec(), reader, writer)
+            return writer
+
+        expected, result = run(line), run(block)
+        if (expected.getvalue() != result.getvalue() or
+                expected.mappings != result.mappings):
+            raise AssertionError(
+                '%s transpilers produced different outputs' % name)
+        results.append((
+            name,
+            best_time(lambda: run(line), repeat),
+            best_time(lambda: run(block), repeat),
+        ))
+    return results
+
+
+def bench_visit(depth=1000, repeat=3):
+    """
+    Compare the recursive visitors against the iterative ones with a
+    tree parsed from a source nested to the specified depth.
+
+    Returns a list of 3-tuples of the name of the visitor, the time
+    taken by the recursive and the iterative implementations, where the
+    time for the recursive implementation will be None if it failed by
+    exceeding the recursion limit.
+    """
+
+    tree = parse(generate_nested_source(depth))
+    results = []
+    define_args = dict(f_name='define', f_argn=0, f_argt=ast.String)
+    for name, recursive, iterative in (
+            ('define',
+                partial(recursive_function_argument_visitor, **define_args),
+                partial(extract_function_argument_visitor, **define_args)),
+            ('amd_requires',
+                recursive_all_amd_requires_visitor,
+                extract_all_amd_requires_visitor)):
+
+        def run(visitor):
+            return list(visitor(tree))
+
+        expected = run(iterative)
+        try:
+            if run(recursive) != expected:
+                raise AssertionError(
+                    '%s visitors produced different outputs' % name)
+        except RuntimeError:
+            # the recursion limit was exceeded.
+            recursive_time = None
+        else:
+            recursive_time = best_time(lambda: run(recursive), repeat)
+        results.append((
+            name, recursive_time, best_time(lambda: run(iterative), repeat)))
+    return results
+
+
+class SyntheticEnvironment(object):
+    """
+    A synthetic set of packages declaring their modules through a
+    module registry, generated into a temporary directory.
+
+    The modules are spread across packages of MODULES_PER_PACKAGE
+    modules each, with an application package that requires all of
+    them.  Every module requires up to two of the modules before it,
+    and every fifth module is already an AMD module.  Every tenth module
+    is accompanied by a text resource for the text loader plugin, and
+    every twentieth by a vendored source declared for bundling by the
+    application package under its node_modules extras.  An
+    artifact defining all the modules is also produced for the karma
+    phase.
+
+    Upon entering, the registry is registered with the root registry,
+    which is undone upon exit.  The packages are only available through
+    the working_set of the environment, which should be provided to the
+    functions that look them up.
+    """
+
+    app_name = 'benchapp'
+
+    def __init__(self, modules, size=0, root=None):
+        """
+        Arguments:
+
+        modules
+            The number of modules to generate.
+        size
+            The minimum size of each module source in bytes.
+        root
+            The directory to generate into; defaults to a temporary
+            directory that is removed upon exit.
+        """
+
+        self.modules = modules
+        self.size = size
+        self.root = root
+        self.registry_name = BENCHMARK_REGISTRY_NAME
+        self._tmpdir = None
+        self._restore = None
+
+    def _write(self, path, text):
+        with codecs.open(path, 'w', encoding='utf-8') as fd:
+            fd.write(text)
+
+    def _write_dist(self, name, requires=(), extras_calmjs=None):
+        egg_info = join(self.dist_dir, '%s-1.0.egg-info' % name)
+        os.makedirs(egg_info)
+        self._write(join(egg_info, 'requires.txt'), '\n'.join(requires))
+        self._write(
+            join(egg_info, 'calmjs_module_registry.txt'), self.registry_name)
+        if extras_calmjs:
+            self._write(join(egg_info, EXTRAS_CALMJS_JSON), json.dumps(
+                extras_calmjs))
+
+    def _module_source(self, i, modname, deps, amd):
+        body = generate_source(self.size, FILLER_TEMPLATE)
+        if amd:
+            return "define(%s, function(%s) {\n%s\n});\n" % (
+                json.dumps(deps),
+                ', '.join('dep%d' % n for n in range(len(deps))),
+                body,
+            )
+        return ''.join(
+            "var dep%d = require('%s');\n" % (n, dep)
+            for n, dep in enumerate(deps)
+        ) + 'exports.value = %d;\n' % i + body
+
+    def generate(self):
+        """
+        Generate the packages, the registry, and the artifact.
+        """
+
+        root = self.root
+        if root is None:
+            root = self._tmpdir = mkdtemp()
+        self.working_dir = root
+        self.dist_dir = join(root, 'dists')
+        self.src_dir = join(root, 'src')
+        node_modules = join(root, 'node_modules')
+        self.rjs_bin = join(root, 'r.js')
+        self.artifact = join(root, 'artifact.js')
+        os.makedirs(self.dist_dir)
+        self._write(self.rjs_bin, '')
+
+        self.registry = ModuleRegistry(
+            self.registry_name, _working_set=WorkingSet([]))
+        package_names = []
+        modnames = []
+        artifact = []
+        bundled = {}
+        for i in range(self.modules):
+            package = 'benchpkg%d' % (i // MODULES_PER_PACKAGE)
+            if package not in self.registry.package_module_map:
+                package_names.append(package)
+                os.makedirs(join(self.src_dir, package))
+                self.registry.package_module_map[package] = [package]
+                self.registry.records[package] = {}
+                self._write_dist(package)
+            records = self.registry.records[package]
+
+            modname = '%s/mod%d' % (package, i)
+            deps = modnames[-2:]
+            if i % 10 == 9:
+                text = 'text!%s/data%d.txt' % (package, i)
+                records[text] = join(self.src_dir, package, 'data%d.txt' % i)
+                self._write(records[text], 'data %d\n' % i)
+            records[modname] = join(self.src_dir, package, 'mod%d.js' % i)
+            self._write(records[modname], self._module_source(
+                i, modname, deps, i % 5 == 4))
+            if i % 20 == 19:
+                vendor = 'vendor%d' % i
+                bundled[vendor] = vendor + '/index.js'
+                os.makedirs(join(node_modules, vendor))
+                self._write(join(node_modules, bundled[vendor]), (
+                    "define('%s', [], function() {\n%s});\n" % (
+                        vendor, generate_source(self.size, FILLER_TEMPLATE))))
+            artifact.append("define('%s', %s, function() {\n%s});\n" % (
+                modname, json.dumps(deps), 'return %d;\n' % i))
+            modnames.append(modname)
+
+        self._write_dist(self.app_name, package_names, {
+            'node_modules': bundled})
+        self._write(self.artifact, ''.join(artifact))
+        self.working_set = WorkingSet([self.dist_dir])
+        return self
+
+    def __enter__(self):
+        self.generate()
+        # the root registry is itself registered under its own name.
+        root_registry = get('calmjs.registry')
+        self._restore = root_registry.records.get(self.registry_name)
+        root_registry.records[self.registry_name] = self.registry
+        return self
+
+    def __exit__(self, *exc_info):
+        root_registry = get('calmjs.registry')
+        if self._restore is None:
+            root_registry.records.pop(self.registry_name, None)
+        else:  # pragma: no cover
+            root_registry.records[self.registry_name] = self._restore
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir)
+            self._tmpdir = None
+
+
+class PhaseRecorder(object):
+    """
+    Record the wall time and the peak memory allocated through Python
+    (if tracemalloc is available and memory is True) for each phase.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory and tracemalloc is not None
+        self.times = {}
+        self.peaks = {}
+
+    @contextmanager
+    def measure(self, phase):
+        if self.memory:
+            tracemalloc.start()
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.times[phase] = self.times.get(phase, 0) + (
+                time.time() - start)
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.peaks[phase] = max(self.peaks.get(phase, 0), peak)
+
+
+class BenchmarkToolchain(RJSToolchain):
+    """
+    The RJSToolchain with the compile methods and the assemble step
+    measured by the recorder.  The link step is skipped, as that is
+    entirely done by r.js.
+    """
+
+    def __init__(self, recorder, *a, **kw):
+        super(BenchmarkToolchain, self).__init__(*a, **kw)
+        self.recorder = recorder
+
+    def compile_transpile(self, spec, entries):
+        with self.recorder.measure('transpile'):
+            return super(BenchmarkToolchain, self).compile_transpile(
+                spec, entries)
+
+    def compile_bundle(self, spec, entries):
+        with self.recorder.measure('bundle'):
+            return super(BenchmarkToolchain, self).compile_bundle(
+                spec, entries)
+
+    def compile_plugin(self, spec, entries):
+        with self.recorder.measure('plugin'):
+            return super(BenchmarkToolchain, self).compile_plugin(
+                spec, entries)
+
+    def assemble(self, spec):
+        with self.recorder.measure('assemble'):
+            return super(BenchmarkToolchain, self).assemble(spec)
+
+    def link(self, spec):
+        pass
+
+
+def bench_startup(module='calmjs.rjs.runtime', repeat=3):
+    """
+    Measure the time to import module in a fresh interpreter.
+
+    Returns a dict with the best time out of the repeated runs, the
+    deferred modules that were imported along with it, and whether the
+    loader plugin registry of the default toolchain was resolved.
+    """
+
+    script = STARTUP_SCRIPT % {
+        'module': module, 'deferred': STARTUP_DEFERRED_MODULES}
+    results = [json.loads(subprocess.check_output(
+        [sys.executable, '-c', script]).decode('utf8'))
+        for i in range(repeat)]
+    result = results[-1]
+    result['time'] = min(r['time'] for r in results)
+    return result
+
+
+def run_pipeline(env, memory=False, **kwargs):
+    """
+    Run the pipeline for the packages in the entered synthetic
+    environment, returning the PhaseRecorder.  Other keyword arguments
+    are passed to create_spec.
+    """
+
+    recorder = PhaseRecorder(memory=memory)
+    build_dir = mkdtemp()
+    try:
+        with recorder.measure('create_spec'):
+            spec = create_spec(
+                [env.app_name],
+                export_target=join(build_dir, 'export.js'),
+                build_dir=build_dir,
+                working_dir=env.working_dir,
+                source_registries=[env.registry_name],
+                working_set=MemoizedWorkingSet(env.working_set),
+                **kwargs
+            )
+        spec['rjs_bin'] = env.rjs_bin
+        BenchmarkToolchain(recorder)(spec)
+
+        if KARMA_CONFIG:
+            spec[KARMA_CONFIG] = {'files': [], 'frameworks': []}
+            spec[ARTIFACT_PATHS] = [env.artifact]
+            with recorder.measure('karma'):
+                karma_requirejs(spec)
+    finally:
+        shutil.rmtree(build_dir)
+    return recorder
+
+
+def bench_pipeline(
+        module_counts=DEFAULT_MODULE_COUNTS, size=0, memory=True,
+        **kwargs):
+    """
+    Run the pipeline against synthetic environments of each of the
+    module counts, with the modules of the specified size.
+
+    Returns a list of dicts with the modules, size, and the times and
+    peaks (in bytes, if memory is True) for each phase.  The peaks are
+    measured in a separate run, as tracing the memory allocations slows
+    down the execution considerably.
+    """
+
+    results = []
+    for modules in module_counts:
+        with SyntheticEnvironment(modules, size) as env:
+            recorder = run_pipeline(env, **kwargs)
+            result = {
+                'modules': modules,
+                'size': size,
+                'times': recorder.times,
+                'peaks': {},
+            }
+            if memory and tracemalloc:
+                result['peaks'] = run_pipeline(
+                    env, memory=True, **kwargs).peaks
+        results.append(result)
+    return results
+
+
+def format_pipeline_results(results):
+    lines = []
+    for result in results:
+        lines.append('modules=%d size=%d' % (
+            result['modules'], result['size']))
+        lines.append('  %-12s %10s %10s' % ('phase', 'time (s)', 'peak (MB)'))
+        for phase in PHASES:
+            if phase not in result['times']:
+                continue
+            peak = result['peaks'].get(phase)
+            lines.append('  %-12s %10.3f %10s' % (
+                phase, result['times'][phase],
+                '-' if peak is None else '%.2f' % (float(peak) / MB),
+            ))
+    return '\n'.join(lines)
+
+
+def main(argv=None, stream=None):
+    stream = stream or sys.stdout
+    parser = ArgumentParser(
+        prog='python -m calmjs.rjs.testing.benchmark',
+        description='benchmarks for calmjs.rjs',
+    )
+    commands = parser.add_subparsers(dest='command')
+    transpile = commands.add_parser(
+        'transpile', help='compare the line and block based transpilers')
+    transpile.add_argument(
+        '--size', type=float, default=4,
+        help='size of the generated source in MB; default: 4')
+    transpile.add_argument(
+        '--repeat', type=int, default=3,
+        help='number of runs to take the best time from; default: 3')
+    visit = commands.add_parser(
+        'visit', help='compare the recursive and iterative visitors')
+    visit.add_argument(
+        '--depth', type=int, nargs='+', default=list(DEFAULT_VISIT_DEPTHS),
+        help='the depths of the nested sources; default: %s' % (
+            ' '.join(str(i) for i in DEFAULT_VISIT_DEPTHS)))
+    visit.add_argument(
+        '--repeat', type=int, default=3,
+        help='number of runs to take the best time from; default: 3')
+    startup = commands.add_parser(
+        'startup', help='measure the time taken to import the runtime')
+    startup.add_argument(
+        '--module', default='calmjs.rjs.runtime',
+        help='the module to import; default: calmjs.rjs.runtime')
+    startup.add_argument(
+        '--repeat', type=int, default=3,
+        help='number of runs to take the best time from; default: 3')
+    startup.add_argument(
+        '--max', type=float, default=None,
+        help='fail if the import takes longer than this many seconds, or '
+             'if any of the deferred modules were imported')
+    pipeline = commands.add_parser(
+        'pipeline', help='measure each phase of the build pipeline')
+    pipeline.add_argument(
+        '--preset', default='default', choices=sorted(PIPELINE_PRESETS),
+        help='the module counts and size to benchmark with, unless those '
+             'are specified; default: %s modules unpadded, scaling: %s '
+             'modules, large: %s modules of %dM each' % (
+                 ' '.join(str(i) for i in DEFAULT_MODULE_COUNTS),
+                 ' '.join(str(i) for i in PIPELINE_PRESETS['scaling'][0]),
+                 ' '.join(str(i) for i in PIPELINE_PRESETS['large'][0]),
+                 PIPELINE_PRESETS['large'][1] // MB))
+    pipeline.add_argument(
+        '--modules', type=int, nargs='+', default=None,
+        help='the numbers of modules to benchmark with')
+    pipeline.add_argument(
+        '--size', type=parse_size, default=None,
+        help='the minimum size of each module in bytes, with an optional '
+             'k or M suffix')
+    pipeline.add_argument(
+        '--no-memory', dest='memory', action='store_false',
+        help='skip the measurement of the peak memory')
+    pipeline.add_argument(
+        '--extract-engine', default=None, choices=('ast', 'scan'),
+        help='the engine for extracting the required module names')
+    pipeline.add_argument(
+        '--json', dest='json_path', default=None,
+        help='also write the results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pipeline':
+        module_counts, size = PIPELINE_PRESETS[args.preset]
+        results = bench_pipeline(
+            module_counts if args.modules is None else args.modules,
+            size if args.size is None else args.size, memory=args.memory,
+            extract_engine=args.extract_engine,
+        )
+        print(format_pipeline_results(results), file=stream)
+        if args.json_path:
+            with open(args.json_path, 'w') as fd:
+                json.dump(results, fd, indent=2, sort_keys=True)
+    elif args.command == 'transpile':
+        print('%-8s %10s %10s %8s' % (
+            'name', 'line (s)', 'block (s)', 'speedup'), file=stream)
+        for name, line, block in bench_transpile(
+                int(args.size * MB), args.repeat):
+            print('%-8s %10.3f %10.3f %7.1fx' % (
+                name, line, block, line / block if block else 0), file=stream)
+    elif args.command == 'visit':
+        print('%-14s %6s %14s %14s' % (
+            'name', 'depth', 'recursive (s)', 'iterative (s)'), file=stream)
+        for depth in args.depth:
+            for name, recursive, iterative in bench_visit(depth, args.repeat):
+                print('%-14s %6d %14s %14.3f' % (
+                    name, depth, 'failed' if recursive is None else
+                    '%.3f' % recursive, iterative), file=stream)
+    elif args.command == 'startup':
+        result = bench_startup(args.module, args.repeat)
+        print('import %s: %.3f s' % (args.module, result['time']), file=stream)
+        print('deferred modules imported: %s' % (
+            ', '.join(result['modules']) or 'none'), file=stream)
+        print('loader plugin registry resolved: %s' % (
+            'yes' if result['registry'] else 'no'), file=stream)
+        if args.max is not None and (
+                result['time'] > args.max or result['modules'] or
+                result['registry']):
+            print('FAIL', file=stream)
+            return 1
+    else:
+        parser.print_help(stream)
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
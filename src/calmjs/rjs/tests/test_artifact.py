@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import unittest
+import gzip
+import json
+import os
+from io import BytesIO
+from os.path import exists
+from os.path import join
+
+from calmjs.rjs import artifact
+from calmjs.rjs.cache import text_digest
+
+from calmjs.utils import pretty_logging
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
+
+
+class ArtifactTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.path = join(self.tmpdir, 'export.js')
+        with open(self.path, 'w') as fd:
+            fd.write('var a = 1;\n' * 100)
+
+    def test_hashed_path(self):
+        self.assertEqual(artifact.hashed_path(
+            join('dir', 'export.page.js'), '0123456789abcdef'),
+            join('dir', 'export.page.0123456789ab.js'))
+
+    def test_gzip_compress(self):
+        data = b'var a = 1;\n' * 100
+        result = artifact.gzip_compress(data)
+        self.assertEqual(result, artifact.gzip_compress(data))
+        self.assertLess(len(result), len(data))
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(result)).read(), data)
+
+    def test_write_hashed_artifact(self):
+        # brotli may not be installed, so stand in for an unavailable one.
+        stub_item_attr_value(self, artifact, 'compressors', (
+            ('.gz', artifact.gzip_compress),
+            ('.none', lambda data: None),
+        ))
+        target, exts = artifact.write_hashed_artifact(self.path)
+        with open(self.path, 'rb') as fd:
+            digest = text_digest(fd.read())
+        self.assertEqual(target, join(
+            self.tmpdir, 'export.%s.js' % digest[:artifact.HASH_LENGTH]))
+        self.assertEqual(exts, ['.gz'])
+        self.assertTrue(exists(target + '.gz'))
+        self.assertFalse(exists(target + '.none'))
+
+        # existing files are kept.
+        mtime = os.stat(target + '.gz').st_mtime
+        os.utime(target + '.gz', (mtime - 10, mtime - 10))
+        self.assertEqual(
+            artifact.write_hashed_artifact(self.path), (target, ['.gz']))
+        self.assertEqual(os.stat(target + '.gz').st_mtime, mtime - 10)
+
+    def test_write_hashed_artifacts(self):
+        stub_item_attr_value(self, artifact, 'compressors', (
+            ('.gz', artifact.gzip_compress),
+        ))
+        os.mkdir(join(self.tmpdir, 'sub'))
+        other = join(self.tmpdir, 'sub', 'other.js')
+        with open(other, 'w') as fd:
+            fd.write('var b = 2;\n')
+        manifest_path = join(self.tmpdir, 'manifest.json')
+        results = artifact.write_hashed_artifacts(
+            [self.path, other], manifest_path)
+        self.assertEqual(sorted(results), sorted([self.path, other]))
+        with open(manifest_path) as fd:
+            manifest = json.load(fd)
+        self.assertEqual(manifest['version'], 1)
+        self.assertEqual(manifest['compressed'], ['.gz'])
+        self.assertEqual(sorted(manifest['files']), [
+            'export.js', 'sub/other.js'])
+        self.assertTrue(manifest['files']['sub/other.js'].startswith(
+            'sub/other.'))
+        self.assertTrue(exists(results[other]))
+
+    def test_write_hashed_artifacts_prune(self):
+        stub_item_attr_value(self, artifact, 'compressors', (
+            ('.gz', artifact.gzip_compress),
+        ))
+        manifest_path = join(self.tmpdir, 'manifest.json')
+        first = artifact.write_hashed_artifacts([self.path], manifest_path)
+        # rewriting the same contents removes nothing.
+        self.assertEqual(artifact.write_hashed_artifacts(
+            [self.path], manifest_path), first)
+        self.assertTrue(exists(first[self.path]))
+
+        with open(self.path, 'w') as fd:
+            fd.write('var a = 2;\n')
+        with pretty_logging(
+                logger='calmjs.rjs.artifact', stream=StringIO()) as s:
+            second = artifact.write_hashed_artifacts(
+                [self.path], manifest_path)
+        self.assertIn("removed 2 stale hashed artifact file(s)", s.getvalue())
+        self.assertFalse(exists(first[self.path]))
+        self.assertFalse(exists(first[self.path] + '.gz'))
+        self.assertTrue(exists(second[self.path]))
+        self.assertTrue(exists(second[self.path] + '.gz'))
+        self.assertTrue(exists(self.path))
+
+    def test_read_artifact_manifest(self):
+        manifest_path = join(self.tmpdir, 'manifest.json')
+        self.assertIsNone(artifact.read_artifact_manifest(manifest_path))
+        with open(manifest_path, 'w') as fd:
+            fd.write('{')
+        with pretty_logging(
+                logger='calmjs.rjs.artifact', stream=StringIO()) as s:
+            self.assertIsNone(artifact.read_artifact_manifest(manifest_path))
+        self.assertIn('ignoring corrupted artifact manifest', s.getvalue())
+        with open(manifest_path, 'w') as fd:
+            fd.write('{"version": 0}')
+        self.assertIsNone(artifact.read_artifact_manifest(manifest_path))
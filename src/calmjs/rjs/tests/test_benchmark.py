@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from os.path import exists
+from os.path import join
+
+from pkg_resources import Requirement
+
+from calmjs import dist as calmjs_dist
+from calmjs.registry import get
+
+from calmjs.rjs.testing import benchmark
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_generate_source(self):
+        source = benchmark.generate_source(1000)
+        self.assertGreaterEqual(len(source), 1000)
+        self.assertIn("require('example/mod0')", source)
+        source = benchmark.generate_source(1000, benchmark.FILLER_TEMPLATE)
+        self.assertNotIn("require(", source)
+
+    def test_parse_size(self):
+        self.assertEqual(benchmark.parse_size('512'), 512)
+        self.assertEqual(benchmark.parse_size('4k'), 4096)
+        self.assertEqual(benchmark.parse_size('1.5M'), 1572864)
+        with self.assertRaises(ValueError):
+            benchmark.parse_size('4g')
+
+    def test_bench_transpile(self):
+        results = benchmark.bench_transpile(size=1000, repeat=1)
+        self.assertEqual([name for name, line, block in results], [
+            'null', 'umd'])
+
+    def test_bench_visit(self):
+        results = benchmark.bench_visit(depth=10, repeat=1)
+        self.assertEqual([name for name, r, i in results], [
+            'define', 'amd_requires'])
+        self.assertNotIn(None, [r for name, r, i in results])
+        results = benchmark.bench_visit(depth=1200, repeat=1)
+        self.assertEqual([r for name, r, i in results], [None, None])
+
+    def test_main(self):
+        stream = StringIO()
+        benchmark.main(['transpile', '--size', '0.001', '--repeat', '1'],
+                       stream=stream)
+        self.assertIn('speedup', stream.getvalue())
+        self.assertIn('umd', stream.getvalue())
+
+        stream = StringIO()
+        benchmark.main(['visit', '--depth', '10', '1200', '--repeat', '1'],
+                       stream=stream)
+        self.assertIn('amd_requires', stream.getvalue())
+        self.assertIn('failed', stream.getvalue())
+
+        stream = StringIO()
+        benchmark.main([], stream=stream)
+        self.assertIn('usage', stream.getvalue())
+
+    def test_bench_startup(self):
+        # guard against the costly modules and registries being loaded
+        # by merely importing the runtime.
+        result = benchmark.bench_startup(repeat=1)
+        self.assertEqual(result['modules'], [])
+        self.assertFalse(result['registry'])
+        self.assertGreater(result['time'], 0)
+
+    def test_main_startup(self):
+        stream = StringIO()
+        self.assertEqual(benchmark.main(
+            ['startup', '--repeat', '1', '--max', '60'], stream=stream), 0)
+        self.assertIn('import calmjs.rjs.runtime', stream.getvalue())
+        self.assertIn('deferred modules imported: none', stream.getvalue())
+        stream = StringIO()
+        self.assertEqual(benchmark.main([
+            'startup', '--module', 'slimit.parser', '--repeat', '1',
+            '--max', '60'], stream=stream), 1)
+        self.assertIn('FAIL', stream.getvalue())
+
+
+class PipelineBenchmarkTestCase(unittest.TestCase):
+
+    def test_synthetic_environment(self):
+        root = mkdtemp(self)
+        working_set = calmjs_dist.default_working_set
+        with benchmark.SyntheticEnvironment(40, size=100, root=root) as env:
+            # the packages are only in the working set of the env.
+            self.assertIs(calmjs_dist.default_working_set, working_set)
+            self.assertEqual(env.working_set.find(
+                Requirement.parse(env.app_name)).project_name, env.app_name)
+            registry = get(benchmark.BENCHMARK_REGISTRY_NAME)
+            self.assertIs(registry, env.registry)
+            self.assertEqual(
+                sorted(registry.package_module_map), ['benchpkg0'])
+            records = registry.get_records_for_package('benchpkg0')
+            self.assertEqual(len(records), 44)
+            self.assertIn('text!benchpkg0/data9.txt', records)
+            with open(records['benchpkg0/mod2']) as fd:
+                source = fd.read()
+            self.assertIn("require('benchpkg0/mod0')", source)
+            self.assertGreater(len(source), 100)
+            with open(records['benchpkg0/mod4']) as fd:
+                self.assertTrue(fd.read().startswith(
+                    'define(["benchpkg0/mod2", "benchpkg0/mod3"]'))
+            self.assertTrue(exists(join(
+                root, 'node_modules', 'vendor19', 'index.js')))
+            self.assertTrue(exists(env.artifact))
+
+        self.assertIs(calmjs_dist.default_working_set, working_set)
+        self.assertIsNone(get(benchmark.BENCHMARK_REGISTRY_NAME))
+        # provided root is not removed.
+        self.assertTrue(exists(env.artifact))
+
+    def test_bench_pipeline(self):
+        results = benchmark.bench_pipeline([20], size=100)
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertEqual(result['modules'], 20)
+        self.assertEqual(sorted(result['times']), sorted(benchmark.PHASES))
+        self.assertEqual(sorted(result['peaks']), sorted(benchmark.PHASES))
+        self.assertIn('modules=20 size=100', (
+            benchmark.format_pipeline_results(results)))
+
+    def test_main_pipeline(self):
+        path = join(mkdtemp(self), 'results.json')
+        stream = StringIO()
+        benchmark.main([
+            'pipeline', '--modules', '10', '--size', '1k', '--no-memory',
+            '--extract-engine', 'scan', '--json', path,
+        ], stream=stream)
+        self.assertIn('assemble', stream.getvalue())
+        with open(path) as fd:
+            results = json.load(fd)
+        self.assertEqual(results[0]['size'], 1024)
+        self.assertEqual(results[0]['peaks'], {})
+
+    def test_main_pipeline_preset(self):
+        calls = []
+
+        def bench_pipeline(module_counts, size, **kw):
+            calls.append((module_counts, size))
+            return []
+
+        stub_item_attr_value(self, benchmark, 'bench_pipeline', bench_pipeline)
+        benchmark.main(['pipeline'], stream=StringIO())
+        benchmark.main(['pipeline', '--preset', 'scaling'], stream=StringIO())
+        benchmark.main(['pipeline', '--preset', 'large'], stream=StringIO())
+        benchmark.main([
+            'pipeline', '--preset', 'large', '--modules', '5', '--size', '0',
+        ], stream=StringIO())
+        self.assertEqual(calls, [
+            ((10, 100, 1000), 0),
+            ((10, 100, 1000, 10000), 0),
+            ((10, 100), 2 * benchmark.MB),
+            ([5], 0),
+        ])
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+from os.path import exists
+from os.path import join
+
+from calmjs.utils import pretty_logging
+
+from calmjs.rjs import cache
+from calmjs.rjs.requirejs import extract_all_amd_requires
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+
+
+class TextDigestTestCase(unittest.TestCase):
+
+    def test_text_digest(self):
+        self.assertEqual(
+            cache.text_digest('text'), cache.text_digest(b'text'))
+        self.assertNotEqual(
+            cache.text_digest('text'), cache.text_digest('text', '1'))
+        self.assertNotEqual(
+            cache.text_digest('text', '1'), cache.text_digest('text', '2'))
+
+
+class ContentCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        cache_dir = join(mkdtemp(self), 'cache')
+        c = cache.ContentCache(cache_dir)
+        key = c.key('some source')
+        self.assertIsNone(c.get(key))
+        c.set(key, ['a', 'b'])
+        self.assertTrue(exists(cache_dir))
+        self.assertEqual(c.get(key), ['a', 'b'])
+        self.assertEqual(c.hits, 1)
+        self.assertEqual(c.misses, 1)
+
+        # a new instance with a different version will not find that.
+        c2 = cache.ContentCache(cache_dir, version='2')
+        self.assertIsNone(c2.get(c2.key('some source')))
+        self.assertEqual(cache.ContentCache(cache_dir).get(key), ['a', 'b'])
+
+    def test_get_corrupted(self):
+        c = cache.ContentCache(mkdtemp(self))
+        key = c.key('some source')
+        c.set(key, ['a'])
+        with open(c._entry_path(key), 'w') as fd:
+            fd.write('[not json')
+
+        with pretty_logging(stream=StringIO()) as s:
+            self.assertIsNone(c.get(key))
+        self.assertIn('removing corrupted cache entry', s.getvalue())
+        self.assertFalse(exists(c._entry_path(key)))
+
+    def test_set_failure(self):
+        tmpdir = mkdtemp(self)
+        cache_dir = join(tmpdir, 'cache')
+        # a file is where the cache directory should be.
+        with open(cache_dir, 'w'):
+            pass
+        c = cache.ContentCache(cache_dir)
+        with pretty_logging(stream=StringIO()) as s:
+            c.set(c.key('text'), [])
+        self.assertIn('failed to write cache entry', s.getvalue())
+
+    def test_prune(self):
+        c = cache.ContentCache(mkdtemp(self), max_size=0)
+        self.assertEqual(c.prune(), 0)
+        keys = [c.key(str(i)) for i in range(4)]
+        for idx, key in enumerate(keys):
+            c.set(key, ['value'])
+            # ensure a well defined ordering for the entries
+            os.utime(c._entry_path(key), (idx, idx))
+
+        # mark the oldest entry as accessed.
+        c.get(keys[0])
+        size = os.stat(c._entry_path(keys[0])).st_size
+        c.max_size = size * 2
+        self.assertEqual(c.prune(), 2)
+        self.assertEqual(len(c.entries()), 2)
+        self.assertEqual(c.get(keys[0]), ['value'])
+        self.assertIsNone(c.get(keys[1]))
+        self.assertIsNone(c.get(keys[2]))
+        self.assertEqual(c.get(keys[3]), ['value'])
+
+    def test_process_path(self):
+        tmpdir = mkdtemp(self)
+        src_file = join(tmpdir, 'source.js')
+        with open(src_file, 'w') as fd:
+            fd.write("define(['mod1', 'mod2'], function(mod1, mod2) {});")
+
+        called = []
+
+        def f(text):
+            called.append(text)
+            return extract_all_amd_requires(text)
+
+        c = cache.ContentCache(join(tmpdir, 'cache'))
+        self.assertEqual(c.process_path(src_file, f), ['mod1', 'mod2'])
+        self.assertEqual(c.process_path(src_file, f), ['mod1', 'mod2'])
+        self.assertEqual(len(called), 1)
+
+        with open(src_file, 'w') as fd:
+            fd.write("require('mod3');")
+        self.assertEqual(c.process_path(src_file, f), ['mod3'])
+        self.assertEqual(len(called), 2)
+
+    def test_process_path_error(self):
+        tmpdir = mkdtemp(self)
+        src_file = join(tmpdir, 'source.js')
+        with open(src_file, 'w') as fd:
+            fd.write("define([], function () { return 'blah' }")
+
+        c = cache.ContentCache(join(tmpdir, 'cache'))
+        with pretty_logging(stream=StringIO()) as s:
+            result = c.process_path(src_file, extract_all_amd_requires)
+        self.assertIsNone(result)
+        self.assertIn('syntax error', s.getvalue())
+        # nothing cached for failures.
+        self.assertEqual(c.entries(), [])
+
+    def test_process_paths(self):
+        tmpdir = mkdtemp(self)
+        src_file1 = join(tmpdir, 'source1.js')
+        src_file2 = join(tmpdir, 'source2.js')
+        missing = join(tmpdir, 'missing.js')
+        with open(src_file1, 'w') as fd:
+            fd.write("define(['mod1', 'mod2'], function(mod1, mod2) {});")
+        with open(src_file2, 'w') as fd:
+            fd.write("require('mod3');")
+
+        c = cache.ContentCache(join(tmpdir, 'cache'))
+        paths = [src_file1, missing, src_file2]
+        with pretty_logging(stream=StringIO()) as s:
+            self.assertEqual(c.process_paths(
+                paths, extract_all_amd_requires, processes=2,
+            ), [['mod1', 'mod2'], None, ['mod3']])
+        self.assertIn("failed to read '%s'" % missing, s.getvalue())
+        self.assertEqual(c.misses, 2)
+        self.assertEqual(len(c.entries()), 2)
+
+        with open(src_file1, 'w') as fd:
+            fd.write("require('mod4');")
+
+        with pretty_logging(stream=StringIO()) as s:
+            self.assertEqual(c.process_paths(
+                paths, extract_all_amd_requires,
+            ), [['mod4'], None, ['mod3']])
+        self.assertEqual(c.hits, 1)
+        self.assertEqual(c.misses, 3)
@@ -1,13 +1,28 @@
 # -*- coding: utf-8 -*-
 import unittest
+import threading
+import time
+from argparse import ArgumentTypeError
+from os.path import exists
+from os.path import join
 
 from calmjs.toolchain import Spec
 from calmjs.utils import pretty_logging
 
+from calmjs.rjs import toolchain
+from calmjs.rjs.cli import build_targets
 from calmjs.rjs.cli import create_spec
 from calmjs.rjs.cli import compile_all
+from calmjs.rjs.cli import compile_targets
+from calmjs.rjs.exc import RJSRuntimeError
+from calmjs.rjs.runtime import parse_bundle
+from calmjs.rjs.runtime import parse_target
+from calmjs.rjs.worker import load_build_config
 
 from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
+from calmjs.testing.utils import stub_mod_call
 
 
 class CliTestCase(unittest.TestCase):
@@ -26,6 +41,17 @@ class CliTestCase(unittest.TestCase):
         self.assertEqual(spec['export_target'], 'calmjs.rjs.export.js')
         self.assertEqual(spec['calmjs_module_registry_names'], [])
 
+    def test_create_spec_artifact_defines(self):
+        with pretty_logging(stream=StringIO()):
+            spec = create_spec([])
+        self.assertNotIn('artifact_defines', spec)
+        self.assertNotIn('defines_manifest', spec)
+        with pretty_logging(stream=StringIO()):
+            spec = create_spec(
+                [], artifact_defines=[], defines_manifest=True)
+        self.assertEqual(spec['artifact_defines'], [])
+        self.assertTrue(spec['defines_manifest'])
+
     def test_create_spec_with_calmjs_rjs(self):
         with pretty_logging(stream=StringIO()) as stream:
             spec = create_spec(['calmjs.rjs'])
@@ -78,3 +104,221 @@ class CliTestCase(unittest.TestCase):
         self.assertIn('no packages specified', stream.getvalue())
         self.assertTrue(isinstance(spec, Spec))
         self.assertTrue(spec['transpile_no_indent'])
+
+
+class BuildTargetsTestCase(unittest.TestCase):
+    """
+    Test the building of multiple targets.
+    """
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.build_dir = mkdtemp(self)
+        self.rjs_bin = join(self.tmpdir, 'r.js')
+        with open(self.rjs_bin, 'w'):
+            pass
+        self.sources = {}
+        for name, text in (
+                ('common', "exports.common = 'common';\n"),
+                ('app1', "var common = require('common');\n"),
+                ('app2', "define(['common'], function(common) {});\n")):
+            self.sources[name] = join(self.tmpdir, name + '.js')
+            with open(self.sources[name], 'w') as fd:
+                fd.write(text)
+
+        self.lock = threading.Lock()
+        self.active = []
+        self.concurrency = []
+
+        def fake_call(args, **kw):
+            config = load_build_config(args[-1])
+            with self.lock:
+                self.active.append(config['out'])
+                self.concurrency.append(len(self.active))
+            # give the other links a chance to run.
+            time.sleep(0.05)
+            with open(config['out'], 'w') as fd:
+                fd.write('\n'.join(config['include']))
+            with self.lock:
+                self.active.remove(config['out'])
+            return 0
+
+        stub_mod_call(self, toolchain, fake_call)
+
+    def make_spec(self, name, *modnames, **kw):
+        return Spec(
+            export_target=join(self.tmpdir, name + '.js'),
+            rjs_bin=self.rjs_bin,
+            transpile_source_map={
+                modname: self.sources[modname] for modname in modnames},
+            **kw
+        )
+
+    def build(self, **kw):
+        specs = [
+            self.make_spec('export1', 'common', 'app1', **kw),
+            self.make_spec('export2', 'common', 'app2', **kw),
+        ]
+        with pretty_logging(logger='calmjs', stream=StringIO()) as s:
+            build_targets(
+                specs, build_dir=self.build_dir, link_jobs=2,
+                toolchain=toolchain.RJSToolchain(),
+            )
+        return specs, s.getvalue()
+
+    def test_build_targets(self):
+        specs, log = self.build()
+        for name, spec in zip(('export1', 'export2'), specs):
+            self.assertEqual(spec['build_dir'], self.build_dir)
+            self.assertEqual(spec['build_manifest_path'], join(
+                self.build_dir, name + '.build.js'))
+            self.assertTrue(exists(spec['build_manifest_path']))
+            self.assertTrue(exists(spec['requirejs_config_js']))
+            self.assertTrue(exists(spec['export_target']))
+
+        with open(specs[0]['export_target']) as fd:
+            self.assertEqual(sorted(fd.read().split()), ['app1', 'common'])
+        with open(specs[1]['export_target']) as fd:
+            self.assertEqual(sorted(fd.read().split()), ['app2', 'common'])
+
+        # the common module is only transpiled once.
+        self.assertEqual(log.count(
+            "skipping transpile of unchanged '%s'" % self.sources['common']
+        ), 1)
+        self.assertEqual(max(self.concurrency), 2)
+        # nothing persisted for the non-incremental build.
+        self.assertFalse(exists(join(self.build_dir, 'build_state.json')))
+
+    def test_build_targets_parse_workers(self):
+        import multiprocessing
+        methods = []
+        get_context = multiprocessing.get_context
+
+        def recording_get_context(method=None):
+            methods.append(method)
+            return get_context(method)
+
+        stub_item_attr_value(
+            self, multiprocessing, 'get_context', recording_get_context)
+        specs, log = self.build(parse_workers=2)
+        with open(specs[0]['export_target']) as fd:
+            self.assertEqual(sorted(fd.read().split()), ['app1', 'common'])
+        with open(specs[1]['export_target']) as fd:
+            self.assertEqual(sorted(fd.read().split()), ['app2', 'common'])
+        # the parse pool was spawned as the builds run in threads; the
+        # common module was only parsed for the first target.
+        self.assertEqual(methods.count('spawn'), 1)
+        self.assertNotIn('fork', methods)
+
+    def test_build_targets_incremental(self):
+        self.build(incremental=True)
+        self.assertTrue(exists(join(self.build_dir, 'build_state.json')))
+        specs, log = self.build(incremental=True)
+        self.assertEqual(log.count('skipping link'), 2)
+        self.assertEqual(len(self.concurrency), 2)
+
+    def test_build_targets_link_jobs(self):
+        specs = [
+            self.make_spec('export1', 'common', 'app1'),
+            self.make_spec('export2', 'common', 'app2'),
+        ]
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()):
+            build_targets(
+                specs, link_jobs=1, toolchain=toolchain.RJSToolchain())
+        self.assertEqual(self.concurrency, [1, 1])
+        # temporary build directory removed
+        self.assertFalse(exists(specs[0]['build_dir']))
+
+    def test_build_targets_failure(self):
+        specs = [
+            self.make_spec('export1', 'common', 'app1'),
+            self.make_spec('export2', 'common', 'app2'),
+        ]
+        specs[0]['rjs_bin'] = join(self.tmpdir, 'no_such_r.js')
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()) as s:
+            with self.assertRaises(RJSRuntimeError):
+                build_targets(
+                    specs, build_dir=self.build_dir,
+                    toolchain=toolchain.RJSToolchain(),
+                )
+        self.assertIn("failed to build '%s'" % specs[0]['export_target'], (
+            s.getvalue()))
+        # the other target was still built.
+        self.assertTrue(exists(specs[1]['export_target']))
+
+    def test_build_targets_duplicated_names(self):
+        with self.assertRaises(RJSRuntimeError) as e:
+            build_targets([
+                self.make_spec('export1'),
+                Spec(export_target=join(self.build_dir, 'export1.js')),
+            ], toolchain=toolchain.RJSToolchain())
+        self.assertIn('duplicated: export1', str(e.exception))
+
+    def test_parse_target(self):
+        self.assertEqual(parse_target('export.js=pkg1,pkg2'), (
+            'export.js', ['pkg1', 'pkg2']))
+        self.assertEqual(parse_target('export.js='), ('export.js', []))
+        with self.assertRaises(ArgumentTypeError):
+            parse_target('export.js')
+        with self.assertRaises(ArgumentTypeError):
+            parse_target('=pkg1')
+
+    def test_parse_bundle(self):
+        self.assertEqual(parse_bundle('page1=mod1,mod2'), (
+            'page1', ['mod1', 'mod2']))
+        with self.assertRaises(ArgumentTypeError):
+            parse_bundle('page1=')
+        with self.assertRaises(ArgumentTypeError):
+            parse_bundle('=mod1')
+
+    def test_compile_targets(self):
+        rjs = toolchain.RJSToolchain()
+        rjs.which = lambda: self.rjs_bin
+        with pretty_logging(stream=StringIO()):
+            specs = compile_targets([
+                ([], join(self.tmpdir, 'export1.js')),
+                ([], join(self.tmpdir, 'export2.js')),
+            ], toolchain=rjs, build_dir=self.build_dir,
+                transpile_no_indent=True)
+        self.assertEqual(len(specs), 2)
+        self.assertTrue(specs[0]['transpile_no_indent'])
+        self.assertEqual(specs[1]['export_target'], join(
+            self.tmpdir, 'export2.js'))
+
+    def test_compile_targets_shared_working_set(self):
+        from calmjs.rjs import cli
+        from calmjs.rjs.dist import MemoizedWorkingSet
+
+        working_sets = []
+        resolved = []
+
+        class RecordingWorkingSet(MemoizedWorkingSet):
+            def __init__(self, *a, **kw):
+                super(RecordingWorkingSet, self).__init__(*a, **kw)
+                working_sets.append(self)
+
+            def resolve(self, requirements, *a, **kw):
+                requirements = list(requirements)
+                key = tuple(str(req) for req in requirements)
+                if key not in self.resolved:
+                    resolved.append(key)
+                return super(RecordingWorkingSet, self).resolve(
+                    requirements, *a, **kw)
+
+        stub_item_attr_value(self, cli, 'MemoizedWorkingSet', (
+            RecordingWorkingSet))
+        rjs = toolchain.RJSToolchain()
+        rjs.which = lambda: self.rjs_bin
+        with pretty_logging(stream=StringIO()):
+            specs = compile_targets([
+                (['calmjs.rjs'], join(self.tmpdir, 'export1.js')),
+                (['calmjs.rjs'], join(self.tmpdir, 'export2.js')),
+            ], toolchain=rjs, build_dir=self.build_dir)
+        self.assertEqual(len(specs), 2)
+        # the lookups for both targets were done through the same one.
+        self.assertEqual(len(working_sets), 1)
+        self.assertEqual(len(resolved), len(set(resolved)))
+        self.assertIn(('calmjs.rjs',), resolved)
+        self.assertEqual(
+            specs[0]['calmjs_module_registry_names'],
+            specs[1]['calmjs_module_registry_names'])
@@ -21,6 +21,7 @@ from calmjs.registry import get
 from calmjs.toolchain import Spec
 from calmjs.utils import pretty_logging
 
+from calmjs.rjs import dev
 from calmjs.rjs.dev import karma_requirejs
 from calmjs.rjs.dev import process_artifacts
 from calmjs.rjs.ecma import parse
@@ -87,6 +88,127 @@ class ProcessArtifactsTestCase(unittest.TestCase):
         self.assertIn('syntax error in', s.getvalue())
         self.assertIn(source2, s.getvalue())
 
+    def test_process_paths_records(self):
+        build_dir = mkdtemp(self)
+        source1 = join(build_dir, 'source1.js')
+        source2 = join(build_dir, 'source2.js')
+
+        with open(source1, 'w') as fd:
+            fd.write(
+                "define('source1/mod1', ['require','exports','module'],"
+                "function (require, exports, module) {"
+                "  var mod2 = require('source2/mod2');"
+                "});\n"
+            )
+
+        # the record of source2 was produced by the build, so the file
+        # will not be read.
+        records = {source2: [[['source2/mod2', []]], []]}
+        with pretty_logging(stream=StringIO()) as s:
+            result = process_artifacts([source1, source2], records)
+
+        self.assertEqual(result, ['source2/mod2', 'source1/mod1'])
+        self.assertNotIn('failed to read', s.getvalue())
+        self.assertEqual(records[source1], [
+            [['source1/mod1', ['source2/mod2']]], ['source2/mod2']])
+
+    def test_process_paths_cache(self):
+        build_dir = mkdtemp(self)
+        cache_dir = mkdtemp(self)
+        source1 = join(build_dir, 'source1.js')
+        with open(source1, 'w') as fd:
+            fd.write("define('source1/mod1', [], function () {});\n")
+
+        with pretty_logging(stream=StringIO()) as s:
+            result = process_artifacts([source1], cache_dir=cache_dir)
+        self.assertEqual(result, ['source1/mod1'])
+        self.assertIn('had 0 hits and 1 misses', s.getvalue())
+        self.assertTrue(exists(join(cache_dir, dev.ARTIFACT_CACHE_NAME)))
+
+        with pretty_logging(stream=StringIO()) as s:
+            result = process_artifacts([source1], cache_dir=cache_dir)
+        self.assertEqual(result, ['source1/mod1'])
+        self.assertIn('had 1 hits and 0 misses', s.getvalue())
+
+    def test_parse_artifacts_processes(self):
+        build_dir = mkdtemp(self)
+        paths = []
+        for idx in range(3):
+            path = join(build_dir, 'source%d.js' % idx)
+            with open(path, 'w') as fd:
+                fd.write("define('source%d', [], function () {});\n" % idx)
+            paths.append(path)
+
+        self.assertEqual(dev.parse_artifacts(paths, processes=2), [
+            [[['source%d' % idx, []]], []] for idx in range(3)])
+
+    def test_parse_artifacts_in_process(self):
+        import multiprocessing
+
+        def fail(*a, **kw):
+            raise AssertionError('no pool should have been created')
+
+        stub_item_attr_value(self, multiprocessing, 'Pool', fail)
+        build_dir = mkdtemp(self)
+        paths = []
+        for idx in range(2):
+            path = join(build_dir, 'source%d.js' % idx)
+            with open(path, 'w') as fd:
+                fd.write("define('source%d', [], function () {});\n" % idx)
+            paths.append(path)
+        self.assertEqual(dev.parse_artifacts(paths), [
+            [[['source%d' % idx, []]], []] for idx in range(2)])
+
+    def test_defines_manifest(self):
+        build_dir = mkdtemp(self)
+        source1 = join(build_dir, 'source1.js')
+        with open(source1, 'w') as fd:
+            fd.write('not valid javascript;\n')
+
+        with pretty_logging(stream=StringIO()):
+            self.assertEqual(dev.write_defines_manifest(
+                source1, ['source1/mod1', 'source1/mod2']),
+                source1 + dev.DEFINES_MANIFEST_SUFFIX)
+        self.assertEqual(dev.read_defines_manifest(source1), [
+            'source1/mod1', 'source1/mod2'])
+
+        # the artifact will not be parsed.
+        with pretty_logging(stream=StringIO()) as s:
+            result = process_artifacts([source1])
+        self.assertEqual(result, ['source1/mod1', 'source1/mod2'])
+        self.assertIn('using defines manifest', s.getvalue())
+
+        # the manifest is no longer valid once the artifact is changed.
+        with open(source1, 'w') as fd:
+            fd.write("define('source1/mod3', [], function () {});\n")
+        with pretty_logging(stream=StringIO()) as s:
+            self.assertIsNone(dev.read_defines_manifest(source1))
+            self.assertEqual(process_artifacts([source1]), ['source1/mod3'])
+        self.assertIn('ignoring outdated defines manifest', s.getvalue())
+
+    def test_defines_manifest_invalid(self):
+        build_dir = mkdtemp(self)
+        source1 = join(build_dir, 'source1.js')
+        self.assertIsNone(dev.read_defines_manifest(source1))
+
+        with open(source1 + dev.DEFINES_MANIFEST_SUFFIX, 'w') as fd:
+            fd.write('{')
+        with pretty_logging(stream=StringIO()) as s:
+            self.assertIsNone(dev.read_defines_manifest(source1))
+        self.assertIn('ignoring corrupted defines manifest', s.getvalue())
+
+        with open(source1 + dev.DEFINES_MANIFEST_SUFFIX, 'w') as fd:
+            fd.write('{"version": 0}')
+        with pretty_logging(stream=StringIO()) as s:
+            self.assertIsNone(dev.read_defines_manifest(source1))
+        self.assertIn('ignoring incompatible defines manifest', s.getvalue())
+
+    def test_write_defines_manifest_failure(self):
+        path = join(mkdtemp(self), 'missing', 'source1.js')
+        with pretty_logging(stream=StringIO()) as s:
+            self.assertIsNone(dev.write_defines_manifest(path, []))
+        self.assertIn('failed to write defines manifest', s.getvalue())
+
 
 class KarmaAbsentTestCase(unittest.TestCase):
     """
@@ -214,3 +336,48 @@ class KarmaTestCase(unittest.TestCase):
         self.assertEqual(['example/package/tests/test_some_module'], tests)
         self.assertEqual(
             ['preexported', 'example/package/tests/some_test_data'], deps)
+
+    def read_deps(self, spec):
+        with open(spec['karma_requirejs_test_script']) as fd:
+            script = parse(fd.read())
+        return json.loads(
+            script.children()[0].children()[0].initializer.to_ecma())
+
+    def test_karma_artifact_defines(self):
+        build_dir = mkdtemp(self)
+        artifact = join(build_dir, 'artifact.js')
+        with open(artifact, 'w') as fd:
+            fd.write("define('artifact/mod', [], function () {});\n")
+        spec = Spec(
+            karma_config=karma.build_base_config(),
+            build_dir=build_dir,
+            rjs_loader_plugin_registry=get(RJS_LOADER_PLUGIN_REGISTRY_NAME),
+            artifact_paths=[artifact],
+            cache_dir=join(build_dir, 'cache'),
+        )
+        with pretty_logging(stream=StringIO()):
+            karma_requirejs(spec)
+        self.assertEqual(self.read_deps(spec), ['artifact/mod'])
+        self.assertTrue(exists(join(build_dir, 'cache')))
+
+    def test_karma_artifact_defines_provided(self):
+        build_dir = mkdtemp(self)
+        spec = Spec(
+            karma_config=karma.build_base_config(),
+            build_dir=build_dir,
+            rjs_loader_plugin_registry=get(RJS_LOADER_PLUGIN_REGISTRY_NAME),
+            # would not be read
+            artifact_paths=[join(build_dir, 'missing.js')],
+            artifact_defines=['provided/mod'],
+        )
+        with pretty_logging(stream=StringIO()) as s:
+            karma_requirejs(spec)
+        self.assertEqual(self.read_deps(spec), ['provided/mod'])
+        self.assertNotIn('failed to read', s.getvalue())
+
+        # an empty list skips the extraction.
+        spec['artifact_defines'] = []
+        with pretty_logging(stream=StringIO()) as s:
+            karma_requirejs(spec)
+        self.assertEqual(self.read_deps(spec), [])
+        self.assertNotIn('failed to read', s.getvalue())
@@ -198,3 +198,50 @@ class DistIntegrationTestCase(unittest.TestCase):
         self.assertEqual(sorted(mapping.keys()), ['jquery', 'underscore'])
         self.assertEqual(mapping['jquery'], 'empty:')
         self.assertEqual(mapping['underscore'], 'empty:')
+
+    def test_memoized_working_set(self):
+        from calmjs import dist as calmjs_dist
+
+        calls = []
+
+        class CountingWorkingSet(object):
+            def __init__(self, working_set):
+                self.working_set = working_set
+
+            def find(self, req):
+                calls.append(('find', str(req)))
+                return self.working_set.find(req)
+
+            def resolve(self, requirements):
+                calls.append(('resolve', [str(r) for r in requirements]))
+                return self.working_set.resolve(requirements)
+
+        working_set = dist.MemoizedWorkingSet(
+            CountingWorkingSet(calmjs_dist.default_working_set))
+        registries = (self.registry_name, self.test_registry_name)
+        for method in ('all', 'explicit'):
+            self.assertEqual(dist.get_calmjs_module_registry_for(
+                ['site'], method=method, working_set=working_set,
+            ), dist.get_calmjs_module_registry_for(['site'], method=method))
+            self.assertEqual(dist.generate_transpile_source_maps(
+                ['site'], registries=registries, method=method,
+                working_set=working_set,
+            ), dist.generate_transpile_source_maps(
+                ['site'], registries=registries, method=method))
+            self.assertEqual(dist.generate_bundle_source_maps(
+                ['site'], self.dist_dir, method=method,
+                working_set=working_set,
+            ), dist.generate_bundle_source_maps(
+                ['site'], self.dist_dir, method=method))
+
+        # the graph is resolved once, and every package found once.
+        self.assertEqual(calls.count(('resolve', ['site'])), 1)
+        finds = [call for call in calls if call[0] == 'find']
+        self.assertEqual(len(finds), len(set(finds)))
+
+        site = working_set.find('site')
+        self.assertIs(site, working_set.find('site'))
+        self.assertEqual(str(site), str(site.dist))
+        self.assertEqual(site.project_name, 'site')
+        # the metadata read through the lookups are kept.
+        self.assertIn(calmjs_dist.EXTRAS_CALMJS_JSON, site.metadata)
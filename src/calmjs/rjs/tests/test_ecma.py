@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import unittest
+import threading
+import weakref
 
 from calmjs.rjs import ecma
 
@@ -9,8 +11,138 @@ class SpecUpdateSourceMapTestCase(unittest.TestCase):
     def test_parse(self):
         text = "process.stdout.write('hello world');"
         tree = ecma.parse(text)
-        parser = ecma._parser
+        parser = ecma.get_parser()
         self.assertEqual(text, tree.to_ecma())
         ecma.parse(text)
         # the parser is not mutated.
-        self.assertIs(parser, ecma._parser)
+        self.assertIs(parser, ecma.get_parser())
+
+    def test_parse_again_automatic_semicolon(self):
+        text = "var a = 1\nvar b = 2\n"
+        self.assertEqual(ecma.parse(text).to_ecma(), 'var a = 1;\nvar b = 2;')
+        self.assertEqual(ecma.parse(text).to_ecma(), 'var a = 1;\nvar b = 2;')
+
+    def test_parse_after_syntax_error(self):
+        with self.assertRaises(SyntaxError):
+            ecma.parse("var a = (1;\nvar b = 2;")
+        self.assertEqual(ecma.parse('var c = 3\n').to_ecma(), 'var c = 3;')
+
+    def test_parse_not_retained(self):
+        tree = weakref.ref(ecma.parse("var a = (1 + 2);"))
+        # the parser keeps no references to the tree it produced.
+        self.assertIsNone(tree())
+        with self.assertRaises(SyntaxError):
+            ecma.parse("var a = (1;")
+        self.assertIsNone(ecma.get_parser().lexer.lexer.lexdata)
+
+    def test_parse_threads(self):
+        texts = [
+            "define('mod%d', ['dep%d'], function(dep) {\n"
+            "    var a = [1, 2, 3]\n"
+            "    return a.map(function(v) { return v * %d })\n"
+            "});\n" % (i, i, i) for i in range(40)
+        ]
+        expected = [ecma.parse(text).to_ecma() for text in texts]
+        results = {}
+        parsers = {}
+
+        def run(idx):
+            parsers[idx] = ecma.get_parser()
+            results[idx] = [ecma.parse(text).to_ecma() for text in texts]
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {i: expected for i in range(4)})
+        # every thread had its own parser.
+        self.assertEqual(len(set(id(p) for p in parsers.values())), 4)
+        self.assertNotIn(ecma.get_parser(), parsers.values())
+
+    def test_parser_version(self):
+        from pkg_resources import get_distribution
+        self.assertEqual(ecma.parser_version(), 'slimit-%s' % (
+            get_distribution('slimit').version))
+        self.assertIs(ecma.parser_version(), ecma.parser_version())
+
+
+class TokenizeTestCase(unittest.TestCase):
+
+    def tokens(self, text):
+        return list(ecma.tokenize(text))
+
+    def test_basic(self):
+        self.assertEqual(self.tokens(
+            "var a = require('a'); // require('b')\n/* require('c') */"
+        ), [
+            ('name', 'var'), ('name', 'a'), ('punct', '='),
+            ('name', 'require'), ('punct', '('), ('string', "'a'"),
+            ('punct', ')'), ('punct', ';'),
+        ])
+
+    def test_bom(self):
+        self.assertEqual(self.tokens(u'﻿a'), [('name', 'a')])
+
+    def test_numbers_and_punctuators(self):
+        self.assertEqual(self.tokens('a.b >>>= 1.5e-3 === .5'), [
+            ('name', 'a'), ('punct', '.'), ('name', 'b'),
+            ('punct', '>>>='), ('number', '1.5e-3'), ('punct', '==='),
+            ('number', '.5'),
+        ])
+
+    def test_strings(self):
+        self.assertEqual(self.tokens(
+            r"""'it\'s' "say \"hi\"" 'a\
+b'"""), [
+            ('string', r"'it\'s'"),
+            ('string', r'"say \"hi\""'),
+            ('string', "'a\\\nb'"),
+        ])
+
+    def test_regex_or_division(self):
+        self.assertEqual(self.tokens("a = b / c / d"), [
+            ('name', 'a'), ('punct', '='), ('name', 'b'), ('punct', '/'),
+            ('name', 'c'), ('punct', '/'), ('name', 'd'),
+        ])
+        self.assertEqual(self.tokens("x = /'[/]'/g.test(y)")[2], (
+            'regex', "/'[/]'/g"))
+        self.assertEqual(self.tokens("(a) / 2")[3], ('punct', '/'))
+        self.assertEqual(self.tokens("if (a) /'/.test(b)")[4], (
+            'regex', "/'/"))
+        self.assertEqual(self.tokens("return /'/")[1], ('regex', "/'/"))
+        self.assertEqual(self.tokens("x[0] / 2")[4], ('punct', '/'))
+
+    def test_templates(self):
+        self.assertEqual(self.tokens("`a ${ {b: `c${d}`}.b } e` + f"), [
+            ('template', '`a ${'), ('punct', '{'), ('name', 'b'),
+            ('punct', ':'), ('template', '`c${'), ('name', 'd'),
+            ('template', '}`'), ('punct', '}'), ('punct', '.'),
+            ('name', 'b'), ('template', '} e`'), ('punct', '+'),
+            ('name', 'f'),
+        ])
+
+    def test_positions(self):
+        text = "a(/* b */ 'c', /d/) + `e${f}`"
+        tokens = list(ecma.tokenize(text, positions=True))
+        self.assertEqual([token[:2] for token in tokens], self.tokens(text))
+        self.assertEqual([text[pos:pos + len(value)] for (
+            kind, value, pos) in tokens], [value for (
+                kind, value, pos) in tokens])
+        self.assertEqual(tokens[2], ('string', "'c'", 10))
+
+    def test_syntax_errors(self):
+        with self.assertRaises(SyntaxError) as e:
+            self.tokens("a = 'unterminated;\nb = 1;")
+        self.assertEqual(
+            str(e.exception), 'unterminated string literal at 1:5')
+        with self.assertRaises(SyntaxError) as e:
+            self.tokens("a = 1;\n/* unterminated")
+        self.assertEqual(str(e.exception), 'unterminated comment at 2:1')
+        with self.assertRaises(SyntaxError):
+            self.tokens("`unterminated ${a}")
+        with self.assertRaises(SyntaxError):
+            self.tokens("`unterminated ${a")
+        with self.assertRaises(SyntaxError):
+            self.tokens("a = \x00;")
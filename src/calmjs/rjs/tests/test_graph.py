@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import unittest
+import sqlite3
+from os.path import join
+
+from calmjs.rjs import graph
+
+from calmjs.testing.utils import mkdtemp
+
+
+def module(modname, size=1, status=graph.OK):
+    return (
+        modname, modname + '.js', modname + '.js', 'transpiled', None,
+        graph.module_package(modname, None), size, status,
+    )
+
+
+class ModulePackageTestCase(unittest.TestCase):
+
+    def test_module_package(self):
+        self.assertEqual(graph.module_package(
+            'jquery', join('/src', 'node_modules', 'jquery', 'jquery.js')),
+            'jquery')
+        self.assertEqual(graph.module_package(
+            'lib', '/src/node_modules/a/node_modules/@scope/lib/lib.js'),
+            '@scope/lib')
+        self.assertEqual(graph.module_package(
+            'example/package/mod', '/src/example/package/mod.js'),
+            'example.package')
+        self.assertEqual(graph.module_package(
+            'text!example/package/data.txt', None), 'example.package')
+        self.assertIsNone(graph.module_package('mod', None))
+
+
+class ModuleGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = join(mkdtemp(self), 'graph.sqlite')
+        # a -> b -> c -> d, a -> c, e -> c, d -> b (a cycle)
+        self.graph = graph.ModuleGraph.create(self.path, [
+            module('pkg/a', 1),
+            module('pkg/b', 2),
+            module('pkg/c', 4),
+            module('pkg/d', 8),
+            module('other/e', 16),
+            module('missing', 0, graph.MISSING),
+        ], [
+            ('pkg/a', 'pkg/b'),
+            ('pkg/a', 'pkg/c'),
+            ('pkg/a', 'pkg/c'),
+            ('pkg/b', 'pkg/c'),
+            ('pkg/c', 'pkg/d'),
+            ('pkg/d', 'pkg/b'),
+            ('other/e', 'pkg/c'),
+            ('other/e', 'missing'),
+        ])
+        self.addCleanup(self.graph.close)
+
+    def test_modules(self):
+        self.assertEqual(self.graph.modnames(), [
+            'missing', 'other/e', 'pkg/a', 'pkg/b', 'pkg/c', 'pkg/d'])
+        self.assertEqual(self.graph.modnames(graph.MISSING), ['missing'])
+        self.assertEqual(self.graph.module('pkg/a'), {
+            'modname': 'pkg/a',
+            'source': 'pkg/a.js',
+            'target': 'pkg/a.js',
+            'kind': 'transpiled',
+            'plugin': None,
+            'package': 'pkg',
+            'size': 1,
+            'status': graph.OK,
+        })
+        self.assertIsNone(self.graph.module('nothing'))
+
+    def test_direct(self):
+        self.assertEqual(self.graph.requires('pkg/a'), ['pkg/b', 'pkg/c'])
+        self.assertEqual(self.graph.required_by('pkg/c'), [
+            'other/e', 'pkg/a', 'pkg/b'])
+        self.assertEqual(self.graph.required_by('pkg/a'), [])
+        self.assertEqual(self.graph.requires('nothing'), [])
+
+    def test_transitive(self):
+        self.assertEqual(self.graph.reachable('pkg/a'), [
+            'pkg/b', 'pkg/c', 'pkg/d'])
+        # part of the cycle, so reachable from itself.
+        self.assertEqual(self.graph.reachable('pkg/c'), [
+            'pkg/b', 'pkg/c', 'pkg/d'])
+        self.assertEqual(self.graph.dependents('pkg/b'), [
+            'other/e', 'pkg/a', 'pkg/b', 'pkg/c', 'pkg/d'])
+        self.assertEqual(self.graph.dependents('missing'), ['other/e'])
+        self.assertEqual(self.graph.reachable('nothing'), [])
+        self.assertEqual(self.graph.reachable_size('pkg/a'), 15)
+        self.assertEqual(self.graph.reachable_size('other/e'), 30)
+        self.assertEqual(self.graph.reachable_size('nothing'), 0)
+
+    def test_package_sizes(self):
+        self.assertEqual(self.graph.package_sizes(), [
+            ('other', 1, 16), ('pkg', 4, 15), (None, 1, 0)])
+
+    def test_reopen_replace(self):
+        self.graph.close()
+        with graph.ModuleGraph(self.path) as g:
+            self.assertEqual(g.requires('pkg/b'), ['pkg/c'])
+        graph.ModuleGraph.create(self.path, [module('mod')], []).close()
+        with graph.ModuleGraph(self.path) as g:
+            self.assertEqual(g.modnames(), ['mod'])
+
+    def test_open_invalid(self):
+        path = join(mkdtemp(self), 'graph.sqlite')
+        with self.assertRaises(IOError):
+            graph.ModuleGraph(path)
+        sqlite3.connect(path).close()
+        with self.assertRaises(ValueError):
+            graph.ModuleGraph(path)
+
+    def test_large(self):
+        count = 20000
+        path = join(mkdtemp(self), 'large.sqlite')
+        with graph.ModuleGraph.create(path, (
+                module('mod%d' % i) for i in range(count)), (
+                ('mod%d' % i, 'mod%d' % j)
+                for i in range(count) for j in (i + 1, i * 2)
+                if i < j < count)) as g:
+            self.assertEqual(len(g.reachable('mod0')), count - 1)
+            self.assertEqual(g.required_by('mod10'), ['mod5', 'mod9'])
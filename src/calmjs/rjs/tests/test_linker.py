@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from os.path import join
+
+from calmjs.rjs import linker
+
+from calmjs.testing.utils import mkdtemp
+
+
+class NormalizeTestCase(unittest.TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(linker.normalize('mod'), 'mod')
+        self.assertEqual(linker.normalize('mod', 'pkg/a'), 'mod')
+        self.assertEqual(linker.normalize('./b', 'pkg/a'), 'pkg/b')
+        self.assertEqual(linker.normalize('../b/c', 'pkg/sub/a'), 'pkg/b/c')
+        self.assertEqual(linker.normalize('./b', 'a'), 'b')
+        with self.assertRaises(linker.LinkerError):
+            linker.normalize('../b', 'a')
+
+
+class FindDefinesTestCase(unittest.TestCase):
+
+    def test_find_defines(self):
+        text = (
+            "define(['a'], function() {});\n"
+            "define('named', [], function() {});\n"
+            "// define(function() {});\n"
+            "a.define(); function define(x) {} x = 'define(';\n"
+            "define('plain');\n"
+        )
+        results = linker.find_defines(text)
+        self.assertEqual(results, [
+            (None, 7), ('named', 37),
+            (None, text.index("define('plain')") + 7)])
+        self.assertEqual(text[results[1][1]:].split(',')[0], "'named'")
+
+
+class LinkerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = mkdtemp(self)
+        self.out = join(self.base_dir, 'out.js')
+        self.config = {
+            'paths': {'jquery': 'empty:'},
+            'shim': {},
+            'wrap': True,
+            'wrapShim': True,
+            'include': [],
+            'out': 'out.js',
+        }
+
+    def write(self, path, text):
+        with open(join(self.base_dir, *path.split('/')), 'w') as fd:
+            fd.write(text)
+
+    def link(self, **kw):
+        self.config.update(kw)
+        modnames = linker.Linker(self.config, self.base_dir).link()
+        with open(self.out) as fd:
+            return modnames, fd.read()
+
+    def test_resolve(self):
+        self.config['paths'].update({
+            'lib': 'vendor/lib',
+            'lib/x': '/abs/x.js?',
+        })
+        rjs = linker.Linker(self.config, self.base_dir)
+        self.assertEqual(rjs.resolve('mod'), join(self.base_dir, 'mod.js'))
+        self.assertEqual(rjs.resolve('lib/a/b'), join(
+            self.base_dir, 'vendor', 'lib', 'a', 'b.js'))
+        self.assertEqual(rjs.resolve('lib/x'), '/abs/x.js')
+        self.assertEqual(rjs.resolve('data.txt', ext=''), join(
+            self.base_dir, 'data.txt'))
+        self.assertTrue(rjs.is_empty('jquery'))
+        self.assertFalse(rjs.is_empty('lib'))
+
+    def test_link_order(self):
+        self.write('a.js', (
+            "(function(define) {\n"
+            "    define(function (require, exports, module) {\n"
+            "        var b = require('./b');\n"
+            "        var t = require('text!data.txt');\n"
+            "    });\n"
+            "}(define));\n"
+        ))
+        self.write('b.js', (
+            "define(['jquery', 'c', 'module'], function($, c) {});"))
+        # a cycle, which is left for the loader to deal with.
+        self.write('c.js', "define(['b'], function(b) {});\n")
+        self.write('text.js', "define({load: function() {}});\n")
+        self.write('data.txt', 'hello "world"\n')
+        modnames, result = self.link(include=['a'])
+        self.assertEqual(modnames, ['c', 'b', 'text', 'text!data.txt', 'a'])
+        self.assertTrue(result.startswith('(function () {\n'))
+        self.assertTrue(result.endswith('\n}());\n'))
+        self.assertIn('    define("a", function (require', result)
+        self.assertIn('define("c", [\'b\']', result)
+        self.assertIn(
+            'define("text!data.txt", function () { return %s; });' % (
+                json.dumps('hello "world"\n')), result)
+        self.assertNotIn('jquery = ', result)
+
+    def test_link_non_amd(self):
+        self.write('legacy.js', 'var Legacy = {};\n')
+        self.write('dep.js', 'var Dep = {};\n')
+        self.write('plain.js', 'window.plain = true;\n')
+        self.write('other.js', "define('named', function() {});\n")
+        self.config['shim'] = {
+            'legacy': {'deps': ['dep'], 'exports': 'Legacy'},
+            'dep': ['jquery'],
+        }
+        modnames, result = self.link(
+            include=['legacy', 'plain', 'other'], wrap=False)
+        self.assertEqual(modnames, ['dep', 'legacy', 'plain', 'other'])
+        self.assertIn(
+            '(function(root) {\ndefine("legacy", ["dep"], function() {\n'
+            '  return (function() {\nvar Legacy = {};\n\nreturn Legacy;\n'
+            '  }).apply(root, arguments);\n});\n}(this));\n', result)
+        self.assertIn('define("dep", ["jquery"], function() {', result)
+        self.assertIn(
+            'window.plain = true;\n\ndefine("plain", function(){});', result)
+        self.assertIn('define("other", function(){});', result)
+        self.assertFalse(result.startswith('(function () {'))
+
+        modnames, result = self.link(include=['legacy'], wrapShim=False)
+        self.assertIn(
+            'var Legacy = {};\n\n'
+            'define("legacy", ["dep"], function () { return Legacy; });',
+            result)
+
+    def test_link_exclude(self):
+        self.write('a.js', "define(['b'], function() {});\n")
+        self.write('b.js', "define(['c'], function() {});\n")
+        self.write('c.js', "define([], function() {});\n")
+        self.write('d.js', "define(['a', 'c'], function() {});\n")
+        modnames, result = self.link(
+            include=['d'], exclude=['b'], wrap={'start': '/* s */\n'})
+        self.assertEqual(modnames, ['a', 'd'])
+        self.assertTrue(result.startswith('/* s */\ndefine("a", '))
+
+    def test_link_deep(self):
+        count = 5000
+        for i in range(count):
+            self.write('m%d.js' % i, "define(['m%d'], function() {});\n" % (
+                i + 1))
+        self.write('m%d.js' % count, "define([], function() {});\n")
+        modnames, result = self.link(include=['m0'])
+        self.assertEqual(len(modnames), count + 1)
+        self.assertEqual(modnames[0], 'm%d' % count)
+
+    def test_link_errors(self):
+        self.write('anon.js', "define(function() {}); define([], 1);\n")
+        self.write('bad.js', "define(function() { 'unterminated });\n")
+        self.write('plugin.js', "define(['css!style'], function() {});\n")
+        for include, message in (
+                (['missing'], "module 'missing' not found at '%s'" % join(
+                    self.base_dir, 'missing.js')),
+                (['anon'], "module 'anon' has multiple anonymous define"),
+                (['bad'], "syntax error in module 'bad'"),
+                (['plugin'], "loader plugin 'css' required for 'css!style' "
+                             "is not supported")):
+            with self.assertRaises(linker.LinkerError) as e:
+                self.link(include=include)
+            self.assertIn(message, str(e.exception))
+
+        self.write('a.js', "define([], function() {});\n")
+        with self.assertRaises(linker.LinkerError) as e:
+            self.link(include=['a'], wrap={'startFile': 'start.frag'})
+        self.assertIn('only the start and end of wrap', str(e.exception))
+
+    def test_link_build_manifest(self):
+        self.write('a.js', "define([], function() {});\n")
+        self.config.update(include=['a'], out=self.out)
+        path = join(self.base_dir, 'build.js')
+        with open(path, 'w') as fd:
+            fd.write('(\n%s\n)' % json.dumps(self.config))
+        self.assertEqual(linker.link_build_manifest(path), ['a'])
+        with open(self.out) as fd:
+            self.assertIn('define("a", [], function() {});', fd.read())
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import unittest
+from os.path import exists
+from os.path import join
+
+from calmjs.rjs import minify
+from calmjs.rjs.cache import ContentCache
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.utils import pretty_logging
+
+
+class MinifyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+
+    def write(self, name, text):
+        path = join(self.tmpdir, name)
+        with open(path, 'w') as fd:
+            fd.write(text)
+        return path
+
+    def test_minify_slimit(self):
+        self.assertEqual(minify.minify_slimit(
+            "define(function (require, exports, module) {\n"
+            "    // a comment\n"
+            "    var value = require('value');\n"
+            "    exports.value = value + 1;\n"
+            "});\n"
+        ), [
+            "define(function(require,exports,module){"
+            "var value=require('value');exports.value=value+1;});"
+        ])
+
+    def test_minify_paths(self):
+        paths = [
+            self.write('a.js', 'var a = 1;\n'),
+            self.write('b.js', 'var b = ;\n'),
+            join(self.tmpdir, 'missing.js'),
+        ]
+        targets = [
+            join(self.tmpdir, 'min', 'sub', name)
+            for name in ('a.js', 'b.js', 'missing.js')
+        ]
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()) as s:
+            result = minify.minify_paths(
+                paths, targets, minify.minify_slimit)
+        self.assertEqual(result, [True, False, False])
+        self.assertIn("syntax error in '%s'" % paths[1], s.getvalue())
+        self.assertIn("failed to read '%s'" % paths[2], s.getvalue())
+        with open(targets[0]) as fd:
+            self.assertEqual(fd.read(), 'var a=1;')
+        self.assertFalse(exists(targets[1]))
+
+    def test_minify_paths_cache_processes(self):
+        cache = ContentCache(join(self.tmpdir, 'cache'), 'minify')
+        paths = [self.write('m%d.js' % i, 'var m = %d;' % i) for i in (1, 2)]
+        targets = [join(self.tmpdir, 'out%d.js' % i) for i in (1, 2)]
+        self.assertEqual(minify.minify_paths(
+            paths, targets, minify.minify_slimit, cache=cache,
+            processes=2), [True, True])
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(minify.minify_paths(
+            paths, targets, minify.minify_slimit, cache=cache), [True, True])
+        self.assertEqual(cache.hits, 2)
+        with open(targets[1]) as fd:
+            self.assertEqual(fd.read(), 'var m=2;')
@@ -47,7 +47,7 @@ class LoaderPluginRegistryTestCase(unittest.TestCase):
         with pretty_logging(stream=StringIO()) as stream:
             registry = LoaderPluginRegistry(
                 'calmjs.rjs.loader_plugin', _working_set=working_set)
-        self.assertIsNone(registry.get('not_plugin'))
+            self.assertIsNone(registry.get('not_plugin'))
         self.assertIn(
             "registry 'calmjs.rjs.loader_plugin' failed to load loader plugin "
             "handler for entry point 'not_plugin =", stream.getvalue(),
@@ -61,7 +61,7 @@ class LoaderPluginRegistryTestCase(unittest.TestCase):
         with pretty_logging(stream=StringIO()) as stream:
             registry = LoaderPluginRegistry(
                 'calmjs.rjs.loader_plugin', _working_set=working_set)
-        self.assertIsNone(registry.get('not_plugin'))
+            self.assertIsNone(registry.get('not_plugin'))
         self.assertIn(
             "'not_plugin = calmjs.rjs.tests.test_registry:NotPlugin' does not "
             "lead to a valid loader plugin handler class",
@@ -76,7 +76,7 @@ class LoaderPluginRegistryTestCase(unittest.TestCase):
         with pretty_logging(stream=StringIO()) as stream:
             registry = LoaderPluginRegistry(
                 'calmjs.rjs.loader_plugin', _working_set=working_set)
-        self.assertIsNone(registry.get('bad_plugin'))
+            self.assertIsNone(registry.get('bad_plugin'))
         self.assertIn(
             "the loader plugin class registered at 'bad_plugin = "
             "calmjs.rjs.tests.test_registry:BadPlugin' failed "
@@ -94,13 +94,50 @@ class LoaderPluginRegistryTestCase(unittest.TestCase):
         with pretty_logging(stream=StringIO()) as stream:
             registry = LoaderPluginRegistry(
                 'calmjs.rjs.loader_plugin', _working_set=working_set)
+            # the second one will be registered
+            self.assertTrue(isinstance(registry.get('text'), TextPlugin))
         self.assertIn(
             "loader plugin handler for 'text' was already registered to an "
             "instance of 'calmjs.rjs.tests.test_registry:DupePlugin'",
             stream.getvalue()
         )
-        # the second one will be registered
-        self.assertTrue(isinstance(registry.get('text'), TextPlugin))
+
+    def test_initialize_dupe_plugin_failure(self):
+        # a later entry point that fails will not override the earlier.
+        working_set = WorkingSet({'calmjs.rjs.loader_plugin': [
+            'text = calmjs.rjs.plugin:TextPlugin',
+            'text = calmjs.rjs.tests.test_registry:BadPlugin',
+        ]})
+        with pretty_logging(stream=StringIO()) as stream:
+            registry = LoaderPluginRegistry(
+                'calmjs.rjs.loader_plugin', _working_set=working_set)
+            self.assertTrue(isinstance(registry.get('text'), TextPlugin))
+        self.assertIn("failed to be instantiated", stream.getvalue())
+        self.assertNotIn("already registered", stream.getvalue())
+
+    def test_initialize_lazy(self):
+        working_set = WorkingSet({'calmjs.rjs.loader_plugin': [
+            'text = calmjs.rjs.plugin:TextPlugin',
+            'not_plugin = calmjs.rjs.not_plugin:nothing',
+        ]})
+        with pretty_logging(stream=StringIO()) as stream:
+            registry = LoaderPluginRegistry(
+                'calmjs.rjs.loader_plugin', _working_set=working_set)
+        # nothing is loaded until requested.
+        self.assertEqual(stream.getvalue(), '')
+        self.assertEqual(dict(registry.records), {})
+
+        text = registry.get('text')
+        self.assertTrue(isinstance(text, TextPlugin))
+        self.assertIs(registry.get('text'), text)
+        self.assertEqual(list(registry.records), ['text'])
+
+        # a failed load is only attempted and logged once.
+        with pretty_logging(stream=StringIO()) as stream:
+            self.assertIsNone(registry.get('not_plugin'))
+            self.assertIsNone(registry.get('not_plugin'))
+        self.assertEqual(stream.getvalue().count('failed to load'), 1)
+        self.assertIsNone(registry.get('no_such_plugin'))
 
     def test_initialize_integration(self):
         # Use the global set and see that the defaults are registered
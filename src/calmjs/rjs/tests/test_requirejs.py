@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
 import unittest
+import random
+import weakref
+from collections import OrderedDict
 from os.path import join
+from slimit.ast import FunctionCall
+from slimit.ast import Identifier
 from slimit.ast import String
 
+from calmjs.rjs.testing import benchmark
 from calmjs.rjs import requirejs
+from calmjs.rjs.ecma import parse
 from calmjs.utils import pretty_logging
 
 from calmjs.testing.mocks import StringIO
 from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
 
 # an example bundle including webpack blobs and requirejs AMD blobs
 artifact = """
@@ -142,6 +150,41 @@ var dynamic = define([target], function(target_mod) {});
 """
 
 
+def reference_defines(node):
+    # the defines with their requires, as done by the original recursive
+    # visitor within extract_defines_with_deps_visitor.
+    for child in node:
+        if isinstance(child, FunctionCall) and isinstance(
+                child.identifier, Identifier):
+            if child.identifier.value == 'define' and child.args and (
+                    isinstance(child.args[0], String)):
+                yield [requirejs.to_str(child.args[0]), list(
+                    requirejs.extract_function_argument_visitor(
+                        child, 'require', 0, String))]
+        else:
+            for value in reference_defines(child):
+                yield value
+
+
+def reference_order(defines):
+    # the ordering of the defines as done by the original recursive
+    # generator within extract_defines_with_deps_visitor.
+    yielded = set()
+
+    def process_defines(modname):
+        if modname not in yielded:
+            for modname_ in defines.get(modname, ()):
+                for mn in process_defines(modname_):
+                    yield mn
+            if modname in defines:
+                yielded.add(modname)
+                yield modname
+
+    for modname in defines.keys():
+        for mn in process_defines(modname):
+            yield mn
+
+
 class ToStrTestCase(unittest.TestCase):
     """
     Test that the to_str function does operate correctly on edge cases.
@@ -304,6 +347,139 @@ class RequireJSHelperTestCase(unittest.TestCase):
             sorted(set(requirejs.extract_all_amd_requires(src)))
         )
 
+    def test_extract_deeply_nested(self):
+        # past the default recursion limit for the recursive visitors.
+        tree = parse(benchmark.generate_nested_source(1200))
+        self.assertEqual(len(list(
+            requirejs.extract_function_argument_visitor(
+                tree, 'define', 0, String))), 1200)
+        self.assertEqual(list(requirejs.extract_function_argument_visitor(
+            tree, 'require', 0, String))[:2], ['nested/dep0', 'nested/dep1'])
+        results = list(requirejs.extract_all_amd_requires_visitor(tree))
+        self.assertEqual(len(results), 2400)
+        self.assertEqual(results[:3], [
+            'nested/dep0', 'nested/dep0', 'nested/dep1'])
+        with pretty_logging(stream=StringIO()):
+            self.assertEqual(len(list(
+                requirejs.extract_defines_with_deps_visitor(
+                    [('<text>', tree)]))), 1200)
+
+    def test_visitors_order_same_as_recursive(self):
+        for source in (
+                artifact, artifact_multiple1, artifact_multiple2,
+                commonjs_require, requirejs_require,
+                benchmark.generate_nested_source(20)):
+            tree = parse(source)
+            for f_name in ('define', 'require'):
+                self.assertEqual(
+                    list(requirejs.extract_function_argument_visitor(
+                        tree, f_name, 0, String)),
+                    list(benchmark.recursive_function_argument_visitor(
+                        tree, f_name, 0, String)),
+                )
+            self.assertEqual(
+                list(requirejs.extract_all_amd_requires_visitor(tree)),
+                list(benchmark.recursive_all_amd_requires_visitor(tree)),
+            )
+
+    def test_extract_dependencies(self):
+        self.assertEqual(requirejs.extract_dependencies(
+            "define('mod1', ['mod2', 'module'], function(mod2) {\n"
+            "    var mod3 = require('mod3');\n"
+            "    wrapped(function() { define('mod4', require('mod5')); });\n"
+            "});\n"
+            "define('mod6', []);\n"
+        ), [
+            [['mod1', ['mod3']], ['mod6', []]],
+            ['mod2', 'mod3', 'mod5'],
+        ])
+
+    def test_extract_dependencies_same_as_visitors(self):
+        for source in (
+                artifact, artifact_multiple1, artifact_multiple2,
+                artifact_multiple3, artifact_multiple4,
+                commonjs_require, requirejs_require,
+                benchmark.generate_nested_source(20)):
+            tree = parse(source)
+            defines, requires = requirejs.extract_dependencies_visitor(tree)
+            self.assertEqual(requires, list(
+                requirejs.extract_all_amd_requires_visitor(tree)))
+            self.assertEqual(defines, list(reference_defines(tree)))
+
+    def test_order_defines_same_as_recursive(self):
+        rand = random.Random(0)
+        names = ['mod%d' % i for i in range(300)]
+        rand.shuffle(names)
+        # every module only requires those before it, and some that are
+        # missing, so that there are no cycles.
+        named_defines = [('<text>', [
+            [name, [
+                rand.choice(names[:idx] + ['missing'])
+                for _ in range(rand.randint(0, 4))
+            ] if idx else []]
+            for idx, name in enumerate(names)
+        ])]
+        defines = OrderedDict(
+            (name, deps) for name, deps in named_defines[0][1])
+        with pretty_logging(stream=StringIO()):
+            self.assertEqual(
+                list(requirejs.order_defines_with_deps(named_defines)),
+                list(reference_order(defines)),
+            )
+
+    def test_order_defines_cycle(self):
+        with pretty_logging(stream=StringIO()) as stream:
+            result = list(requirejs.order_defines_with_deps([('<text>', [
+                ['lib1', ['lib2']],
+                ['lib2', ['lib3']],
+                ['lib3', ['lib1', 'lib4']],
+                ['lib4', []],
+            ])]))
+        self.assertEqual(['lib4', 'lib3', 'lib2', 'lib1'], result)
+        self.assertIn(
+            'circular dependency between modules: '
+            'lib1 -> lib2 -> lib3 -> lib1', stream.getvalue())
+
+    def test_order_defines_deep(self):
+        # deep chains well beyond the recursion limit.
+        count = 30000
+        named_defines = [('<text>', [
+            ['mod%d' % i, ['mod%d' % (i + 1)] if i + 1 < count else []]
+            for i in range(count)
+        ])]
+        result = list(requirejs.order_defines_with_deps(named_defines))
+        self.assertEqual(len(result), count)
+        self.assertEqual(result[0], 'mod%d' % (count - 1))
+        self.assertEqual(result[-1], 'mod0')
+
+    def test_extract_defines_with_deps_from_paths(self):
+        tmpdir = mkdtemp(self)
+        paths = []
+        for idx, source in enumerate((
+                artifact_multiple2, 'define(;', artifact)):
+            paths.append(join(tmpdir, 'artifact%d.js' % idx))
+            with open(paths[-1], 'w') as fd:
+                fd.write(source)
+        paths.append(join(tmpdir, 'missing.js'))
+
+        trees = []
+
+        def tracked_parse(text):
+            # all trees parsed previously should have been discarded.
+            self.assertEqual([ref() for ref in trees], [None] * len(trees))
+            tree = parse(text)
+            trees.append(weakref.ref(tree))
+            return tree
+
+        stub_item_attr_value(self, requirejs, 'parse', tracked_parse)
+        with pretty_logging(stream=StringIO()) as stream:
+            result = requirejs.extract_defines_with_deps_from_paths(paths)
+        self.assertEqual(['lib3', 'lib2', 'lib1', 'lib4'], result)
+        self.assertEqual(len(trees), 2)
+        self.assertIn('syntax error in', stream.getvalue())
+        self.assertIn('failed to read', stream.getvalue())
+        self.assertIn("module 'lib1' defined again", stream.getvalue())
+
     def test_extract_read_from_file(self):
         tmpdir = mkdtemp(self)
         src_file = join(tmpdir, 'source.js')
@@ -347,3 +523,150 @@ class RequireJSHelperTestCase(unittest.TestCase):
         self.assertIsNone(result)
         self.assertIn('No such file or directory:', stream.getvalue())
         self.assertIn(src_file, stream.getvalue())
+
+    def test_process_paths(self):
+        tmpdir = mkdtemp(self)
+        src_file1 = join(tmpdir, 'source1.js')
+        src_file2 = join(tmpdir, 'source2.js')
+        src_file3 = join(tmpdir, 'source3.js')
+        missing = join(tmpdir, 'missing.js')
+
+        with open(src_file1, 'w') as fd:
+            fd.write(requirejs_require)
+        with open(src_file2, 'w') as fd:
+            fd.write("define([], function () { return 'blah' }")
+        with open(src_file3, 'w') as fd:
+            fd.write(commonjs_require)
+
+        paths = [src_file1, src_file2, missing, src_file3]
+        with pretty_logging(stream=StringIO()) as stream:
+            serial = requirejs.process_paths(
+                paths, requirejs.extract_all_amd_requires)
+
+        self.assertEqual(serial[0], list(
+            requirejs.extract_all_amd_requires(requirejs_require)))
+        self.assertIsNone(serial[1])
+        self.assertIsNone(serial[2])
+        self.assertEqual(serial[3], ['mod1', 'name/mod/mod2'])
+        # strip the timestamps
+        serial_log = [
+            line.split(' ', 2)[-1] for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(serial_log), 2)
+        self.assertIn("syntax error in '%s'" % src_file2, serial_log[0])
+        self.assertIn("failed to read '%s'" % missing, serial_log[1])
+
+        with pretty_logging(stream=StringIO()) as stream:
+            pooled = requirejs.process_paths(
+                paths, requirejs.extract_all_amd_requires, processes=2)
+
+        # identical results and logs, in the same order.
+        self.assertEqual(serial, pooled)
+        self.assertEqual(serial_log, [
+            line.split(' ', 2)[-1] for line in stream.getvalue().splitlines()])
+
+    def test_process_paths_empty(self):
+        self.assertEqual([], requirejs.process_paths(
+            [], requirejs.extract_all_amd_requires, processes=0))
+
+
+# sources that have constructs that may trip up the token based scanner.
+scanner_edge_cases = [
+    # calls on members, results of calls and parenthesized identifiers.
+    "a.require('no'); require('yes')('no'); (require)('paren');",
+    "((require))(('double')); new require('new'); x.define(['no'], "
+    "function() {});",
+    # comments, strings, regex and template literals hiding calls.
+    "// require('comment')\n/* define(['c'], function() {}) */",
+    "var s = \"require('string')\"; var r = /require\\('regex'\\)/g;",
+    "var r = [/[/]require('x')/]; var c = a / require('div') / 2;",
+    # nested calls, with and without going inside.
+    "require(['outer'], function() { require(['inner'], function() {}); "
+    "define(require('nested'), []); });",
+    "require('first', function() { require('skipped'); });",
+    "define(['a', , 'b', ], function() {}); define([], function() {});",
+    "define(('named'), [('require'), 'exports', ('dep')], function() {});",
+    "define(['exports', 'require', 'module'], function() {});",
+    "require(['a'], function named(a) { return a; }, 'extra');",
+    "define('x', [], function() {}, 'extra'); define(['a'], 'str');",
+    "define([x ? 'a' : 'b', 'c'], function() {});",
+    "define(['a' + 'b', 'c'.d, {}, ['e']], function() {});",
+    "for (var i = 0; i < 1; i++) (function() { require('loop'); })();",
+    "function require(x) {} function define() {} require('decl');",
+    "var o = { require: function() {}, b: require('prop') };",
+]
+
+
+class ScannerTestCase(unittest.TestCase):
+    """
+    The token based scanner implementations must produce results that
+    are identical to the tree based implementations.
+    """
+
+    corpus = [
+        artifact, artifact_multiple1, artifact_multiple2,
+        artifact_multiple3, artifact_multiple4, commonjs_require,
+        requirejs_require,
+    ] + scanner_edge_cases
+
+    def assertScanMatches(self, extract, scan, *a):
+        for text in self.corpus:
+            self.assertEqual(list(extract(text, *a)), scan(text, *a), text)
+
+    def test_scan_function_argument(self):
+        self.assertScanMatches(
+            requirejs.extract_function_argument,
+            requirejs.scan_function_argument, 'trial', 2,
+        )
+        self.assertScanMatches(
+            requirejs.extract_function_argument,
+            requirejs.scan_function_argument, 'require', 0,
+        )
+        self.assertEqual(requirejs.scan_function_argument("""
+        (function() {
+            trial(1, 2, 'hello', trial(1, 2, 'goodbye'));
+            trial(1, 2, (function() { trial(1, 2, 'goodbye')})());
+            trial(1, 2, ('paren'), 3);
+            trial(1, 2);
+        })();
+        """, 'trial', 2), ['hello', 'paren'])
+
+    def test_scan_defines(self):
+        self.assertScanMatches(
+            requirejs.extract_defines, requirejs.scan_defines)
+
+    def test_scan_requires(self):
+        self.assertScanMatches(
+            requirejs.extract_requires, requirejs.scan_requires)
+
+    def test_scan_all_amd_requires(self):
+        self.assertScanMatches(
+            requirejs.extract_all_amd_requires,
+            requirejs.scan_all_amd_requires,
+        )
+        self.assertEqual(requirejs.scan_all_amd_requires(
+            "define(['a', , 'b', ], function() {});"
+            "define(['exports', 'require', 'module'], function() {});"
+        ), ['a', 'b', 'exports', 'require'])
+
+    def test_scan_on_syntax_error(self):
+        with self.assertRaises(SyntaxError):
+            requirejs.scan_all_amd_requires("""
+            (function() {
+                missing_rparen(1, 2, 'hello';
+            })();
+            """)
+        with self.assertRaises(SyntaxError):
+            requirejs.scan_all_amd_requires("define([}, function() {});")
+        with self.assertRaises(SyntaxError):
+            requirejs.scan_all_amd_requires("define(['a'], function() {}")
+
+    def test_scan_read_from_file(self):
+        tmpdir = mkdtemp(self)
+        src_file = join(tmpdir, 'source.js')
+        with open(src_file, 'w') as fd:
+            fd.write(requirejs_require)
+        self.assertEqual(
+            requirejs.process_path(src_file, requirejs.scan_all_amd_requires),
+            list(requirejs.process_path(
+                src_file, requirejs.extract_all_amd_requires)),
+        )
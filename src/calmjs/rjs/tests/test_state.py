@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+import os
+from os.path import join
+
+from calmjs.utils import pretty_logging
+
+from calmjs.rjs import state
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+
+
+class HelpersTestCase(unittest.TestCase):
+
+    def test_file_stamp_digest(self):
+        tmpdir = mkdtemp(self)
+        path = join(tmpdir, 'file.js')
+        self.assertIsNone(state.file_stamp(path))
+        self.assertIsNone(state.file_digest(path))
+        with open(path, 'w') as fd:
+            fd.write('text')
+        self.assertEqual(state.file_stamp(path)[1], 4)
+        self.assertEqual(state.file_digest(path), state.text_digest('text'))
+
+    def test_walk_files(self):
+        tmpdir = mkdtemp(self)
+        os.mkdir(join(tmpdir, 'sub'))
+        for name in ('b.js', 'a.js', join('sub', 'c.js')):
+            with open(join(tmpdir, name), 'w'):
+                pass
+        self.assertEqual(state.walk_files(tmpdir), [
+            join(tmpdir, 'a.js'), join(tmpdir, 'b.js'),
+            join(tmpdir, 'sub', 'c.js'),
+        ])
+        self.assertEqual(
+            state.walk_files(join(tmpdir, 'a.js')), [join(tmpdir, 'a.js')])
+
+
+class BuildStateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.source = join(self.tmpdir, 'source.js')
+        self.target = join(self.tmpdir, 'target.js')
+        self.path = join(self.tmpdir, 'build_state.json')
+        for path in (self.source, self.target):
+            with open(path, 'w') as fd:
+                fd.write('source')
+
+    def test_update_is_current(self):
+        s = state.BuildState(self.path)
+        self.assertFalse(s.is_current('key', [self.source], [self.target]))
+        s.update('key', [self.source], [self.target], extra=[1], result='r')
+        self.assertTrue(s.is_current(
+            'key', [self.source], [self.target], extra=[1]))
+        self.assertEqual(s.result('key'), 'r')
+        # different arguments
+        self.assertFalse(s.is_current(
+            'key', [self.source], [self.target], extra=[2]))
+        self.assertFalse(s.is_current('key', [self.source], extra=[1]))
+        self.assertFalse(s.is_current('key', [self.target], extra=[1]))
+
+    def test_source_changes(self):
+        s = state.BuildState(self.path)
+        s.update('key', [self.source])
+
+        # same contents but different stamp is still current.
+        os.utime(self.source, (1, 1))
+        self.assertTrue(s.is_current('key', [self.source]))
+        self.assertEqual(
+            s.records['key']['sources'][self.source][:2],
+            state.file_stamp(self.source),
+        )
+
+        with open(self.source, 'w') as fd:
+            fd.write('changed')
+        self.assertFalse(s.is_current('key', [self.source]))
+
+        os.remove(self.source)
+        self.assertFalse(s.is_current('key', [self.source]))
+
+    def test_target_changes(self):
+        s = state.BuildState(self.path)
+        s.update('key', [self.source], [self.target])
+        os.utime(self.target, (1, 1))
+        self.assertFalse(s.is_current('key', [self.source], [self.target]))
+
+    def test_save_load_prune(self):
+        s = state.BuildState(self.path)
+        s.update('key1', [self.source], result=['a'])
+        s.update('key2', [self.source], [self.target])
+        s.save()
+
+        loaded = state.BuildState.load(self.path)
+        self.assertEqual(loaded.records, s.records)
+        self.assertEqual(loaded.touched, set())
+        self.assertTrue(loaded.is_current('key1', [self.source]))
+        self.assertEqual(loaded.touched_paths(), [self.source])
+        loaded.prune()
+        self.assertEqual(sorted(loaded.records), ['key1'])
+
+    def test_fork(self):
+        s = state.BuildState(self.path)
+        s.update('old', [self.source])
+        s.touched.clear()
+        fork1 = s.fork()
+        fork2 = s.fork()
+        fork1.update('key1', [self.source])
+        self.assertTrue(fork2.is_current('key1', [self.source]))
+        self.assertEqual(fork1.touched, {'key1'})
+        self.assertEqual(fork2.touched, {'key1'})
+        self.assertEqual(s.touched, {'key1'})
+        # only the parent prunes.
+        fork1.prune()
+        self.assertIn('old', s.records)
+        fork1.save()
+        self.assertTrue(os.path.exists(self.path))
+        s.prune()
+        self.assertEqual(sorted(fork2.records), ['key1'])
+
+    def test_load_missing(self):
+        with pretty_logging(stream=StringIO()) as s:
+            loaded = state.BuildState.load(self.path)
+        self.assertEqual(loaded.records, {})
+        self.assertEqual(s.getvalue(), '')
+
+    def test_load_incompatible(self):
+        with open(self.path, 'w') as fd:
+            json.dump({'version': 0, 'records': {'key': {}}}, fd)
+        self.assertEqual(state.BuildState.load(self.path).records, {})
+
+    def test_load_corrupted(self):
+        with open(self.path, 'w') as fd:
+            fd.write('{')
+        with pretty_logging(stream=StringIO()) as s:
+            loaded = state.BuildState.load(self.path)
+        self.assertEqual(loaded.records, {})
+        self.assertIn('ignoring corrupted build state', s.getvalue())
+
+    def test_load_failure(self):
+        with pretty_logging(stream=StringIO()) as s:
+            loaded = state.BuildState.load(self.tmpdir)
+        self.assertEqual(loaded.records, {})
+        self.assertIn('failed to read build state', s.getvalue())
+
+    def test_save_failure(self):
+        s = state.BuildState(self.tmpdir)
+        with pretty_logging(stream=StringIO()) as stream:
+            s.save()
+        self.assertIn('failed to write build state', stream.getvalue())
@@ -2,13 +2,17 @@
 from __future__ import unicode_literals
 
 import unittest
+import codecs
 import json
 import os
+from os.path import basename
+from os.path import dirname
 from os.path import exists
 from os.path import join
 
 from io import StringIO
 
+from calmjs.registry import get
 from calmjs.toolchain import Spec
 from calmjs.toolchain import CONFIG_JS_FILES
 from calmjs.vlqsm import SourceWriter
@@ -16,7 +20,11 @@ from calmjs.npm import get_npm_version
 from calmjs.utils import pretty_logging
 
 from calmjs.rjs.ecma import parse
+from calmjs.rjs.testing import benchmark
+from calmjs.rjs import dev
+from calmjs.rjs import graph
 from calmjs.rjs import toolchain
+from calmjs.rjs.worker import resolve_build_config
 
 from calmjs.testing import utils
 from calmjs.testing import mocks
@@ -276,6 +284,56 @@ class TranspilerTestCase(unittest.TestCase):
         self.assertNotEqual('console.log("Hello");', result)
         self.assertIn('console.log("Hello");', result)
 
+    def test_transpile_modname_source_target_passthrough(self):
+        src_dir = utils.mkdtemp(self)
+        tgt_dir = utils.mkdtemp(self)
+        source = b"'use strict';\n\ndefine(['a'], function(a) {\r\n});\n"
+        src_file = join(src_dir, 'module.js')
+        with open(src_file, 'wb') as fd:
+            fd.write(source)
+
+        rjs = toolchain.RJSToolchain()
+        with pretty_logging(logger='calmjs', stream=mocks.StringIO()) as s:
+            rjs.transpile_modname_source_target(
+                Spec(build_dir=tgt_dir), 'module', src_file, 'sub/module.js')
+        self.assertIn('Copying %s' % src_file, s.getvalue())
+        with open(join(tgt_dir, 'sub', 'module.js'), 'rb') as fd:
+            self.assertEqual(fd.read(), source)
+
+        # identical to what the transpiler would have produced
+        stream = StringIO()
+        with open(src_file) as reader:
+            toolchain._rjs_transpiler(Spec(), reader, stream)
+        with open(join(tgt_dir, 'sub', 'module.js')) as fd:
+            self.assertEqual(fd.read(), stream.getvalue())
+
+    def test_transpile_modname_source_target_no_passthrough(self):
+        src_file = join(utils.mkdtemp(self), 'module.js')
+        tgt_dir = utils.mkdtemp(self)
+        with open(src_file, 'w') as fd:
+            fd.write("define(['a'], function(a) {});\n")
+
+        rjs = toolchain.RJSToolchain()
+        # source maps are generated through the transpiler
+        with pretty_logging(logger='calmjs', stream=mocks.StringIO()) as s:
+            rjs.transpile_modname_source_target(Spec(
+                build_dir=tgt_dir, generate_source_map=True,
+            ), 'module', src_file, 'module.js')
+        self.assertIn('Transpiling %s' % src_file, s.getvalue())
+        self.assertTrue(exists(join(tgt_dir, 'module.js.map')))
+
+        # as is a different transpiler
+        rjs.transpiler = toolchain._null_transpiler
+        self.assertFalse(rjs.passthrough_modname_source_target(
+            Spec(build_dir=tgt_dir), 'module', src_file, 'module.js'))
+
+        # also not the modules that require transpiling
+        rjs = toolchain.RJSToolchain()
+        with open(src_file, 'w') as fd:
+            fd.write("var a = require('a');\n")
+        self.assertFalse(rjs.passthrough_modname_source_target(
+            Spec(build_dir=tgt_dir), 'module', src_file, 'module.js'))
+
     def test_transpile_modname_source_target_empty(self):
         modname = 'module'
         src_file = 'empty:'
@@ -287,6 +345,98 @@ class TranspilerTestCase(unittest.TestCase):
         self.assertFalse(exists(tgt_file))
 
 
+class BlockTranspilerTestCase(unittest.TestCase):
+    """
+    The block based transpilers must produce output identical to the
+    line based ones.
+    """
+
+    sources = [
+        '',
+        '\n',
+        'var a = 1;',
+        'var a = 1;\n',
+        '\n\n\n\n\nvar a = 1;\n\n\n  \n    var b = 2;\n}',
+        '\n  \n',
+        '  \n  ',
+        '"use strict";\n\n\nvar a = 1;\n',
+        "'use strict';",
+        "'use strict';\n\n\n\n\n\nvar a = 1;\n\n",
+        'var a = "\x0c";\nvar b = "\u2028";\n\nvar c;\n',
+        'var a = 1;\r\nvar b = 2;\rvar c = 3;\n',
+        'var a = 1;\r\n\r\n\r\rvar b = 2;\r',
+        'var a = "\x0c";\r\n  \x1c\n\n\u2029var b;',
+        '\tvar x;\n' * 50 + '\n' * 10 + 'var y;',
+    ]
+
+    def assertTranspiled(self, block, line, spec):
+        path = join(utils.mkdtemp(self), 'source.js')
+
+        def codecs_reader(source):
+            # the reader as used by the toolchain.
+            with open(path, 'wb') as fd:
+                fd.write(source.encode('utf-8'))
+            reader = codecs.open(path, 'r', encoding='utf-8')
+            self.addCleanup(reader.close)
+            return reader
+
+        for reader in (StringIO, codecs_reader):
+            for source in self.sources:
+                for size in (1, 2, 3, 7, 64, None):
+                    utils.stub_item_attr_value(
+                        self, toolchain, 'TRANSPILE_BLOCK_SIZE',
+                        size or 1 << 18)
+                    expected = SourceWriter(StringIO())
+                    line(spec, reader(source), expected)
+                    result = SourceWriter(StringIO())
+                    block(spec, reader(source), result)
+                    msg = 'mismatched %%s for %r at size %r with %s' % (
+                        source, size, reader.__name__)
+                    self.assertEqual(
+                        result.getvalue(), expected.getvalue(),
+                        msg % 'output')
+                    self.assertEqual(
+                        result.mappings, expected.mappings,
+                        msg % 'mappings')
+                    self.assertEqual(result.warn, expected.warn)
+
+    def test_null_transpiler(self):
+        self.assertTranspiled(
+            toolchain._null_transpiler, benchmark.line_null_transpiler, Spec())
+
+    def test_umd_transpiler(self):
+        with pretty_logging(stream=mocks.StringIO()):
+            self.assertTranspiled(
+                toolchain._transpile_generic_to_umd_node_amd_compat_rjs,
+                benchmark.line_umd_transpiler, Spec(),
+            )
+
+    def test_umd_transpiler_no_indent(self):
+        with pretty_logging(stream=mocks.StringIO()):
+            self.assertTranspiled(
+                toolchain._transpile_generic_to_umd_node_amd_compat_rjs,
+                benchmark.line_umd_transpiler, Spec(transpile_no_indent=True),
+            )
+
+    def test_write_lines_fast(self):
+        lines = ['var a = 1;\n', '\n', '  \n', '    var b = 2;\n']
+        for indent in ('', '    '):
+            expected = SourceWriter(StringIO())
+            expected.write('// ')
+            toolchain._write_lines(expected, lines, indent)
+            result = SourceWriter(StringIO())
+            result.write('// ')
+            toolchain._write_lines(result, lines, indent, fast=True)
+            self.assertEqual(result.getvalue(), expected.getvalue())
+            self.assertEqual(result.mappings, expected.mappings)
+
+    def test_plain_writer(self):
+        # the null transpiler only needs a writer with a write method.
+        result = StringIO()
+        toolchain._null_transpiler(Spec(), StringIO('a\nb\nc'), result)
+        self.assertEqual(result.getvalue(), 'a\nb\nc')
+
+
 class ToolchainCompilePluginTestCase(unittest.TestCase):
     """
     Test the compile_plugin method
@@ -409,6 +559,47 @@ class ToolchainBaseUnitTestCase(unittest.TestCase):
             'empty:',
         )
 
+    def test_compile_bundle_delegated(self):
+        from calmjs.toolchain import Toolchain
+        calls = []
+
+        def compile_bundle(self, spec, entries):
+            calls.append(entries)
+            return {}, {}, []
+
+        utils.stub_item_attr_value(
+            self, Toolchain, 'compile_bundle', compile_bundle)
+        src_dir = utils.mkdtemp(self)
+        build_dir = utils.mkdtemp(self)
+        with open(join(src_dir, 'mod.js'), 'w') as fd:
+            fd.write('define({});')
+        entries = [('mod', src_dir, 'mod', 'mod')]
+        rjs = toolchain.RJSToolchain()
+        rjs.compile_bundle(Spec(build_dir=build_dir), entries)
+        self.assertEqual(calls, [entries])
+
+        # the incremental build replaces the previous copy.
+        state = toolchain.BuildState(None)
+        os.mkdir(join(build_dir, 'mod'))
+        with open(join(build_dir, 'mod', 'stale.js'), 'w'):
+            pass
+        rjs.compile_bundle(
+            Spec(build_dir=build_dir, build_state=state), entries)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(os.listdir(join(build_dir, 'mod')), ['mod.js'])
+
+    def test_loader_plugin_registry_deferred(self):
+        rjs = toolchain.RJSToolchain()
+        self.assertIsNone(rjs._loader_plugin_registry)
+        self.assertIsNone(rjs.env_path)
+        self.assertIs(
+            rjs.loader_plugin_registry,
+            get(toolchain.RJS_LOADER_PLUGIN_REGISTRY_NAME),
+        )
+        registry = object()
+        rjs.loader_plugin_registry = registry
+        self.assertIs(rjs.loader_plugin_registry, registry)
+
 
 @unittest.skipIf(get_npm_version() is None, "npm is unavailable")
 class ToolchainUnitTestCase(unittest.TestCase):
@@ -449,6 +640,46 @@ class ToolchainUnitTestCase(unittest.TestCase):
             rjs.rjs_bin
         ))
 
+    def test_prepare_python_linker_without_rjs(self):
+        utils.stub_os_environ(self)
+        utils.remember_cwd(self)
+        os.environ['NODE_PATH'] = ''
+        os.environ['PATH'] = ''
+        tmpdir = utils.mkdtemp(self)
+        os.chdir(tmpdir)
+
+        rjs = toolchain.RJSToolchain()
+        spec = Spec(
+            build_dir=tmpdir, export_target=join(tmpdir, 'export.js'),
+            python_linker=True,
+        )
+        with pretty_logging(logger='calmjs.rjs', stream=mocks.StringIO()) as s:
+            rjs.prepare(spec)
+        self.assertIsNone(spec[rjs.rjs_bin_key])
+        self.assertIn("only the Python linker will be available", s.getvalue())
+
+    def test_prepare_env_path_with_rjs_bin(self):
+        utils.stub_os_environ(self)
+        utils.remember_cwd(self)
+        os.environ['NODE_PATH'] = ''
+        os.environ['PATH'] = ''
+        tmpdir = utils.mkdtemp(self)
+        os.chdir(tmpdir)
+        bin_dir = join(tmpdir, 'node_modules', '.bin')
+        os.makedirs(bin_dir)
+        utils.create_fake_bin(bin_dir, toolchain.RJSToolchain.rjs_bin)
+        rjs_bin = utils.create_fake_bin(tmpdir, 'r.js')
+
+        rjs = toolchain.RJSToolchain()
+        spec = Spec(
+            build_dir=tmpdir, export_target=join(tmpdir, 'export.js'),
+            rjs_bin=rjs_bin,
+        )
+        with pretty_logging(stream=mocks.StringIO()):
+            rjs.prepare(spec)
+        self.assertEqual(spec[rjs.rjs_bin_key], rjs_bin)
+        self.assertEqual(rjs.env_path, bin_dir)
+
     def test_prepare_failure_export_target(self):
         tmpdir = utils.mkdtemp(self)
         rjs = toolchain.RJSToolchain()
@@ -793,3 +1024,579 @@ class ToolchainUnitTestCase(unittest.TestCase):
             'some.pylike.module': 'empty:',
             'underscore': 'empty:',
         })
+
+    def test_assemble_cached(self):
+        cache_dir = utils.mkdtemp(self)
+        with pretty_logging(logger='calmjs.rjs', stream=mocks.StringIO()) as s:
+            build_js, config_js = self.assemble_spec_config(
+                cache_dir=cache_dir)
+
+        self.assertIn("had 0 hits and 3 misses", s.getvalue())
+
+        # subsequent builds with the same sources will make use of the
+        # cached results, with identical output.
+        with pretty_logging(logger='calmjs.rjs', stream=mocks.StringIO()) as s:
+            build_js, config_js = self.assemble_spec_config(
+                cache_dir=cache_dir)
+
+        self.assertIn("had 3 hits and 0 misses", s.getvalue())
+        self.assertIn(
+            "source file(s) referenced modules that are missing in the "
+            "build directory: 'jquery', 'some.pylike.module', 'underscore'",
+            s.getvalue()
+        )
+        self.assertEqual(config_js['paths'], {
+            'module1': 'module1.js?',
+            'module2': 'module2.js?',
+            'module3': 'module3.js?',
+        })
+
+    def test_assemble_extract_engine_scan(self):
+        cache_dir = utils.mkdtemp(self)
+        self.assemble_spec_config(cache_dir=cache_dir)
+        with pretty_logging(logger='calmjs.rjs', stream=mocks.StringIO()) as s:
+            build_js, config_js = self.assemble_spec_config(
+                cache_dir=cache_dir, extract_engine='scan')
+
+        # results from the different engines are cached separately.
+        self.assertIn("had 0 hits and 3 misses", s.getvalue())
+        self.assertIn(
+            "source file(s) referenced modules that are missing in the "
+            "build directory: 'jquery', 'some.pylike.module', 'underscore'",
+            s.getvalue()
+        )
+        self.assertEqual(config_js['paths'], {
+            'module1': 'module1.js?',
+            'module2': 'module2.js?',
+            'module3': 'module3.js?',
+        })
+
+    def test_assemble_dependency_records(self):
+        records = {}
+        self.assemble_spec_config(dependency_records=records)
+        self.assertEqual(
+            sorted(basename(path) for path in records),
+            ['module1.js', 'module2.js', 'module3.js'])
+        self.assertEqual(sorted(
+            (basename(path), record) for path, record in records.items()
+        )[2], ('module3.js', [[], ['jquery', 'underscore', 'module2']]))
+
+        # records are not produced by the scan engine.
+        records = {}
+        self.assemble_spec_config(
+            dependency_records=records, extract_engine='scan')
+        self.assertEqual(records, {})
+
+    def test_assemble_extract_engine_invalid(self):
+        with self.assertRaises(toolchain.RJSRuntimeError) as e:
+            self.assemble_spec_config(extract_engine='invalid')
+        self.assertIn("'invalid' is not a valid 'extract_engine'", str(
+            e.exception))
+
+    def test_assemble_parse_workers(self):
+        with pretty_logging(logger='calmjs.rjs', stream=mocks.StringIO()) as s:
+            build_js, config_js = self.assemble_spec_config(parse_workers=2)
+
+        self.assertIn(
+            "source file(s) referenced modules that are missing in the "
+            "build directory: 'jquery', 'some.pylike.module', 'underscore'",
+            s.getvalue()
+        )
+        self.assertEqual(config_js['paths'], {
+            'module1': 'module1.js?',
+            'module2': 'module2.js?',
+            'module3': 'module3.js?',
+        })
+
+
+class ToolchainIncrementalTestCase(unittest.TestCase):
+    """
+    Test the incremental builds.
+    """
+
+    def setUp(self):
+        self.src_dir = utils.mkdtemp(self)
+        self.build_dir = utils.mkdtemp(self)
+        self.export_target = join(utils.mkdtemp(self), 'export.js')
+        self.rjs_bin = join(self.src_dir, 'r.js')
+        with open(self.rjs_bin, 'w'):
+            pass
+
+        self.sources = {}
+        self.transpiled = ['mod1', 'mod2', 'mod3']
+        self.bundled = ['bundle']
+        for name, text in (
+                ('mod1', "define(['mod2'], function(mod2) {});\n"),
+                ('mod2', "var mod3 = require('mod3');\n"),
+                ('mod3', "exports.mod3 = 'mod3';\n"),
+                ('bundle', "define('bundle', [], function() {});\n")):
+            self.sources[name] = join(self.src_dir, name + '.js')
+            self.write(name, text)
+        self.text_src = join(self.src_dir, 'text.txt')
+        with open(self.text_src, 'w') as fd:
+            fd.write('hello')
+
+        self.links = []
+        # the extra lines for the output of the fake r.js, or None for
+        # it to produce no output.
+        self.rjs_output = []
+
+        def fake_call(args, stdout=None):
+            self.links.append(args)
+            config = resolve_build_config(
+                self.read_config(args[-1]), dirname(args[-1]))
+            with open(config['out'], 'w') as fd:
+                fd.write('linked %d' % len(self.links))
+            if stdout is not None and self.rjs_output is not None:
+                stdout.write(self.fake_rjs_output(config))
+            return 0
+
+        utils.stub_mod_call(self, toolchain, fake_call)
+
+    def fake_rjs_output(self, config):
+        # list the files of the included modules the way r.js does.
+        lines = ['', config['out'], '----------------']
+        for modname in config['include']:
+            path = config['paths'].get(modname, modname)
+            if path == 'empty:':
+                continue
+            if '!' in modname:
+                lines.append(modname)
+                continue
+            if path.endswith('?'):
+                path = path[:-1]
+            elif not path.endswith('.js'):
+                path += '.js'
+            lines.append(join(config['baseUrl'], *path.split('/')))
+        return '\n'.join(lines + self.rjs_output + [''])
+
+    def write(self, name, text):
+        with open(self.sources[name], 'w') as fd:
+            fd.write(text)
+
+    def build(self, **kw):
+        spec = Spec(
+            build_dir=self.build_dir,
+            export_target=self.export_target,
+            rjs_bin=self.rjs_bin,
+            transpile_source_map={
+                name: self.sources[name] for name in self.transpiled},
+            bundle_source_map={
+                name: self.sources[name] for name in self.bundled},
+            requirejs_plugins={
+                'text': {
+                    'text!text.txt': self.text_src,
+                },
+            },
+            incremental=True,
+            **kw
+        )
+        rjs = toolchain.RJSToolchain()
+        with pretty_logging(logger='calmjs.rjs', stream=mocks.StringIO()) as s:
+            rjs(spec)
+        return spec, s.getvalue()
+
+    def read_config(self, path):
+        with open(path) as fd:
+            return json.loads(fd.read().strip()[1:-1])
+
+    def test_bundles(self):
+        spec, log = self.build(bundles={
+            'page1': ['mod1'],
+            'page2': ['mod2', 'bundle'],
+        })
+        self.assertIn("common layer has 3 of 5 module(s)", log)
+        build_js = self.read_config(spec['build_manifest_path'])
+        self.assertEqual(
+            sorted(build_js['include']), ['mod2', 'mod3', 'text!text.txt'])
+        self.assertEqual(build_js['out'], self.export_target)
+
+        target_dir = dirname(self.export_target)
+        page1_target = join(target_dir, 'export.page1.js')
+        page1_js = self.read_config(
+            join(self.build_dir, 'build.page1.js'))
+        self.assertEqual(page1_js['include'], ['mod1'])
+        self.assertEqual(page1_js['out'], page1_target)
+        self.assertEqual(page1_js['exclude'], build_js['include'])
+        page2_js = self.read_config(
+            join(self.build_dir, 'build.page2.js'))
+        self.assertEqual(page2_js['include'], ['bundle'])
+        self.assertEqual(spec['bundle_targets'], {
+            'page1': page1_target,
+            'page2': join(target_dir, 'export.page2.js'),
+        })
+
+        # r.js invoked for each of the manifests.
+        self.assertEqual([args[-1] for args in self.links], [
+            spec['build_manifest_path'],
+            join(self.build_dir, 'build.page1.js'),
+            join(self.build_dir, 'build.page2.js'),
+        ])
+
+        with open(spec['requirejs_config_js']) as fd:
+            config = json.loads(''.join(fd.readlines()[4:-10]))
+        self.assertEqual(config['bundles']['export.page1'], ['mod1'])
+        self.assertEqual(config['bundles']['export.page2'], ['bundle'])
+        self.assertEqual(
+            sorted(config['bundles']['export']), sorted(build_js['include']))
+        self.assertEqual(
+            config['paths']['export.page1'], join(target_dir, 'export.page1'))
+
+        # unchanged inputs will not be linked again
+        spec, log = self.build(bundles={
+            'page1': ['mod1'],
+            'page2': ['mod2', 'bundle'],
+        })
+        self.assertEqual(len(self.links), 3)
+
+    def test_bundles_defines_manifest(self):
+        spec, log = self.build(defines_manifest=True, bundles={
+            'page1': ['mod1'],
+            'page2': ['mod2', 'bundle'],
+        })
+        # the export target only has the common layer.
+        self.assertEqual(
+            sorted(dev.read_defines_manifest(self.export_target)),
+            ['mod2', 'mod3', 'text!text.txt'])
+        self.assertEqual(dev.read_defines_manifest(
+            spec['bundle_targets']['page1']), ['mod1'])
+        self.assertEqual(dev.read_defines_manifest(
+            spec['bundle_targets']['page2']), ['bundle'])
+
+    def test_bundles_relative_requires(self):
+        self.write('mod1', "define(['./mod2'], function(mod2) {});\n")
+        spec, log = self.build(bundles={
+            'page1': ['mod1'],
+            'page2': ['mod3'],
+        })
+        page1_js = self.read_config(
+            join(self.build_dir, 'build.page1.js'))
+        self.assertEqual(sorted(page1_js['include']), ['mod1', 'mod2'])
+        self.assertEqual(sorted(self.read_config(
+            spec['build_manifest_path'])['include']),
+            ['bundle', 'mod3', 'text!text.txt'])
+
+    def test_bundles_unknown_entry(self):
+        with self.assertRaises(toolchain.RJSRuntimeError) as e:
+            self.build(bundles={'page1': ['mod1', 'nothing']})
+        self.assertIn(
+            "entry module(s) for bundle 'page1' not found in the build: "
+            "nothing", str(e.exception))
+
+    def test_python_linker(self):
+        # without the text plugin in the build, r.js has to be used.
+        spec, log = self.build(python_linker=True)
+        self.assertIn("module 'text' not found at", log)
+        self.assertIn("r.js will be invoked instead", log)
+        self.assertEqual(len(self.links), 1)
+
+        self.sources['text'] = join(self.src_dir, 'text.js')
+        self.write('text', "define({load: function() {}});\n")
+        self.bundled.append('text')
+        spec, log = self.build(python_linker=True)
+        self.assertIn("building '%s' with the Python linker" % (
+            spec['build_manifest_path']), log)
+        self.assertIn("linked 6 module(s) into '%s'" % self.export_target, log)
+        self.assertEqual(len(self.links), 1)
+        with open(self.export_target) as fd:
+            result = fd.read()
+        self.assertTrue(result.startswith('(function () {\n'))
+        self.assertTrue(result.endswith('}());\n'))
+        positions = [result.index('define("%s", ' % name) for name in (
+            'mod3', 'mod2', 'mod1', 'text', 'text!text.txt')]
+        self.assertEqual(positions[:3], sorted(positions[:3]))
+        self.assertLess(positions[3], positions[4])
+        self.assertIn('function () { return "hello"; }', result)
+
+        # unchanged inputs will not be linked again
+        spec, log = self.build(python_linker=True)
+        self.assertIn("skipping link", log)
+
+    def test_minify(self):
+        self.write('mod3', "exports.mod3 = ;\n")
+        cache_dir = utils.mkdtemp(self)
+        spec, log = self.build(minify=True, cache_dir=cache_dir)
+        self.assertIn("minified 3 of 4 module(s) with 'slimit'", log)
+        self.assertIn(
+            "1 module(s) failed to be minified and will be used as is", log)
+        build_js = self.read_config(spec['build_manifest_path'])
+        self.assertEqual(build_js['paths'], {
+            'mod1': 'minified/mod1',
+            'mod2': 'minified/mod2',
+            'bundle': 'minified/bundle',
+        })
+        self.assertEqual(build_js['optimize'], 'none')
+        with open(join(self.build_dir, 'minified', 'mod1.js')) as fd:
+            self.assertEqual(fd.read(), "define(['mod2'],function(mod2){});")
+
+        # only the changed module is minified again.
+        self.write('mod3', "exports.mod3 = 'mod3';\n")
+        spec, log = self.build(minify=True, cache_dir=cache_dir)
+        self.assertIn("minified 1 of 4 module(s) with 'slimit'", log)
+        build_js = self.read_config(spec['build_manifest_path'])
+        self.assertEqual(build_js['paths']['mod3'], 'minified/mod3')
+        self.assertEqual(len(self.links), 2)
+
+        with self.assertRaises(toolchain.RJSRuntimeError) as e:
+            self.build(minify='nothing')
+        self.assertIn("'nothing' is not a valid 'minify'", str(e.exception))
+
+    def test_hashed_artifacts(self):
+        from calmjs.rjs.artifact import HASH_LENGTH
+        spec, log = self.build(
+            hashed_artifacts=True, bundles={'page1': ['mod1']})
+        target_dir = dirname(self.export_target)
+        with open(self.export_target + '.manifest.json') as fd:
+            manifest = json.load(fd)
+        files = manifest['files']
+        self.assertEqual(sorted(files), ['export.js', 'export.page1.js'])
+        self.assertIn('.gz', manifest['compressed'])
+        page1 = files['export.page1.js']
+        self.assertEqual(len(page1), len('export.page1..js') + HASH_LENGTH)
+        with open(join(target_dir, page1)) as fd:
+            self.assertEqual(fd.read(), 'linked 2')
+        self.assertTrue(exists(join(target_dir, files['export.js'] + '.gz')))
+
+        with open(spec['requirejs_config_js']) as fd:
+            config = json.loads(''.join(fd.readlines()[4:-10]))
+        self.assertEqual(config['paths']['export.page1'], join(
+            target_dir, page1[:-3]))
+        self.assertEqual(config['paths']['export'], join(
+            target_dir, files['export.js'][:-3]))
+        self.assertEqual(
+            sorted(config['bundles']['export.page1']),
+            ['mod1', 'mod2', 'mod3'])
+
+        # the copies of the previous build are removed once replaced.
+        self.write('mod1', "define(['mod3'], function(mod3) {});\n")
+        spec, log = self.build(
+            hashed_artifacts=True, bundles={'page1': ['mod1']})
+        self.assertIn("stale hashed artifact file(s)", log)
+        with open(self.export_target + '.manifest.json') as fd:
+            files = json.load(fd)['files']
+        self.assertNotEqual(files['export.page1.js'], page1)
+        self.assertFalse(exists(join(target_dir, page1)))
+        self.assertFalse(exists(join(target_dir, page1 + '.gz')))
+        self.assertTrue(exists(join(target_dir, files['export.page1.js'])))
+        with open(spec['requirejs_config_js']) as fd:
+            config = json.loads(''.join(fd.readlines()[4:-10]))
+        self.assertEqual(config['paths']['export.page1'], join(
+            target_dir, files['export.page1.js'][:-3]))
+
+    def test_module_graph_relative_requires(self):
+        self.write('mod1', "define(['./mod2', './gone'], function() {});\n")
+        spec, log = self.build(module_graph=True)
+        path = join(self.build_dir, 'module_graph.sqlite')
+        with graph.ModuleGraph(path) as g:
+            self.assertEqual(g.requires('mod1'), ['gone', 'mod2'])
+            self.assertEqual(g.dependents('mod2'), ['mod1'])
+            self.assertEqual(g.reachable('mod1'), ['gone', 'mod2', 'mod3'])
+            self.assertEqual(g.modnames(graph.MISSING), ['gone'])
+            self.assertNotIn('./mod2', g.modnames())
+
+    def test_module_graph(self):
+        self.write('mod1', "define(['mod2', 'gone'], function(mod2) {});\n")
+        spec, log = self.build(module_graph=True)
+        path = join(self.build_dir, 'module_graph.sqlite')
+        self.assertIn("wrote module graph with 7 modules and 3 edges", log)
+        with graph.ModuleGraph(path) as g:
+            self.assertEqual(g.modnames(), [
+                'bundle', 'gone', 'mod1', 'mod2', 'mod3', 'text',
+                'text!text.txt'])
+            self.assertEqual(g.requires('mod1'), ['gone', 'mod2'])
+            self.assertEqual(g.reachable('mod1'), ['gone', 'mod2', 'mod3'])
+            self.assertEqual(g.dependents('mod3'), ['mod1', 'mod2'])
+            self.assertEqual(g.modnames(graph.MISSING), ['gone'])
+            mod1 = g.module('mod1')
+            self.assertEqual(mod1['source'], self.sources['mod1'])
+            self.assertEqual(mod1['kind'], 'transpiled')
+            self.assertGreater(mod1['size'], 0)
+            text = g.module('text!text.txt')
+            self.assertEqual(text['kind'], 'plugins')
+            self.assertEqual(text['plugin'], 'text')
+            self.assertEqual(text['source'], self.text_src)
+            self.assertEqual(text['size'], 5)
+
+        # a specific path
+        path = join(utils.mkdtemp(self), 'graph.sqlite')
+        spec, log = self.build(module_graph=path)
+        with graph.ModuleGraph(path) as g:
+            self.assertEqual(g.requires('mod2'), ['mod3'])
+
+        # failure is not fatal.
+        spec, log = self.build(module_graph=join(self.build_dir, 'no', 'p'))
+        self.assertIn("failed to write module graph", log)
+
+    def test_defines_manifest(self):
+        spec, log = self.build(defines_manifest=True)
+        manifest_path = self.export_target + dev.DEFINES_MANIFEST_SUFFIX
+        self.assertTrue(exists(manifest_path))
+        self.assertEqual(
+            dev.read_defines_manifest(self.export_target),
+            spec['export_module_names'],
+        )
+        # the export target produced by the fake r.js is not valid
+        # JavaScript, so the manifest must have been used.
+        with pretty_logging(stream=mocks.StringIO()) as s:
+            self.assertEqual(
+                sorted(dev.process_artifacts([self.export_target])),
+                sorted(spec['export_module_names']),
+            )
+        self.assertNotIn('syntax error', s.getvalue())
+
+        # still written when the link is skipped.
+        os.remove(manifest_path)
+        spec, log = self.build(defines_manifest=True)
+        self.assertIn("skipping link as the inputs", log)
+        self.assertTrue(exists(manifest_path))
+
+    def test_defines_manifest_empty_and_bundled_dir(self):
+        # a module made empty, and a directory with a module that is
+        # only pulled into the build as it is required.
+        lib_dir = join(self.src_dir, 'lib')
+        os.mkdir(lib_dir)
+        with open(join(lib_dir, 'a.js'), 'w') as fd:
+            fd.write("define([], function() {});\n")
+        self.sources['jquery'] = 'empty:'
+        self.transpiled.append('jquery')
+        self.sources['lib'] = lib_dir
+        # the loader plugin, for the linker.
+        self.sources['text'] = join(self.src_dir, 'text.js')
+        self.write('text', "define('text', [], function() {});\n")
+        self.bundled.extend(['lib', 'text'])
+        self.write('mod1', "define(['mod2', 'lib/a'], function(mod2) {});\n")
+
+        spec, log = self.build(defines_manifest=True, python_linker=True)
+        self.assertIn('jquery', spec['export_module_names'])
+        defines = dev.read_defines_manifest(self.export_target)
+        self.assertNotIn('jquery', defines)
+        self.assertIn('lib/a', defines)
+        self.assertEqual(sorted(defines), [
+            'bundle', 'lib/a', 'mod1', 'mod2', 'mod3', 'text',
+            'text!text.txt'])
+
+        # the names reported by the link are kept when it is skipped.
+        os.remove(self.export_target + dev.DEFINES_MANIFEST_SUFFIX)
+        spec, log = self.build(defines_manifest=True, python_linker=True)
+        self.assertIn("skipping link as the inputs", log)
+        self.assertEqual(
+            dev.read_defines_manifest(self.export_target), defines)
+
+        # likewise for the files listed in the output of r.js.
+        self.rjs_output = [join(self.build_dir, 'lib', 'a.js')]
+        spec, log = self.build(defines_manifest=True)
+        self.assertIn("r.js output:", log)
+        self.assertEqual(
+            sorted(dev.read_defines_manifest(self.export_target)), [
+                'bundle', 'lib/a', 'mod1', 'mod2', 'mod3', 'text',
+                'text!text.txt'])
+
+        # without r.js reporting anything, the manifest is not written
+        # such that the artifact will be parsed.
+        self.rjs_output = None
+        self.write('mod3', "exports.mod3 = 3;\n")
+        spec, log = self.build(defines_manifest=True)
+        self.assertIn("not writing its defines manifest", log)
+        self.assertIsNone(dev.read_defines_manifest(self.export_target))
+
+    def test_incremental_rebuild(self):
+        spec, log = self.build()
+        self.assertEqual(len(self.links), 1)
+        self.assertTrue(exists(join(self.build_dir, 'build_state.json')))
+        self.assertNotIn('skipping', log)
+        with open(join(self.build_dir, 'mod3.js')) as fd:
+            mod3_js = fd.read()
+
+        spec2, log = self.build()
+        self.assertEqual(len(self.links), 1)
+        self.assertIn("skipping transpile of unchanged", log)
+        self.assertIn("skipping copy of unchanged", log)
+        self.assertIn("skipping unchanged '%s'" % self.text_src, log)
+        self.assertIn("0 of 4 target(s) changed", log)
+        self.assertIn("skipping link as the inputs", log)
+        self.assertEqual(
+            spec['export_module_names'], spec2['export_module_names'])
+        self.assertEqual(spec['plugins_targets'], spec2['plugins_targets'])
+
+        # a change in one source only affects that.
+        self.write('mod3', "exports.mod3 = 'changed';\n")
+        spec3, log = self.build()
+        self.assertEqual(len(self.links), 2)
+        self.assertIn("1 of 4 target(s) changed", log)
+        with open(join(self.build_dir, 'mod3.js')) as fd:
+            self.assertNotEqual(mod3_js, fd.read())
+
+        # a change in options that affect the transpiled output.
+        spec4, log = self.build(transpile_no_indent=True)
+        self.assertEqual(len(self.links), 3)
+        self.assertNotIn("skipping transpile of unchanged", log)
+
+    def test_incremental_export_target_removed(self):
+        self.build()
+        os.remove(self.export_target)
+        spec, log = self.build()
+        self.assertEqual(len(self.links), 2)
+        self.assertTrue(exists(self.export_target))
+
+    def test_incremental_plugin_target_removed(self):
+        spec, log = self.build()
+        text_target = join(self.build_dir, 'text.txt')
+        self.assertEqual(sorted(spec[toolchain.BUILD_STATE].records[
+            'plugin:text!text.txt']['targets']), [text_target])
+        os.remove(text_target)
+        spec, log = self.build()
+        self.assertNotIn("skipping unchanged '%s'" % self.text_src, log)
+        self.assertTrue(exists(text_target))
+        # the contents written back are identical.
+        self.assertIn("skipping link as the inputs", log)
+
+    def test_incremental_source_removed(self):
+        spec, log = self.build()
+        self.assertIn('requires:' + join(self.build_dir, 'mod3.js'), spec[
+            toolchain.BUILD_STATE].records)
+        os.remove(self.sources['mod3'])
+        # removing the module from the sources map.
+        self.sources['mod3'] = 'empty:'
+        spec, log = self.build()
+        self.assertEqual(len(self.links), 2)
+        self.assertNotIn('transpile:mod3.js', spec[
+            toolchain.BUILD_STATE].records)
+
+    def test_trace(self):
+        spec, log = self.build(trace=True)
+        path = self.export_target[:-len('.js')] + '.trace.json'
+        self.assertIn("wrote build trace to '%s'" % path, log)
+        self.assertIn('slowest modules:', log)
+        with open(path) as fd:
+            trace = json.load(fd)
+        events = {
+            (event['cat'], event['name']): event
+            for event in trace['traceEvents']
+        }
+        for phase in (
+                'prepare', 'compile', 'assemble', 'link', 'finalize',
+                'transpile', 'bundle', 'plugin', 'parse', 'rjs'):
+            self.assertIn(('phase', phase), events)
+        module = events[('module', 'mod3')]
+        self.assertEqual(module['args']['phase'], 'transpile')
+        self.assertEqual(module['args']['source'], self.sources['mod3'])
+        self.assertEqual(module['args']['source_bytes'], 23)
+        self.assertIn(('module', 'bundle'), events)
+        self.assertIn(('module', 'text!text.txt'), events)
+        self.assertEqual(events[('phase', 'parse')]['args']['files'], 4)
+        self.assertEqual(len(trace['otherData']['slowest_modules']), 5)
+
+    def test_trace_path_failure(self):
+        path = join(utils.mkdtemp(self), 'trace.json')
+        utils.stub_mod_call(self, toolchain, lambda args, **kw: 1)
+        with self.assertRaises(toolchain.RJSExitError):
+            self.build(trace=path)
+        with open(path) as fd:
+            trace = json.load(fd)
+        events = {
+            event['name']: event for event in trace['traceEvents']
+            if event['cat'] == 'phase'
+        }
+        self.assertTrue(events['link']['args']['incomplete'])
+        self.assertNotIn('finalize', events)
+        self.assertNotIn('incomplete', events['assemble']['args'])
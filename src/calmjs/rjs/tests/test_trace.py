@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from os.path import join
+
+from calmjs.rjs import trace
+
+from calmjs.testing.utils import mkdtemp
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class BuildTraceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.trace = trace.BuildTrace(self.timer)
+
+    def test_span(self):
+        with self.trace.span('compile', size=1) as args:
+            self.timer.now = 0.5
+            args['files'] = 2
+        event, = self.trace.events
+        self.assertEqual(event['name'], 'compile')
+        self.assertEqual(event['cat'], trace.PHASE)
+        self.assertEqual(event['ph'], 'X')
+        self.assertEqual(event['ts'], 0)
+        self.assertEqual(event['dur'], 500000)
+        self.assertEqual(event['args'], {'size': 1, 'files': 2})
+
+    def test_span_error(self):
+        with self.assertRaises(ValueError):
+            with self.trace.span('compile'):
+                raise ValueError('failure')
+        self.assertEqual(len(self.trace.events), 1)
+
+    def test_trace_span_none(self):
+        with trace.trace_span(None, 'compile', size=1) as args:
+            args['files'] = 2
+        self.assertEqual(args, {'size': 1, 'files': 2})
+        with trace.trace_span(self.trace, 'compile', size=1) as args:
+            args['files'] = 2
+        self.assertEqual(self.trace.events[0]['args'], args)
+
+    def test_begin_end(self):
+        self.timer.now = 1
+        self.trace.begin('prepare')
+        self.trace.begin('compile')
+        self.timer.now = 2
+        self.assertEqual(self.trace.end('prepare')['dur'], 1000000)
+        self.assertIsNone(self.trace.end('prepare'))
+        self.timer.now = 3
+        self.trace.end_pending()
+        self.assertEqual(self.trace.events[1]['name'], 'compile')
+        self.assertEqual(self.trace.events[1]['ts'], 1000000)
+        self.assertEqual(self.trace.events[1]['dur'], 2000000)
+        self.assertEqual(self.trace.events[1]['args'], {'incomplete': True})
+        self.assertEqual(self.trace.pending, {})
+
+    def add_modules(self):
+        for name, dur in (('a', 3), ('b', 1), ('c', 2)):
+            self.trace.add(name, trace.MODULE, 0, dur, {
+                'phase': 'transpile', 'source_bytes': dur * 10})
+        self.trace.add('compile', trace.PHASE, 0, 10)
+
+    def test_slowest_summary(self):
+        self.add_modules()
+        self.assertEqual(
+            [e['name'] for e in self.trace.slowest(2)], ['a', 'c'])
+        lines = self.trace.summary(2)
+        self.assertEqual(lines[0], 'phases:')
+        self.assertIn('10000.0 ms  compile', lines[1])
+        self.assertEqual(lines[2], 'slowest modules:')
+        self.assertIn('3000.0 ms  transpile  a (30 bytes)', lines[3])
+        self.assertIn('c (20 bytes)', lines[4])
+        self.assertEqual(len(lines), 5)
+
+    def test_dump(self):
+        self.add_modules()
+        path = join(mkdtemp(self), 'trace.json')
+        self.trace.dump(path, 1)
+        with open(path) as fd:
+            result = json.load(fd)
+        self.assertEqual(len(result['traceEvents']), 4)
+        self.assertEqual(result['displayTimeUnit'], 'ms')
+        self.assertEqual(result['otherData']['slowest_modules'], [
+            ['a', 'transpile', 3000.0]])
+
+    def test_file_size(self):
+        path = join(mkdtemp(self), 'file')
+        self.assertEqual(trace.file_size(path), 0)
+        with open(path, 'w') as fd:
+            fd.write('hello')
+        self.assertEqual(trace.file_size(path), 5)
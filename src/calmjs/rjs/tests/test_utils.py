@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 import unittest
+import errno
+from os.path import join
 
 from calmjs.utils import pretty_logging
 from calmjs.rjs import utils
 
 from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
 
 
 class DictGetTestCase(unittest.TestCase):
@@ -70,3 +74,38 @@ class DictKeyGetUpdateTestCase(unittest.TestCase):
             "value of base_key['k2'] is being rewritten from 'v2' to 'v4';",
             s.getvalue())
         self.assertEqual(a['base_key'], {'k1': 'v2', 'k2': 'v4'})
+
+
+class CopyFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.source = join(self.tmpdir, 'source.js')
+        self.target = join(self.tmpdir, 'target.js')
+        with open(self.source, 'wb') as fd:
+            fd.write(b'define([], function() {});\r\n\xe2\x80\xa8\n')
+
+    def assertCopied(self):
+        with open(self.source, 'rb') as src, open(self.target, 'rb') as tgt:
+            self.assertEqual(src.read(), tgt.read())
+
+    def test_copy_file(self):
+        self.assertIn(utils.copy_file(self.source, self.target), (
+            'reflink', 'copy'))
+        self.assertCopied()
+
+    def test_copy_file_fallback(self):
+        def reflink(source, target):
+            raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+
+        stub_item_attr_value(self, utils, 'reflink', reflink)
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()) as s:
+            self.assertEqual(
+                utils.copy_file(self.source, self.target), 'copy')
+        self.assertIn('unable to reflink', s.getvalue())
+        self.assertCopied()
+
+    def test_reflink_unsupported(self):
+        stub_item_attr_value(self, utils, '_FICLONE', 0)
+        with self.assertRaises(OSError):
+            utils.reflink(self.source, self.target)
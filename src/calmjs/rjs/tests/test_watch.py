@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+from os.path import join
+
+from calmjs.toolchain import Spec
+from calmjs.utils import pretty_logging
+
+from calmjs.rjs import runtime
+from calmjs.rjs import watch
+from calmjs.rjs.toolchain import INCREMENTAL
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
+
+
+class FakeWatcher(object):
+    """
+    Produce the predefined changes for each wait.
+    """
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.closed = False
+
+    def __call__(self, paths):
+        self.paths = paths
+        return self
+
+    def wait(self, timeout=None):
+        if not self.changes:
+            raise KeyboardInterrupt()
+        return set(self.changes.pop(0))
+
+    def close(self):
+        self.closed = True
+
+
+class WatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.src1 = join(self.tmpdir, 'src1.js')
+        self.src2 = join(self.tmpdir, 'src2.js')
+        self.subdir = join(self.tmpdir, 'sub')
+        os.mkdir(self.subdir)
+        for path in (self.src1, self.src2, join(self.subdir, 'a.js')):
+            with open(path, 'w') as fd:
+                fd.write('source')
+
+    def touch(self, path, t):
+        os.utime(path, (t, t))
+
+    def test_spec_source_paths(self):
+        spec = Spec(
+            transpile_source_map={'src1': self.src1, 'empty': 'empty:'},
+            bundle_source_map={'src2': self.src2, 'sub': self.subdir},
+            requirejs_plugins={'text': {'text!src1.js': self.src1}},
+        )
+        self.assertEqual(watch.spec_source_paths(spec), sorted([
+            self.src1, self.src2, self.subdir]))
+        self.assertEqual(watch.spec_source_paths(Spec()), [])
+
+    def test_polling_watcher(self):
+        watcher = watch.PollingWatcher(
+            [self.src1, self.src2, self.subdir], interval=0.01)
+        self.assertEqual(watcher.wait(0), set())
+        self.touch(self.src1, 1)
+        self.assertEqual(watcher.wait(0), {self.src1})
+        self.touch(join(self.subdir, 'a.js'), 1)
+        self.touch(self.src2, 1)
+        self.assertEqual(watcher.wait(0.05), {self.src2, self.subdir})
+        with open(join(self.subdir, 'b.js'), 'w'):
+            pass
+        self.assertEqual(watcher.wait(), {self.subdir})
+        watcher.close()
+
+    @unittest.skipIf(
+        watch._load_libc() is None, 'inotify is not available')
+    def test_inotify_watcher(self):
+        watcher = watch.InotifyWatcher([self.src1, self.subdir])
+        self.addCleanup(watcher.close)
+        self.assertEqual(watcher.wait(0), set())
+        with open(self.src2, 'w') as fd:
+            fd.write('changed')
+        # not watched.
+        self.assertEqual(watcher.wait(0.05), set())
+        with open(self.src1, 'w') as fd:
+            fd.write('changed')
+        self.assertEqual(watcher.wait(1), {self.src1})
+        # replacing the file, as done by editors.
+        tmp = join(self.tmpdir, 'tmp')
+        with open(tmp, 'w') as fd:
+            fd.write('replaced')
+        os.rename(tmp, self.src1)
+        self.assertEqual(watcher.wait(1), {self.src1})
+        with open(join(self.subdir, 'b.js'), 'w'):
+            pass
+        self.assertEqual(watcher.wait(1), {self.subdir})
+
+        # new directories inside a watched tree are watched.
+        nested = join(self.subdir, 'new', 'nested')
+        os.makedirs(nested)
+        self.assertEqual(watcher.wait(1), {self.subdir})
+        self.assertEqual(watcher.wait(0.05), set())
+        with open(join(nested, 'c.js'), 'w') as fd:
+            fd.write('new')
+        self.assertEqual(watcher.wait(1), {self.subdir})
+        self.assertIn(nested, watcher.trees)
+
+        # and no longer once they are removed.
+        os.remove(join(nested, 'c.js'))
+        os.rmdir(nested)
+        self.assertEqual(watcher.wait(1), {self.subdir})
+        watcher.wait(0.05)
+        self.assertNotIn(nested, watcher.dirs.values())
+        self.assertNotIn(nested, watcher.trees)
+
+    def test_inotify_unavailable(self):
+        stub_item_attr_value(self, watch, '_load_libc', lambda: None)
+        with self.assertRaises(OSError):
+            watch.InotifyWatcher([self.src1])
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()) as s:
+            watcher = watch.get_watcher([self.src1])
+        self.assertTrue(isinstance(watcher, watch.PollingWatcher))
+        self.assertIn('falling back to polling', s.getvalue())
+
+    def test_spec_factory_from(self):
+        spec = Spec(transpile_source_map={'src1': self.src1})
+        prepared = []
+        factory = watch.spec_factory_from(spec, prepared.append)
+        self.assertIs(factory(), spec)
+        spec['transpiled_targets'] = {}
+        new_spec = factory()
+        self.assertIsNot(new_spec, spec)
+        self.assertEqual(new_spec['transpile_source_map'], {
+            'src1': self.src1})
+        self.assertNotIn('transpiled_targets', new_spec)
+        self.assertTrue(new_spec[INCREMENTAL])
+        self.assertEqual(prepared, [new_spec])
+
+    def test_spec_watcher(self):
+        builds = []
+
+        def toolchain(spec):
+            builds.append(spec)
+            if len(builds) == 2:
+                raise ValueError('broken source')
+
+        fake_watcher = FakeWatcher([
+            [self.src1], [self.src2], [], [self.src1], [],
+        ])
+        watcher = watch.SpecWatcher(toolchain, watch.spec_factory_from(
+            Spec(transpile_source_map={
+                'src1': self.src1, 'src2': self.src2,
+            }),
+        ), watcher_factory=fake_watcher)
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()) as s:
+            spec = watcher.run()
+
+        log = s.getvalue()
+        # the changes to src1 and src2 were debounced into one rebuild.
+        self.assertEqual(len(builds), 3)
+        self.assertIs(spec, builds[-1])
+        self.assertEqual(fake_watcher.paths, [self.src1, self.src2])
+        self.assertTrue(fake_watcher.closed)
+        self.assertIn("rebuilding due to changes in: src1.js, src2.js", log)
+        self.assertIn("build failed: ValueError: broken source", log)
+        self.assertIn("stopped watching for changes", log)
+
+    def test_spec_watcher_rebuilds(self):
+        builds = []
+        fake_watcher = FakeWatcher([[self.src1], [], [self.src1], []])
+        watcher = watch.SpecWatcher(
+            builds.append, watch.spec_factory_from(Spec()),
+            watcher_factory=fake_watcher)
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()):
+            watcher.run(rebuilds=1)
+        self.assertEqual(len(builds), 2)
+
+
+class RuntimeWatchTestCase(unittest.TestCase):
+
+    def test_runtime_watch(self):
+        results = {}
+
+        class FakeSpecWatcher(object):
+            def __init__(self, toolchain, spec_factory):
+                results['factory'] = spec_factory
+
+            def run(self):
+                results['spec'] = results['factory']()
+                results['build_dir'] = results['spec']['build_dir']
+                self.assertTrue(os.path.isdir(results['build_dir']))
+                results['rebuild'] = results['factory']()
+                return results['spec']
+
+            assertTrue = self.assertTrue
+
+        stub_item_attr_value(self, runtime, 'SpecWatcher', FakeSpecWatcher)
+        rt = runtime.RJSRuntime(runtime.default_toolchain)
+        with pretty_logging(logger='calmjs', stream=StringIO()):
+            spec = rt.run(
+                watch=True, source_package_names=[],
+                export_target=join(mkdtemp(self), 'export.js'),
+            )
+
+        self.assertIs(spec, results['spec'])
+        self.assertTrue(spec[INCREMENTAL])
+        self.assertFalse(spec['export_target_overwrite'])
+        self.assertTrue(results['rebuild']['export_target_overwrite'])
+        self.assertEqual(results['rebuild']['build_dir'], spec['build_dir'])
+        # temporary build directory removed.
+        self.assertFalse(os.path.exists(results['build_dir']))
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from os.path import exists
+from os.path import join
+
+from calmjs.toolchain import Spec
+from calmjs.utils import pretty_logging
+from calmjs.utils import which
+
+from calmjs.rjs import toolchain
+from calmjs.rjs import worker
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_mod_call
+
+# a stand-in for r.js, providing just the optimize function.
+fake_rjs = """
+var fs = require('fs');
+console.log('loading fake r.js');
+exports.optimize = function(config, callback, errback) {
+    console.log('building ' + config.out);
+    if (config.crash) {
+        process.exit(2);
+    }
+    if (config.fail) {
+        return errback(new Error('failed to build'));
+    }
+    if (config.throw) {
+        throw 'thrown';
+    }
+    fs.writeFileSync(config.out, JSON.stringify(config.include));
+    callback('built ' + config.out);
+};
+"""
+
+
+class LoadBuildConfigTestCase(unittest.TestCase):
+
+    def test_load_build_config(self):
+        path = join(mkdtemp(self), 'build.js')
+        with open(path, 'w') as fd:
+            fd.write('(\n{"out": "export.js"}\n)')
+        self.assertEqual(worker.load_build_config(path), {
+            'out': 'export.js'})
+        with open(path, 'w') as fd:
+            fd.write('{"out": "export.js"}')
+        self.assertEqual(worker.load_build_config(path), {
+            'out': 'export.js'})
+
+    def test_resolve_build_config(self):
+        base_dir = mkdtemp(self)
+        out = join(mkdtemp(self), 'export.js')
+        config = {'out': 'export.js', 'include': ['mod']}
+        self.assertEqual(worker.resolve_build_config(config, base_dir), {
+            'baseUrl': base_dir,
+            'out': join(base_dir, 'export.js'),
+            'include': ['mod'],
+        })
+        self.assertEqual(config, {'out': 'export.js', 'include': ['mod']})
+        self.assertEqual(worker.resolve_build_config({
+            'baseUrl': 'lib',
+            'out': out,
+        }, base_dir), {
+            'baseUrl': join(base_dir, 'lib'),
+            'out': out,
+        })
+
+    def test_build_output_modnames(self):
+        base_dir = mkdtemp(self)
+        config = worker.resolve_build_config({
+            'paths': {
+                'jquery': 'empty:',
+                'mod1': 'mod1.js?',
+                'lib': 'vendor/lib',
+                'ext': join(base_dir, 'ext', 'ext.js'),
+            },
+        }, base_dir)
+        output = '\n'.join([
+            '',
+            join(base_dir, 'export.js'),
+            '----------------',
+            join(base_dir, 'text.js'),
+            'text!text.txt',
+            join(base_dir, 'mod1.js'),
+            join(base_dir, 'vendor', 'lib', 'a', 'b.js'),
+            join(base_dir, 'ext', 'ext.js'),
+            join(mkdtemp(self), 'elsewhere.js'),
+            '',
+        ])
+        self.assertEqual(worker.build_output_modnames(output, config), [
+            'text', 'text!text.txt', 'mod1', 'lib/a/b', 'ext'])
+        self.assertEqual(worker.build_output_modnames('', config), [])
+
+
+@unittest.skipIf(which('node') is None, 'Node.js not available')
+class RJSWorkerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.rjs_bin = join(self.tmpdir, 'r.js')
+        with open(self.rjs_bin, 'w') as fd:
+            fd.write(fake_rjs)
+
+    def start(self, rjs_bin):
+        w = worker.RJSWorker(rjs_bin)
+        self.addCleanup(w.close)
+        w.start()
+        return w
+
+    def test_successive_builds(self):
+        w = self.start(self.rjs_bin)
+        pid = w.process.pid
+        for name in ('export1.js', 'export2.js'):
+            out = join(self.tmpdir, name)
+            response = w.build({'out': out, 'include': [name]})
+            self.assertEqual(response['ok'], True)
+            self.assertEqual(response['output'], 'built ' + out)
+            with open(out) as fd:
+                self.assertEqual(json.load(fd), [name])
+        # same process for all builds.
+        self.assertEqual(w.process.pid, pid)
+        w.close()
+        self.assertFalse(w.alive)
+        # no effect
+        w.close()
+
+    def test_build_failures(self):
+        w = self.start(self.rjs_bin)
+        response = w.build({'out': 'export.js', 'fail': True})
+        self.assertEqual(response['ok'], False)
+        self.assertEqual(response['error'], 'failed to build')
+        response = w.build({'out': 'export.js', 'throw': True})
+        self.assertEqual(response['error'], 'thrown')
+        self.assertTrue(w.alive)
+
+    def test_worker_crash(self):
+        w = self.start(self.rjs_bin)
+        with self.assertRaises(worker.RJSWorkerError) as e:
+            w.build({'out': 'export.js', 'crash': True})
+        self.assertIn('terminated', str(e.exception))
+        self.assertFalse(w.alive)
+        with self.assertRaises(worker.RJSWorkerError) as e:
+            w.build({'out': 'export.js'})
+        self.assertIn('not running', str(e.exception))
+
+    def test_load_failure(self):
+        with self.assertRaises(worker.RJSWorkerError) as e:
+            self.start(join(self.tmpdir, 'missing.js'))
+        self.assertIn('failed to load', str(e.exception))
+
+    def test_node_missing(self):
+        w = worker.RJSWorker(self.rjs_bin, node_bin=join(
+            self.tmpdir, 'no_such_node'))
+        with self.assertRaises(worker.RJSWorkerError) as e:
+            w.start()
+        self.assertIn('failed to start r.js worker', str(e.exception))
+
+
+class FakeWorker(object):
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.configs = []
+        self.closed = False
+
+    @property
+    def alive(self):
+        return not self.closed
+
+    def build(self, config):
+        self.configs.append(config)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            self.closed = True
+            raise response
+        return response
+
+    def close(self):
+        self.closed = True
+
+
+class ToolchainLinkWorkerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.build_manifest_path = join(self.tmpdir, 'build.js')
+        with open(self.build_manifest_path, 'w') as fd:
+            fd.write('(\n{"out": "export.js"}\n)')
+        stub_mod_call(self, toolchain, lambda args, **kw: 0)
+        self.rjs = toolchain.RJSToolchain()
+        self.spec = Spec(
+            rjs_bin=join(self.tmpdir, 'r.js'),
+            build_manifest_path=self.build_manifest_path,
+            rjs_worker=True,
+        )
+
+    def test_link_worker(self):
+        w = self.rjs.rjs_workers[self.spec['rjs_bin']] = FakeWorker([
+            {'ok': True, 'output': 'built'},
+            {'ok': False, 'error': 'missing module'},
+        ])
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()) as s:
+            self.rjs.link(self.spec)
+        self.assertIn("building '%s' with r.js worker" % (
+            self.build_manifest_path), s.getvalue())
+        # resolved against the directory of the manifest, as r.js does.
+        self.assertEqual(w.configs, [{
+            'baseUrl': self.tmpdir,
+            'out': join(self.tmpdir, 'export.js'),
+        }])
+        # nothing listed in the output of the fake build.
+        self.assertEqual(
+            self.spec['link_defines'], {self.build_manifest_path: []})
+
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()) as s:
+            with self.assertRaises(toolchain.RJSExitError):
+                self.rjs.link(self.spec)
+        self.assertIn(
+            'r.js worker build failed: missing module', s.getvalue())
+
+        self.rjs.close_rjs_workers()
+        self.assertTrue(w.closed)
+        self.assertEqual(self.rjs.rjs_workers, {})
+
+    def test_link_worker_fallback(self):
+        self.rjs.rjs_workers[self.spec['rjs_bin']] = FakeWorker([
+            worker.RJSWorkerError('r.js worker process terminated'),
+        ])
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()) as s:
+            self.rjs.link(self.spec)
+        self.assertIn(
+            'r.js worker process terminated; r.js will be invoked directly',
+            s.getvalue())
+        self.assertIn('invoking', s.getvalue())
+        self.assertEqual(self.rjs.rjs_workers, {})
+
+    def test_link_worker_start_failure(self):
+        # the fake r.js binary is not a valid node module.
+        with open(self.spec['rjs_bin'], 'w') as fd:
+            fd.write('(')
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()) as s:
+            self.rjs.link(self.spec)
+        self.assertIn('r.js will be invoked directly', s.getvalue())
+        self.assertIn('invoking', s.getvalue())
+        self.assertEqual(self.rjs.rjs_workers, {})
+
+    @unittest.skipIf(which('node') is None, 'Node.js not available')
+    def test_link_worker_started(self):
+        with open(self.spec['rjs_bin'], 'w') as fd:
+            fd.write(fake_rjs)
+        self.addCleanup(self.rjs.close_rjs_workers)
+        with open(self.build_manifest_path, 'w') as fd:
+            fd.write('(\n%s\n)' % json.dumps({
+                'out': join(self.tmpdir, 'export.js'),
+                'include': ['module'],
+            }))
+        with pretty_logging(logger='calmjs.rjs', stream=StringIO()):
+            self.rjs.link(self.spec)
+            self.rjs.link(self.spec)
+        self.assertTrue(exists(join(self.tmpdir, 'export.js')))
+        self.assertEqual(len(self.rjs.rjs_workers), 1)
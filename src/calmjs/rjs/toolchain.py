@@ -30,33 +30,67 @@ support for them quite just yet as of mid 2016.
 
 from __future__ import unicode_literals
 
+import atexit
+import codecs
 import json
 import logging
+import shutil
 import sys
+from os import makedirs
+from os import sep
+from os.path import basename
 from os.path import dirname
 from os.path import join
 from os.path import exists
 from os.path import isdir
 from os.path import isfile
+from os.path import relpath
+from os.path import splitext
 from subprocess import call
+from tempfile import TemporaryFile
 
 from calmjs.registry import get
+from calmjs.toolchain import Spec
 from calmjs.toolchain import Toolchain
+from calmjs.toolchain import CLEANUP
 from calmjs.toolchain import CONFIG_JS_FILES
 from calmjs.toolchain import EXPORT_TARGET
 from calmjs.toolchain import BUILD_DIR
 from calmjs.toolchain import EXPORT_MODULE_NAMES
+from calmjs.toolchain import GENERATE_SOURCE_MAP
 
+from .cache import ContentCache
+from .utils import copy_file
 from .utils import dict_get
 from .utils import dict_key_update_overwrite_check
 from .dev import rjs_advice
+from .dev import write_defines_manifest
+from .ecma import parser_version
 from .exc import RJSRuntimeError
 from .exc import RJSExitError
+from .minify import MINIFIER_VERSION
+from .minify import minifiers
+from .minify import minify_paths
 from .registry import RJS_LOADER_PLUGIN_REGISTRY
 from .registry import RJS_LOADER_PLUGIN_REGISTRY_KEY
 from .registry import RJS_LOADER_PLUGIN_REGISTRY_NAME
-from .requirejs import extract_all_amd_requires
-from .requirejs import process_path
+from .requirejs import DEFINES_MANIFEST
+from .requirejs import DEPENDENCY_RECORDS
+from .requirejs import EXTRACTOR_VERSION
+from .requirejs import amd_requires_extractors
+from .requirejs import dependency_extractors
+from .requirejs import process_paths
+from .state import BuildState
+from .state import walk_files
+from .trace import BuildTrace
+from .trace import MODULE
+from .trace import file_size
+from .trace import trace_span
+from .worker import RJSWorker
+from .worker import RJSWorkerError
+from .worker import build_output_modnames
+from .worker import load_build_config
+from .worker import resolve_build_config
 from .umdjs import UMD_NODE_AMD_HEADER
 from .umdjs import UMD_NODE_AMD_FOOTER
 from .umdjs import UMD_NODE_AMD_INDENT
@@ -75,6 +109,36 @@ _DEFAULT_RUNTIME = 'r.js'
 # reserved spec keys for this package
 REQUIREJS_PLUGINS = 'requirejs_plugins'
 STUB_MISSING_WITH_EMPTY = 'stub_missing_with_empty'
+CACHE_DIR = 'cache_dir'
+PARSE_WORKERS = 'parse_workers'
+EXTRACT_ENGINE = 'extract_engine'
+INCREMENTAL = 'incremental'
+BUILD_STATE = 'build_state'
+RJS_WORKER = 'rjs_worker'
+TRACE = 'trace'
+BUILD_TRACE = 'build_trace'
+MODULE_GRAPH = 'module_graph'
+# the mapping of the names of the bundles to be split out of the export
+# target to the lists of their entry module names, and the mapping of
+# those names to the paths of the files produced for them.
+BUNDLES = 'bundles'
+BUNDLE_TARGETS = 'bundle_targets'
+# the mapping of the build manifests to the lists of the module names
+# reported as written to their outputs by the link step.
+LINK_DEFINES = 'link_defines'
+# link with the Linker in place of r.js.
+PYTHON_LINKER = 'python_linker'
+# the name of the minifier to minify every module with before linking.
+MINIFY = 'minify'
+# write the content hashed copies of the artifacts, with the manifest of
+# them written to this path (or next to the export target if True).
+HASHED_ARTIFACTS = 'hashed_artifacts'
+# the requirejs config for the build directory, as generated by the
+# assemble step.
+REQUIREJS_CONFIG = 'requirejs_config'
+
+# the number of characters read at a time by the transpilers.
+TRANSPILE_BLOCK_SIZE = 1 << 18
 
 
 def spec_update_source_map(spec, source_map, default_source_key):
@@ -92,10 +156,31 @@ def spec_update_source_map(spec, source_map, default_source_key):
         plugin[modname] = source
 
 
+def bundle_path(path, name):
+    """
+    Return the path for the file of the bundle name that is produced in
+    addition to the file at path.
+    """
+
+    root, ext = splitext(path)
+    return '%s.%s%s' % (root, name, ext)
+
+
 def get_rjs_runtime_name(platform):
     return _PLATFORM_SPECIFIC_RUNTIME.get(platform, 'r.js')
 
 
+def write_config_js(path, config):
+    """
+    Write the config as the UMD module that applies it to requirejs.
+    """
+
+    with open(path, 'w') as fd:
+        fd.write(UMD_REQUIREJS_JSON_EXPORT_HEADER)
+        json.dump(config, fd, indent=4)
+        fd.write(UMD_REQUIREJS_JSON_EXPORT_FOOTER)
+
+
 def update_base_requirejs_config(d):
     d.update({
         'paths': {},
@@ -136,33 +221,93 @@ def update_base_requirejs_config(d):
     })
 
 
-def _null_transpiler(spec, reader, writer):
-    line = reader.readline()
-    while line:
+def _read_line_blocks(reader, size=None):
+    """
+    Read the reader in blocks of size characters (defaults to the value
+    of TRANSPILE_BLOCK_SIZE), producing 2-tuples of the list of lines
+    and a flag for whether the lines are all complete and will be split
+    by the SourceWriter the same way.  The final partial line, if any,
+    is produced on its own.
+
+    The lines are split the same way as readline of the reader would;
+    the stream readers from codecs (as used by the toolchain) split on
+    all the line boundaries recognized by str.splitlines, while the
+    io text streams split on newlines only.
+    """
+
+    size = size or TRANSPILE_BLOCK_SIZE
+    universal = isinstance(
+        reader, (codecs.StreamReader, codecs.StreamReaderWriter))
+    remainder = ''
+    while True:
+        block = reader.read(size)
+        if not block:
+            break
+        text = remainder + block
+        if universal:
+            lines = text.splitlines(True)
+            last = lines[-1]
+            # a trailing carriage return may be followed by a newline
+            # in the next block.
+            if last.endswith('\r') or last.splitlines()[0] == last:
+                remainder = lines.pop()
+            else:
+                remainder = ''
+        else:
+            end = text.rfind('\n') + 1
+            remainder = text[end:]
+            text = text[:end]
+            lines = text.splitlines(True)
+            if len(lines) != text.count('\n'):
+                # other line separators are present, which the writer
+                # will split on.
+                yield [line + '\n' for line in text.split('\n')[:-1]], False
+                continue
+        if lines:
+            # the complete lines all end with a newline if the counts
+            # match, as the remainder will not have one.
+            yield lines, len(lines) == text.count('\n')
+    if remainder:
+        yield [remainder], False
+
+
+def _write_lines(writer, lines, indent, fast=False):
+    """
+    Write the lines, with the indent written as padding before the ones
+    that are not blank.
+
+    If fast is specified and there is no indent, the lines are joined
+    and written at once, for which the writer will produce the same
+    mappings as the writes of the individual lines, as fast must only
+    be specified for lines that the writer will split the same way.
+    """
+
+    if fast and not indent:
+        writer.write(''.join(lines))
+        return
+
+    for line in lines:
+        if indent and line.strip():
+            writer.write_padding(indent)
         writer.write(line)
-        line = reader.readline()
+
+
+def _null_transpiler(spec, reader, writer):
+    for lines, fast in _read_line_blocks(reader):
+        _write_lines(writer, lines, '', fast)
 
 
 def _transpile_generic_to_umd_node_amd_compat_rjs(spec, reader, writer):
     level = UMD_NODE_AMD_INDENT
     indent = '' if spec.get('transpile_no_indent') else ' ' * level
-    _states = {
-        'pad': 3,  # length of the header to track
-    }
-
-    def write_line(line):
-        contents = line.strip()
-        if _states['pad']:
-            if not contents:
-                writer.discard(line)
-                _states['pad'] -= 1
-                return
-            _states['pad'] = 0
-        if contents:
-            writer.write_padding(indent)
-        writer.write(line)
-
-    line = reader.readline()
+    # the number of leading blank lines to discard, as the header
+    # takes their place.
+    pad = 3
+
+    blocks = _read_line_blocks(reader)
+    lines, fast = next(blocks, ([''], False))
+    pos = 0
+    line = lines[0]
     if line.strip() in ("'use strict';", '"use strict";'):
         header_lines = iter(UMD_NODE_AMD_HEADER.splitlines(True))
         writer.write_padding(next(header_lines))
@@ -170,26 +315,46 @@ def _transpile_generic_to_umd_node_amd_compat_rjs(spec, reader, writer):
         writer.write_padding(indent)
         writer.write(line)
         writer.write_padding(next(header_lines))
+        pos = 1
     else:
         writer.write_padding(UMD_NODE_AMD_HEADER)
-        write_line(line)
 
-    while line:
-        line = reader.readline()
-        write_line(line)
+    while True:
+        while pad and pos < len(lines):
+            if lines[pos].strip():
+                pad = 0
+                break
+            writer.discard(lines[pos])
+            pad -= 1
+            pos += 1
+        _write_lines(writer, lines[pos:] if pos else lines, indent, fast)
+        lines, fast = next(blocks, (None, False))
+        if lines is None:
+            break
+        pos = 0
 
     writer.write_padding(UMD_NODE_AMD_FOOTER)
 
 
-def _rjs_transpiler(spec, reader, writer):
-    # ensure the reader is done from beginning
-    reader.seek(0)
+def _is_amd_define(reader):
+    """
+    Return True if the first statement read from the reader (ignoring
+    blank lines and the use strict directive) is an AMD define.
+    """
+
     line = reader.readline()
     while line and line.strip() in ('', "'use strict';", '"use strict";'):
         line = reader.readline()
+    return line.strip().startswith('define(')
+
+
+def _rjs_transpiler(spec, reader, writer):
+    # ensure the reader is done from beginning
+    reader.seek(0)
+    is_amd_define = _is_amd_define(reader)
     # back to the beginning
     reader.seek(0)
-    if line.strip().startswith('define('):
+    if is_amd_define:
         return _null_transpiler(spec, reader, writer)
     else:
         return _transpile_generic_to_umd_node_amd_compat_rjs(
@@ -204,6 +369,12 @@ class RJSToolchain(Toolchain):
     rjs_bin_key = 'rjs_bin'
     rjs_bin = get_rjs_runtime_name(sys.platform)
     build_manifest_name = 'build.js'
+    build_state_name = 'build_state.json'
+    trace_name = 'trace.json'
+    module_graph_name = 'module_graph.sqlite'
+    minified_dir_name = 'minified'
+    # the number of the slowest modules to report for traced builds.
+    trace_top_count = 10
     requirejs_config_name = 'config.js'
     node_config_name = 'node.js'
 
@@ -212,9 +383,25 @@ class RJSToolchain(Toolchain):
             loader_plugin_registry=RJS_LOADER_PLUGIN_REGISTRY_NAME,
             *a, **kw):
         super(RJSToolchain, self).__init__(*a, **kw)
-        self.loader_plugin_registry = get(loader_plugin_registry)
+        # the registry and the location of the binary are resolved when
+        # first needed, such that the construction of instances (e.g.
+        # the default one at import time) is cheap.
+        self.loader_plugin_registry_name = loader_plugin_registry
+        self._loader_plugin_registry = None
         self.binary = self.rjs_bin
-        self._set_env_path_with_node_modules()
+        # the persistent r.js workers, keyed by the r.js binary.
+        self.rjs_workers = {}
+
+    @property
+    def loader_plugin_registry(self):
+        if self._loader_plugin_registry is None:
+            self._loader_plugin_registry = get(
+                self.loader_plugin_registry_name)
+        return self._loader_plugin_registry
+
+    @loader_plugin_registry.setter
+    def loader_plugin_registry(self, value):
+        self._loader_plugin_registry = value
 
     def setup_transpiler(self):
         self.transpiler = _rjs_transpiler
@@ -230,23 +417,64 @@ class RJSToolchain(Toolchain):
         prepared through this class's prepare method.
         """
 
+        with trace_span(spec.get(BUILD_TRACE), 'plugin'):
+            return self._compile_plugin(spec, entries)
+
+    def _compile_plugin(self, spec, entries):
         plugins_modpaths = {}
         plugins_targets = {}
         export_module_names = []
 
+        state = spec.get(BUILD_STATE)
+        trace = spec.get(BUILD_TRACE)
+
         for modname, source, target, modpath in entries:
             if source == EMPTY or modpath == EMPTY:
                 continue
             plugin_name, arguments = modname.split('!', 1)
             handler = spec[RJS_LOADER_PLUGIN_REGISTRY].get_record(plugin_name)
-            p_pm, p_pt, m_ns = handler(
-                self, spec, modname, source, target, modpath)
+            key = 'plugin:' + modname
+            sources = walk_files(source)
+            extra = [type(handler).__name__, target, modpath]
+            # the files the handler had written in the previous build.
+            previous = state and state.result(key)
+            targets = previous and self._plugin_build_targets(
+                spec, previous[1])
+            if state and state.is_current(key, sources, targets or (), extra):
+                logger.debug(
+                    "skipping unchanged '%s' for loader plugin '%s'",
+                    source, plugin_name,
+                )
+                p_pm, p_pt, m_ns = state.result(key)
+            else:
+                with trace_span(
+                        trace, modname, MODULE, phase='plugin', source=source,
+                        source_bytes=sum(file_size(p) for p in sources)):
+                    p_pm, p_pt, m_ns = handler(
+                        self, spec, modname, source, target, modpath)
+                if state:
+                    state.update(
+                        key, sources, self._plugin_build_targets(spec, p_pt),
+                        extra=extra, result=[p_pm, p_pt, m_ns])
             _spec = locals()
             dict_key_update_overwrite_check(_spec, 'plugins_modpaths', p_pm)
             dict_key_update_overwrite_check(_spec, 'plugins_targets', p_pt)
             export_module_names.extend(m_ns)
         return plugins_modpaths, plugins_targets, export_module_names
 
+    def _plugin_build_targets(self, spec, plugins_targets):
+        """
+        Return the sorted list of the files in the build directory for
+        the targets produced by a loader plugin handler.
+        """
+
+        return sorted(set(
+            path for path in (
+                join(spec[BUILD_DIR], target)
+                for target in plugins_targets.values()
+            ) if isfile(path)
+        ))
+
     def modname_source_target_to_modpath(self, spec, modname, source, target):
         """
         Return 'empty:' if the source is also that, as this is the only
@@ -264,8 +492,268 @@ class RJSToolchain(Toolchain):
             # marked to be ignored for r.js, and so don't bother letting
             # parent "compile" this (which is just a simple copying)
             return
-        super(RJSToolchain, self).transpile_modname_source_target(
-            spec, modname, source, target)
+
+        state = spec.get(BUILD_STATE)
+        if not state:
+            return self._transpile_modname_source_target(
+                spec, modname, source, target)
+
+        key = 'transpile:' + target
+        bd_target = join(spec[BUILD_DIR], target)
+        extra = [
+            self.transpiler.__name__,
+            bool(spec.get('transpile_no_indent')),
+            bool(spec.get(GENERATE_SOURCE_MAP)),
+        ]
+        if state.is_current(key, [source], [bd_target], extra=extra):
+            logger.debug("skipping transpile of unchanged '%s'", source)
+            return
+        self._transpile_modname_source_target(spec, modname, source, target)
+        state.update(key, [source], [bd_target], extra=extra)
+
+    def _transpile_modname_source_target(
+            self, spec, modname, source, target):
+        with trace_span(
+                spec.get(BUILD_TRACE), modname, MODULE, phase='transpile',
+                source=source, source_bytes=file_size(source)) as args:
+            if not self.passthrough_modname_source_target(
+                    spec, modname, source, target):
+                super(RJSToolchain, self).transpile_modname_source_target(
+                    spec, modname, source, target)
+            args['target_bytes'] = file_size(join(spec[BUILD_DIR], target))
+
+    def passthrough_modname_source_target(
+            self, spec, modname, source, target):
+        """
+        Copy the source to the target in the build directory as is, if
+        the source is already an AMD module that the default transpiler
+        would have passed through unchanged, such that the copying will
+        be done by the operating system rather than line by line.  This
+        is not done if source maps are to be generated.
+
+        Returns True if the source was copied.
+        """
+
+        if (self.transpiler is not _rjs_transpiler or
+                spec.get(GENERATE_SOURCE_MAP)):
+            return False
+        with self.opener(source, 'r') as reader:
+            if not _is_amd_define(reader):
+                return False
+
+        bd_target = join(spec[BUILD_DIR], target)
+        self._validate_build_target(spec, bd_target)
+        logger.info('Copying %s to %s', source, bd_target)
+        if not exists(dirname(bd_target)):
+            makedirs(dirname(bd_target))
+        copy_file(source, bd_target)
+        return True
+
+    def compile_transpile(self, spec, entries):
+        with trace_span(spec.get(BUILD_TRACE), 'transpile'):
+            return super(RJSToolchain, self).compile_transpile(spec, entries)
+
+    def compile_bundle(self, spec, entries):
+        """
+        Same as the parent implementation, except the copying of the
+        unchanged sources will be skipped for the incremental build,
+        and the copying will be traced for the traced build.
+        """
+
+        trace = spec.get(BUILD_TRACE)
+        if not (spec.get(BUILD_STATE) or trace):
+            return super(RJSToolchain, self).compile_bundle(spec, entries)
+        with trace_span(trace, 'bundle'):
+            return self._compile_bundle(spec, entries)
+
+    def _compile_bundle(self, spec, entries):
+        state = spec.get(BUILD_STATE)
+        trace = spec.get(BUILD_TRACE)
+        bundled_modpaths = {}
+        bundled_targets = {}
+        export_module_names = []
+
+        for modname, source, target, modpath in entries:
+            bundled_modpaths[modname] = modpath
+            bundled_targets[modname] = target
+            if isfile(source):
+                export_module_names.append(modname)
+                copy_target = join(spec[BUILD_DIR], target)
+                sources = [source]
+                targets = [copy_target]
+            elif isdir(source):
+                copy_target = join(spec[BUILD_DIR], modname)
+                sources = walk_files(source)
+                targets = [
+                    join(copy_target, relpath(path, source))
+                    for path in sources
+                ]
+            else:
+                continue
+
+            key = 'bundle:' + modname
+            if state and state.is_current(key, sources, targets):
+                logger.debug("skipping copy of unchanged '%s'", source)
+                continue
+
+            with trace_span(
+                    trace, modname, MODULE, phase='bundle', source=source,
+                    source_bytes=sum(file_size(path) for path in sources)):
+                if isfile(source):
+                    if not exists(dirname(copy_target)):
+                        makedirs(dirname(copy_target))
+                    shutil.copy(source, copy_target)
+                else:
+                    # the previous copy is replaced for the incremental
+                    # build.
+                    if state and exists(copy_target):
+                        shutil.rmtree(copy_target)
+                    shutil.copytree(source, copy_target)
+            if state:
+                state.update(key, sources, targets)
+
+        return bundled_modpaths, bundled_targets, export_module_names
+
+    def get_content_cache(self, spec, name, version=''):
+        """
+        Return a ContentCache for the name inside the directory that was
+        specified as the CACHE_DIR in the spec, or None if that was not
+        specified.
+        """
+
+        cache_dir = spec.get(CACHE_DIR)
+        if not cache_dir:
+            return None
+        return ContentCache(
+            join(cache_dir, name), version='%s:%s' % (name, version))
+
+    def extract_amd_requires(self, spec, paths):
+        """
+        Extract all the AMD and CommonJS module names required by each
+        of the provided paths, returning a list of the lists of names
+        in the same order as the paths, with None for the paths that
+        failed to be processed.
+
+        The parsing is distributed across a pool of processes if the
+        spec specified PARSE_WORKERS, and the results are cached if a
+        CACHE_DIR was specified.  The implementation used for the
+        extraction may be selected through the EXTRACT_ENGINE in the
+        spec, which must be a key of amd_requires_extractors.
+
+        For incremental builds, only the paths that have changed since
+        the previous build will be processed.
+
+        If the engine is able to produce the complete records of the
+        dependencies (i.e. a key of dependency_extractors), the records
+        will be kept in the spec under DEPENDENCY_RECORDS, keyed by the
+        path, such that the sources will not be parsed again for the
+        other dependency information in the same build (e.g. the
+        defines in the artifacts for the karma test runner).
+        """
+
+        engine = spec.get(EXTRACT_ENGINE) or 'ast'
+        if engine not in amd_requires_extractors:
+            raise RJSRuntimeError(
+                "'%s' is not a valid '%s'; must be one of %s" % (
+                    engine, EXTRACT_ENGINE, sorted(amd_requires_extractors)))
+
+        results = self._extract_dependencies(spec, paths, engine)
+        if engine not in dependency_extractors:
+            return results
+
+        records = spec.setdefault(DEPENDENCY_RECORDS, {})
+        for path, record in zip(paths, results):
+            if record is not None:
+                records[path] = record
+        return [None if record is None else record[1] for record in results]
+
+    def _extract_dependencies(self, spec, paths, engine):
+        state = spec.get(BUILD_STATE)
+        if not state:
+            return self._parse_paths(spec, paths, engine)
+
+        # only the paths that have changed since the previous build
+        # need to be processed.
+        extra = [engine, EXTRACTOR_VERSION, parser_version()]
+        keys = ['requires:' + path for path in paths]
+        results = [
+            state.result(key) if state.is_current(key, [path], extra=extra)
+            else None
+            for key, path in zip(keys, paths)
+        ]
+        changed = [idx for idx, result in enumerate(results) if result is None]
+        processed = self._parse_paths(
+            spec, [paths[idx] for idx in changed], engine)
+        for idx, result in zip(changed, processed):
+            results[idx] = result
+            if result is not None:
+                state.update(
+                    keys[idx], [paths[idx]], extra=extra, result=result)
+        logger.debug(
+            "%d of %d target(s) changed since previous build",
+            len(changed), len(paths),
+        )
+        return results
+
+    def _parse_paths(self, spec, paths, engine):
+        processes = spec.get(PARSE_WORKERS)
+        f = dependency_extractors.get(engine) or amd_requires_extractors[
+            engine]
+        cache = self.get_content_cache(
+            spec, 'amd_requires', '%s:%s:%s' % (
+                engine, EXTRACTOR_VERSION, parser_version()))
+        if not cache:
+            return process_paths(paths, f, processes=processes)
+
+        results = cache.process_paths(paths, f, processes=processes)
+        logger.debug(
+            "cache '%s' had %d hits and %d misses",
+            cache.cache_dir, cache.hits, cache.misses,
+        )
+        cache.prune()
+        return results
+
+    def calf(self, spec):
+        """
+        Same as the parent implementation, with the phases of the build
+        recorded into a BuildTrace if a path was specified for TRACE in
+        the spec (or True for the default path next to the export
+        target), which will be written out at the end of the build.
+        """
+
+        if (isinstance(spec, Spec) and spec.get(TRACE) and
+                spec.get(BUILD_TRACE) is None):
+            trace = spec[BUILD_TRACE] = BuildTrace()
+            for phase in (
+                    'prepare', 'compile', 'assemble', 'link', 'finalize'):
+                spec.advise('before_' + phase, trace.begin, phase)
+                spec.advise('after_' + phase, trace.end, phase)
+            spec.advise(CLEANUP, self.write_trace, spec)
+        return super(RJSToolchain, self).calf(spec)
+
+    def write_trace(self, spec):
+        """
+        Write out the BuildTrace of the spec as a Chrome trace event
+        file, and log the summary with the slowest modules.
+        """
+
+        trace = spec[BUILD_TRACE]
+        trace.end_pending()
+        path = spec[TRACE]
+        if path is True:
+            path = '%s.%s' % (
+                splitext(spec[EXPORT_TARGET])[0], self.trace_name)
+        try:
+            trace.dump(path, self.trace_top_count)
+        except (OSError, IOError) as e:
+            logger.warning(
+                "failed to write build trace '%s': %s: %s",
+                path, type(e).__name__, e,
+            )
+            return
+        logger.info("wrote build trace to '%s'", path)
+        logger.info('build trace summary:\n%s', '\n'.join(
+            trace.summary(self.trace_top_count)))
 
     def prepare(self, spec):
         """
@@ -277,10 +765,19 @@ class RJSToolchain(Toolchain):
         loader_plugin_registry = spec[RJS_LOADER_PLUGIN_REGISTRY] = (
             loader_plugin_registry or self.loader_plugin_registry)
 
+        # the PATH with the node_modules binaries is also needed for
+        # the processes spawned with a specified r.js binary.
+        if self.env_path is None:
+            self._set_env_path_with_node_modules()
+
         if self.rjs_bin_key not in spec:
             which_bin = spec[self.rjs_bin_key] = (
                 self.which() or self.which_with_node_modules())
-            if which_bin is None:
+            if which_bin is None and spec.get(PYTHON_LINKER):
+                logger.info(
+                    "unable to locate '%s'; only the Python linker will be "
+                    "available", self.binary)
+            elif which_bin is None:
                 raise RJSRuntimeError(
                     "unable to locate '%s'" % self.binary)
             logger.debug("using '%s' as '%s'", which_bin, self.binary)
@@ -296,13 +793,18 @@ class RJSToolchain(Toolchain):
         # with requirejs, it would be nice to also build a simple config
         # that can be used from within node with the stuff in just the
         # build directory - if this wasn't already defined for some
-        # reason.
-        spec['requirejs_config_js'] = join(
-            spec['build_dir'], self.requirejs_config_name)
-        spec['node_config_js'] = join(
-            spec['build_dir'], self.node_config_name)
-        spec['build_manifest_path'] = join(
-            spec[BUILD_DIR], self.build_manifest_name)
+        # reason.  These are also left as is if specified, such that
+        # multiple targets may share a build directory.
+        for key, name in (
+                ('requirejs_config_js', self.requirejs_config_name),
+                ('node_config_js', self.node_config_name),
+                ('build_manifest_path', self.build_manifest_name)):
+            if not spec.get(key):
+                spec[key] = join(spec[BUILD_DIR], name)
+
+        if spec.get(INCREMENTAL) and not spec.get(BUILD_STATE):
+            spec[BUILD_STATE] = BuildState.load(
+                join(spec[BUILD_DIR], self.build_state_name))
 
         if EXPORT_TARGET not in spec:
             raise RJSRuntimeError(
@@ -392,6 +894,11 @@ class RJSToolchain(Toolchain):
 
         emptied = set()
 
+        # the full paths to the targets that will be parsed, and the
+        # module names for them.
+        parse_targets = []
+        parse_modnames = []
+
         # correct the targets by appending a ? for the affected targets
         source_prefixes = ('transpiled', 'bundled')
         for prefix in source_prefixes:
@@ -411,16 +918,22 @@ class RJSToolchain(Toolchain):
                     if isfile(full_target):
                         configured_paths[modname] = target + '?'
                         # also, do the parsing for the parsed paths
-                        # this should also preemptively report potential
-                        # syntax error.
-                        parsed_required_paths.update({
-                            modname: EMPTY for modname in (process_path(
-                                full_target, extract_all_amd_requires) or [])
-                        })
+                        parse_targets.append(full_target)
+                        parse_modnames.append(modname)
                         continue
 
                 configured_paths[modname] = target
 
+        # this should also preemptively report potential syntax error.
+        with trace_span(
+                spec.get(BUILD_TRACE), 'parse', files=len(parse_targets),
+                bytes=sum(file_size(path) for path in parse_targets)):
+            parsed_requires = self.extract_amd_requires(spec, parse_targets)
+            for requires in parsed_requires:
+                parsed_required_paths.update({
+                    modname: EMPTY for modname in (requires or [])
+                })
+
         # finally, update the config with the plugin targets, which
         # should have been correctly processed by the plugin handlers.
         configured_paths.update(spec['plugins_targets'])
@@ -458,41 +971,622 @@ class RJSToolchain(Toolchain):
             build_config['paths'].update(
                 {k: v for k, v in spec[key].items() if v == EMPTY})
 
+        if spec.get(MINIFY):
+            with trace_span(
+                    spec.get(BUILD_TRACE), 'minify', files=len(parse_targets)):
+                build_config['paths'].update(self.minify_targets(
+                    spec, parse_modnames, parse_targets))
+
         # build a configuration for usage directly from nodejs (which
         # may or may not work, but a test can find out).
         nodejs_config = {}
         nodejs_config.update(build_config)
         nodejs_config['baseUrl'] = spec['build_dir']
 
-        # write out the configuration files
-        with open(spec['build_manifest_path'], 'w') as fd:
-            fd.write('(\n')
-            json.dump(build_config, fd, indent=4)
-            fd.write('\n)')
+        bundle_configs = {}
+        if spec.get(BUNDLES):
+            with trace_span(spec.get(BUILD_TRACE), 'bundles'):
+                bundle_configs = self.split_bundles(
+                    spec, build_config, requirejs_config,
+                    dict(zip(parse_modnames, parsed_requires)),
+                )
+
+        # kept for the paths to be rewritten to the hashed artifacts.
+        spec[REQUIREJS_CONFIG] = requirejs_config
+        with trace_span(spec.get(BUILD_TRACE), 'write_config'):
+            self.write_config_files(
+                spec, build_config, requirejs_config, nodejs_config,
+                bundle_configs,
+            )
+
+        if spec.get(MODULE_GRAPH):
+            with trace_span(spec.get(BUILD_TRACE), 'module_graph'):
+                self.write_module_graph(
+                    spec, zip(parse_modnames, parsed_requires),
+                    emptied, missing_modname,
+                )
+
+        if spec.get(BUILD_STATE):
+            spec[BUILD_STATE].save()
+
+    def minify_targets(self, spec, modnames, paths):
+        """
+        Minify the targets at paths for the modnames into the minified
+        directory inside the build directory, with the minifier named
+        by MINIFY in the spec (True for the default), distributed across
+        PARSE_WORKERS processes.  The minified texts are cached if a
+        CACHE_DIR was specified, and for incremental builds only the
+        targets that have changed since the previous build are minified.
+
+        Returns the mapping of the modnames to their minified targets,
+        as paths for the build config; the targets that failed to be
+        minified are left out, such that they are used as is.
+        """
+
+        engine = spec[MINIFY]
+        if engine is True:
+            engine = 'slimit'
+        if engine not in minifiers:
+            raise RJSRuntimeError(
+                "'%s' is not a valid '%s'; must be one of %s" % (
+                    engine, MINIFY, sorted(minifiers)))
+
+        state = spec.get(BUILD_STATE)
+        extra = [engine, MINIFIER_VERSION, parser_version()]
+        minified_dir = join(spec[BUILD_DIR], self.minified_dir_name)
+        targets = [
+            join(minified_dir, relpath(path, spec[BUILD_DIR]))
+            for path in paths
+        ]
+        changed = [
+            idx for idx, (path, target) in enumerate(zip(paths, targets))
+            if not (state and state.is_current(
+                'minify:' + path, [path], [target], extra=extra))
+        ]
+
+        cache = self.get_content_cache(
+            spec, 'minified', '%s:%s:%s' % (
+                engine, MINIFIER_VERSION, parser_version()))
+        minified = minify_paths(
+            [paths[idx] for idx in changed],
+            [targets[idx] for idx in changed],
+            minifiers[engine], cache=cache,
+            processes=spec.get(PARSE_WORKERS),
+        )
+        if cache:
+            cache.prune()
+
+        failed = set()
+        for idx, ok in zip(changed, minified):
+            if not ok:
+                failed.add(idx)
+            elif state:
+                state.update(
+                    'minify:' + paths[idx], [paths[idx]], [targets[idx]],
+                    extra=extra,
+                )
+        if failed:
+            logger.warning(
+                "%d module(s) failed to be minified and will be used as is",
+                len(failed),
+            )
+        logger.info(
+            "minified %d of %d module(s) with '%s'",
+            len(changed) - len(failed), len(paths), engine,
+        )
+        return {
+            modname: splitext(relpath(
+                target, spec[BUILD_DIR]))[0].replace(sep, '/')
+            for idx, (modname, target) in enumerate(zip(modnames, targets))
+            if idx not in failed
+        }
+
+    def write_module_graph(self, spec, modname_requires, emptied, missing):
+        """
+        Write the ModuleGraph of the build to the path specified as the
+        MODULE_GRAPH in the spec, or inside the build directory if that
+        is True.
+
+        Arguments:
+
+        spec
+            The spec of the build.
+        modname_requires
+            An iterable of the 2-tuples of the module names that were
+            parsed and the list of the module names they require, which
+            may be relative to the requiring module, or None if the
+            parsing failed.
+        emptied
+            The module names that were made empty.
+        missing
+            The module names that were required but not found.
+        """
+
+        # imported here as sqlite3 is not needed by most builds.
+        from sqlite3 import Error as SQLiteError
+        from .graph import EMPTIED
+        from .graph import MISSING
+        from .graph import OK
+        from .graph import ModuleGraph
+        from .graph import module_package
+        from .linker import LinkerError
+        from .linker import normalize
+
+        path = spec[MODULE_GRAPH]
+        if path is True:
+            path = join(spec[BUILD_DIR], self.module_graph_name)
+
+        def size(target):
+            return file_size(join(spec[BUILD_DIR], *target.split('/')))
+
+        modules = {}
+        for prefix, source_key in (
+                ('transpiled', 'transpile_source_map'),
+                ('bundled', 'bundle_source_map')):
+            sources = spec.get(source_key, {})
+            for modname, target in spec.get(prefix + '_targets', {}).items():
+                source = sources.get(modname)
+                modules[modname] = (
+                    modname, source, target, prefix, None,
+                    module_package(modname, source), size(target),
+                    EMPTIED if modname in emptied else OK,
+                )
+
+        # the targets of the plugins are keyed by the paths configured
+        # for the arguments to the plugins, and the plugins themselves.
+        plugins_targets = dict(spec.get('plugins_targets', {}))
+        for modname, source in spec.get('plugin_source_map', {}).items():
+            plugin_name, argument = modname.split('!', 1)
+            target = plugins_targets.pop(argument, None)
+            modules[modname] = (
+                modname, source, target, 'plugins', plugin_name,
+                module_package(modname, source),
+                size(target) if target else 0,
+                EMPTIED if source == EMPTY or target is None else OK,
+            )
+        for modname, target in plugins_targets.items():
+            modules[modname] = (
+                modname, target, target, 'plugins', None,
+                module_package(modname, target), size(target), OK,
+            )
+
+        edges = []
+        for modname, requires in modname_requires:
+            for name in requires or ():
+                try:
+                    required = normalize(name, modname)
+                except LinkerError:
+                    # outside of the top level, so not in the build.
+                    continue
+                if required not in modules:
+                    modules[required] = (
+                        required, None, None, None,
+                        required.split('!', 1)[0] if '!' in required
+                        else None,
+                        module_package(required, None), 0,
+                        MISSING if required in missing or name in missing
+                        else EMPTIED,
+                    )
+                edges.append((modname, required))
+
+        try:
+            ModuleGraph.create(path, modules.values(), edges).close()
+        except (OSError, IOError, SQLiteError) as e:
+            logger.warning(
+                "failed to write module graph '%s': %s: %s",
+                path, type(e).__name__, e,
+            )
+            return
+        logger.info(
+            "wrote module graph with %d modules and %d edges to '%s'",
+            len(modules), len(edges), path,
+        )
+
+    def split_bundles(self, spec, build_config, requirejs_config, requires):
+        """
+        Split the modules of the build into the bundles specified as the
+        BUNDLES in the spec, and a common layer that is built into the
+        export target.
+
+        Every bundle gets the modules reachable from its entry modules
+        that are not reachable from any other bundle; the rest (i.e.
+        the modules shared between bundles, or not reachable from any
+        of them) along with all that they require form the common
+        layer.  The build_config is updated to include just the common
+        layer, and the bundles configuration for loading the modules
+        on demand is added to the requirejs_config.
+
+        Returns a mapping of the bundle names to their build configs.
+
+        Arguments:
+
+        spec
+            The spec of the build.
+        build_config
+            The build config for the export target.
+        requirejs_config
+            The requirejs config for the build directory.
+        requires
+            A mapping of the module names that were parsed to the lists
+            of the module names they require, which may be relative to
+            the requiring module.
+        """
+
+        from .linker import LinkerError
+        from .linker import normalize
+
+        bundles = spec[BUNDLES]
+        export_module_names = build_config['include']
+        modnames = set(export_module_names)
+        for name, entries in sorted(bundles.items()):
+            unknown = sorted(set(entries) - modnames)
+            if unknown:
+                raise RJSRuntimeError(
+                    "entry module(s) for bundle '%s' not found in the "
+                    "build: %s" % (name, ', '.join(unknown)))
+
+        def required(parent):
+            for modname in requires.get(parent) or ():
+                try:
+                    yield normalize(modname, parent)
+                except LinkerError:
+                    # outside of the top level, so not in the build.
+                    continue
+
+        def reachable(roots):
+            found = set(roots)
+            stack = list(found)
+            while stack:
+                for modname in required(stack.pop()):
+                    if modname in modnames and modname not in found:
+                        found.add(modname)
+                        stack.append(modname)
+            return found
+
+        reached = {
+            name: reachable(entries) for name, entries in bundles.items()}
+        counts = {}
+        for found in reached.values():
+            for modname in found:
+                counts[modname] = counts.get(modname, 0) + 1
+        common = reachable(
+            modname for modname in modnames if counts.get(modname) != 1)
+        build_config['include'] = [
+            modname for modname in export_module_names if modname in common]
+
+        root = splitext(spec[EXPORT_TARGET])[0]
+        bundle_ids = {basename(root): build_config['include']}
+        requirejs_config['paths'][basename(root)] = root
+        bundle_configs = {}
+        bundle_targets = spec[BUNDLE_TARGETS] = {}
+        for name in sorted(bundles):
+            bundle_config = dict(build_config)
+            bundle_config['out'] = bundle_targets[name] = bundle_path(
+                spec[EXPORT_TARGET], name)
+            bundle_config['include'] = [
+                modname for modname in export_module_names
+                if modname in reached[name] and modname not in common
+            ]
+            # the common layer is dependency complete, so its modules
+            # and everything they require are excluded.
+            bundle_config['exclude'] = build_config['include']
+            bundle_configs[name] = bundle_config
+            bundle_id = '%s.%s' % (basename(root), name)
+            bundle_ids[bundle_id] = bundle_config['include']
+            requirejs_config['paths'][bundle_id] = splitext(
+                bundle_config['out'])[0]
+            logger.info(
+                "bundle '%s' has %d module(s) not in the common layer",
+                name, len(bundle_config['include']),
+            )
+
+        logger.info(
+            "common layer has %d of %d module(s)",
+            len(build_config['include']), len(export_module_names),
+        )
+        requirejs_config['bundles'] = bundle_ids
+        return bundle_configs
+
+    def write_config_files(
+            self, spec, build_config, requirejs_config, nodejs_config,
+            bundle_configs=None):
+        """
+        Write out the configuration files produced by assemble.
+        """
+
+        manifests = [(spec['build_manifest_path'], build_config)]
+        manifests.extend(
+            (bundle_path(spec['build_manifest_path'], name), config)
+            for name, config in sorted((bundle_configs or {}).items())
+        )
+        for path, config in manifests:
+            with open(path, 'w') as fd:
+                fd.write('(\n')
+                json.dump(config, fd, indent=4)
+                fd.write('\n)')
+
+        write_config_js(spec['requirejs_config_js'], requirejs_config)
+        write_config_js(spec['node_config_js'], nodejs_config)
+
+    def get_rjs_worker(self, spec):
+        """
+        Return a running RJSWorker for the r.js binary specified in the
+        spec, starting one if needed.  Returns None if that failed.
+        """
+
+        rjs_bin = spec[self.rjs_bin_key]
+        worker = self.rjs_workers.get(rjs_bin)
+        if worker is not None and worker.alive:
+            return worker
+
+        worker = RJSWorker(rjs_bin, **self._gen_call_kws())
+        try:
+            worker.start()
+        except RJSWorkerError as e:
+            logger.warning('%s; r.js will be invoked directly', e)
+            return None
+        if not self.rjs_workers:
+            atexit.register(self.close_rjs_workers)
+        self.rjs_workers[rjs_bin] = worker
+        return worker
+
+    def close_rjs_workers(self):
+        """
+        Stop all the r.js workers started by this toolchain.
+        """
+
+        while self.rjs_workers:
+            self.rjs_workers.popitem()[1].close()
+
+    def link_with_worker(self, spec, build_manifest_path=None):
+        """
+        Do the build with the persistent r.js worker, returning the exit
+        code, or None if the worker is not available such that r.js
+        should be invoked directly.  The build manifest defaults to the
+        one for the export target.
+        """
+
+        worker = self.get_rjs_worker(spec)
+        if worker is None:
+            return None
 
-        with open(spec['requirejs_config_js'], 'w') as fd:
-            fd.write(UMD_REQUIREJS_JSON_EXPORT_HEADER)
-            json.dump(requirejs_config, fd, indent=4)
-            fd.write(UMD_REQUIREJS_JSON_EXPORT_FOOTER)
+        build_manifest_path = (
+            build_manifest_path or spec['build_manifest_path'])
+        logger.info("building '%s' with r.js worker", build_manifest_path)
+        config = resolve_build_config(
+            load_build_config(build_manifest_path),
+            dirname(build_manifest_path),
+        )
+        try:
+            response = worker.build(config)
+        except RJSWorkerError as e:
+            logger.warning('%s; r.js will be invoked directly', e)
+            self.rjs_workers.pop(spec[self.rjs_bin_key], None)
+            return None
+
+        if not response['ok']:
+            logger.error('r.js worker build failed: %s', response['error'])
+            return 1
+        logger.debug('r.js worker output: %s', response['output'])
+        spec.setdefault(LINK_DEFINES, {})[build_manifest_path] = (
+            build_output_modnames(response['output'], config))
+        return 0
+
+    def link_with_rjs(self, spec, build_manifest_path=None):
+        """
+        Do the build by invoking r.js, returning its exit code.  The
+        build manifest defaults to the one for the export target.  The
+        module names listed in the output of r.js are recorded.
+        """
+
+        build_manifest_path = (
+            build_manifest_path or spec['build_manifest_path'])
+        args = (spec[self.rjs_bin_key], '-o', build_manifest_path)
+        logger.info('invoking %s %s %s', *args)
+        with TemporaryFile('w+') as fd:
+            rc = call(args, stdout=fd)
+            fd.seek(0)
+            output = fd.read()
+        if output.strip():
+            logger.info('r.js output: %s', output)
+        if rc == 0:
+            spec.setdefault(LINK_DEFINES, {})[build_manifest_path] = (
+                build_output_modnames(output, resolve_build_config(
+                    load_build_config(build_manifest_path),
+                    dirname(build_manifest_path),
+                )))
+        return rc
+
+    def link_with_linker(self, spec, build_manifest_path=None):
+        """
+        Do the build with the Linker, returning the exit code, or None
+        if the build needs features that only r.js provides such that
+        it should be invoked instead.  The build manifest defaults to the
+        one for the export target.
+        """
 
-        with open(spec['node_config_js'], 'w') as fd:
-            fd.write(UMD_REQUIREJS_JSON_EXPORT_HEADER)
-            json.dump(nodejs_config, fd, indent=4)
-            fd.write(UMD_REQUIREJS_JSON_EXPORT_FOOTER)
+        from .linker import LinkerError
+        from .linker import link_build_manifest
+
+        build_manifest_path = (
+            build_manifest_path or spec['build_manifest_path'])
+        logger.info(
+            "building '%s' with the Python linker", build_manifest_path)
+        try:
+            modnames = link_build_manifest(
+                build_manifest_path, spec.get(EXTRACT_ENGINE) or 'scan')
+        except LinkerError as e:
+            if not spec[self.rjs_bin_key]:
+                logger.error('%s; r.js is not available', e)
+                return 1
+            logger.warning('%s; r.js will be invoked instead', e)
+            return None
+        spec.setdefault(LINK_DEFINES, {})[build_manifest_path] = modnames
+        return 0
 
     def link(self, spec):
         """
         Basically link everything up as a bundle, as if statically
         linking everything into "binary" file.
+
+        For incremental builds, this is skipped if none of the inputs
+        had changed since the previous build.
+
+        If DEFINES_MANIFEST is set in the spec, the manifest of the
+        module names defined in the export target is written next to it,
+        such that the test runner will not need to parse the artifact;
+        see write_defines_manifest.
+
+        If the assemble step split out the BUNDLES, r.js is invoked for
+        the export target and then for every bundle.
+
+        If PYTHON_LINKER is set in the spec, the Linker is used in place
+        of r.js wherever it can be.
         """
 
-        args = (spec[self.rjs_bin_key], '-o', spec['build_manifest_path'])
-        logger.info('invoking %s %s %s', *args)
-        rc = call(args)
+        bundle_targets = spec.get(BUNDLE_TARGETS, {})
+        build_manifest_paths = [spec['build_manifest_path']] + [
+            bundle_path(spec['build_manifest_path'], name)
+            for name in sorted(bundle_targets)
+        ]
+
+        state = spec.get(BUILD_STATE)
+        if state:
+            # the inputs are the manifests and every file that was
+            # produced into or read for the build directory.
+            sources = build_manifest_paths + state.touched_paths()
+            targets = [spec[EXPORT_TARGET]] + [
+                bundle_targets[name] for name in sorted(bundle_targets)]
+            extra = [spec[self.rjs_bin_key]]
+            if spec.get(PYTHON_LINKER):
+                extra.append(PYTHON_LINKER)
+            key = 'link:' + spec[EXPORT_TARGET]
+            if state.is_current(key, sources, targets, extra=extra):
+                logger.info(
+                    "skipping link as the inputs for '%s' are unchanged",
+                    spec[EXPORT_TARGET],
+                )
+                spec[LINK_DEFINES] = state.result(key) or {}
+                state.prune()
+                state.save()
+                self.write_defines_manifest(spec)
+                return
+
+        with trace_span(spec.get(BUILD_TRACE), 'rjs') as trace_args:
+            for build_manifest_path in build_manifest_paths:
+                rc = None
+                if spec.get(PYTHON_LINKER):
+                    rc = self.link_with_linker(spec, build_manifest_path)
+                if rc is None and spec.get(RJS_WORKER):
+                    rc = self.link_with_worker(spec, build_manifest_path)
+                if rc is None:
+                    rc = self.link_with_rjs(spec, build_manifest_path)
+                if rc != 0:
+                    break
+            if EXPORT_TARGET in spec:
+                trace_args['bytes'] = sum(file_size(path) for path in (
+                    [spec[EXPORT_TARGET]] + list(bundle_targets.values())))
         if rc != 0:
             logger.error(
                 "the spec may have contained insufficient information "
                 "required for r.js to locate all dependencies it needs for "
                 "the final build process."
             )
-            raise RJSExitError(rc, spec[self.rjs_bin_key])
+            raise RJSExitError(rc, spec[self.rjs_bin_key] or self.binary)
+
+        if state:
+            state.update(
+                key, sources, targets, extra=extra,
+                result=spec.get(LINK_DEFINES, {}),
+            )
+            state.prune()
+            state.save()
+        self.write_defines_manifest(spec)
+
+    def finalize(self, spec):
+        """
+        If HASHED_ARTIFACTS is set in the spec, write the content hashed
+        copies of the export target and the bundles.
+        """
+
+        if spec.get(HASHED_ARTIFACTS) and EXPORT_TARGET in spec:
+            with trace_span(spec.get(BUILD_TRACE), 'hashed_artifacts'):
+                self.write_hashed_artifacts(spec)
+
+    def write_hashed_artifacts(self, spec):
+        """
+        Write the content hashed copies of the export target and the
+        bundles along with their compressed siblings, and the manifest
+        of them to the path specified as HASHED_ARTIFACTS in the spec,
+        or next to the export target if True.  The paths to the bundles
+        in the requirejs config generated by assemble are rewritten to
+        the copies, and it is written out again.
+        """
+
+        from .artifact import ARTIFACT_MANIFEST_SUFFIX
+        from .artifact import write_hashed_artifacts
+
+        manifest_path = spec[HASHED_ARTIFACTS]
+        if manifest_path is True:
+            manifest_path = spec[EXPORT_TARGET] + ARTIFACT_MANIFEST_SUFFIX
+        bundle_targets = spec.get(BUNDLE_TARGETS, {})
+        hashed = write_hashed_artifacts([spec[EXPORT_TARGET]] + [
+            bundle_targets[name] for name in sorted(bundle_targets)
+        ], manifest_path)
+
+        if not bundle_targets:
+            return
+        roots = {
+            splitext(path)[0]: splitext(target)[0]
+            for path, target in hashed.items()
+        }
+        requirejs_config = dict(spec[REQUIREJS_CONFIG])
+        requirejs_config['paths'] = {
+            key: roots.get(value, value)
+            for key, value in requirejs_config['paths'].items()
+        }
+        write_config_js(spec['requirejs_config_js'], requirejs_config)
+
+    def write_defines_manifest(self, spec):
+        """
+        If DEFINES_MANIFEST is set in the spec, write the manifest of
+        the module names defined in the export target next to it, and
+        likewise for every bundle split out of it.
+
+        Those are the module names included by the build manifest less
+        the ones mapped to empty: there, plus the ones reported as
+        written by the link step, e.g. the modules within the bundled
+        directories that were pulled in as they are required.  As the
+        manifest would be incomplete without the latter, it is not
+        written for the outputs that the link step reported nothing
+        for, such that the artifacts will be parsed instead.
+        """
+
+        if not (spec.get(DEFINES_MANIFEST) and EXPORT_TARGET in spec):
+            return
+
+        bundle_targets = spec.get(BUNDLE_TARGETS, {})
+        outputs = [(spec['build_manifest_path'], spec[EXPORT_TARGET])] + [
+            (bundle_path(spec['build_manifest_path'], name),
+                bundle_targets[name])
+            for name in sorted(bundle_targets)
+        ]
+        link_defines = spec.get(LINK_DEFINES, {})
+        for build_manifest_path, target in outputs:
+            if not link_defines.get(build_manifest_path):
+                logger.warning(
+                    "no module names were reported for '%s' by the link; "
+                    "not writing its defines manifest", target)
+                continue
+            build_config = load_build_config(build_manifest_path)
+            paths = build_config.get('paths', {})
+            names = [
+                modname for modname in build_config.get('include', [])
+                if paths.get(modname) != EMPTY
+            ]
+            seen = set(names)
+            for modname in link_defines.get(build_manifest_path, []):
+                if modname not in seen:
+                    seen.add(modname)
+                    names.append(modname)
+            write_defines_manifest(target, names)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Tracing of the time spent in the steps of a build.
+
+A BuildTrace records the spans of time taken by the phases of a build
+and by the work done for every module within them, along with the byte
+counts involved, and can write them out as a Chrome trace event file
+(viewable through chrome://tracing or Perfetto).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from os.path import getsize
+
+logger = logging.getLogger(__name__)
+
+# the category of the events for the individual modules.
+MODULE = 'module'
+PHASE = 'phase'
+
+default_timer = getattr(time, 'perf_counter', time.time)
+
+
+def file_size(path):
+    """
+    Return the size of path, or 0 if it is not a file.
+    """
+
+    try:
+        return getsize(path)
+    except (OSError, IOError):
+        return 0
+
+
+class BuildTrace(object):
+    """
+    The recorded spans of a build.
+    """
+
+    def __init__(self, timer=default_timer):
+        self.timer = timer
+        self.origin = timer()
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+        # the spans started through begin that are not yet ended.
+        self.pending = {}
+
+    def add(self, name, cat, start, end, args=None):
+        """
+        Add a span for name in category cat, with the start and end
+        times as produced by the timer.
+        """
+
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': self.pid,
+            'tid': threading.current_thread().ident,
+            'args': args or {},
+        }
+        with self.lock:
+            self.events.append(event)
+        return event
+
+    @contextmanager
+    def span(self, name, cat=PHASE, **args):
+        """
+        Record the duration of the block as a span; the args dict is
+        produced such that further values may be added to it.
+        """
+
+        start = self.timer()
+        try:
+            yield args
+        finally:
+            self.add(name, cat, start, self.timer(), args)
+
+    def begin(self, name, cat=PHASE):
+        self.pending[name] = (cat, self.timer())
+
+    def end(self, name, **args):
+        """
+        End the span started through begin for name; has no effect if
+        none was started.
+        """
+
+        if name not in self.pending:
+            return None
+        cat, start = self.pending.pop(name)
+        return self.add(name, cat, start, self.timer(), args)
+
+    def end_pending(self):
+        """
+        End all the spans that were not ended, such as those for the
+        phases where the build failed.
+        """
+
+        for name in list(self.pending):
+            self.end(name, incomplete=True)
+
+    def slowest(self, n=10, cat=MODULE):
+        """
+        Return the n events in the category with the longest durations.
+        """
+
+        return sorted(
+            (event for event in self.events if event['cat'] == cat),
+            key=lambda event: event['dur'], reverse=True,
+        )[:n]
+
+    def summary(self, n=10):
+        """
+        Return the lines of the summary of the phases and the slowest n
+        modules.
+        """
+
+        lines = ['phases:']
+        lines.extend(
+            '  %10.1f ms  %s' % (event['dur'] / 1e3, event['name'])
+            for event in sorted(self.events, key=lambda e: e['ts'])
+            if event['cat'] == PHASE
+        )
+        lines.append('slowest modules:')
+        lines.extend(
+            '  %10.1f ms  %-10s %s (%d bytes)' % (
+                event['dur'] / 1e3, event['args'].get('phase', ''),
+                event['name'], event['args'].get('source_bytes', 0),
+            ) for event in self.slowest(n)
+        )
+        return lines
+
+    def to_chrome_trace(self, n=10):
+        """
+        Return the Chrome trace event JSON object, with the slowest n
+        modules included as the metadata.
+        """
+
+        return {
+            'traceEvents': sorted(self.events, key=lambda e: e['ts']),
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'slowest_modules': [
+                    [event['name'], event['args'].get('phase'),
+                        event['dur'] / 1e3]
+                    for event in self.slowest(n)
+                ],
+            },
+        }
+
+    def dump(self, path, n=10):
+        with open(path, 'w') as fd:
+            json.dump(self.to_chrome_trace(n), fd, indent=1, sort_keys=True)
+
+
+@contextmanager
+def trace_span(trace, name, cat=PHASE, **args):
+    """
+    Record the block as a span in the trace, unless that is None; the
+    args dict is produced regardless.
+    """
+
+    if trace is None:
+        yield args
+        return
+    with trace.span(name, cat, **args) as args:
+        yield args
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+Watching the sources of a spec for changes, to rebuild as they happen.
+
+The sources are watched through inotify where that is available (i.e.
+on Linux), with a fallback to polling their modification times.  The
+rebuilds are done through the incremental mode of the RJSToolchain, so
+that only the steps affected by the changed sources are redone.
+"""
+
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from os.path import basename
+from os.path import dirname
+from os.path import isdir
+from os.path import join
+
+from calmjs.toolchain import Spec
+
+from .dist import EMPTY
+from .state import file_stamp
+from .state import walk_files
+from .toolchain import INCREMENTAL
+from .toolchain import REQUIREJS_PLUGINS
+
+logger = logging.getLogger(__name__)
+
+# the number of seconds without further changes before a rebuild.
+DEFAULT_DEBOUNCE = 0.2
+DEFAULT_POLL_INTERVAL = 0.5
+
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+_IN_MASK = (
+    0x00000002 |  # IN_MODIFY
+    0x00000004 |  # IN_ATTRIB
+    0x00000008 |  # IN_CLOSE_WRITE
+    0x00000040 |  # IN_MOVED_FROM
+    0x00000080 |  # IN_MOVED_TO
+    0x00000100 |  # IN_CREATE
+    0x00000200    # IN_DELETE
+)
+_IN_CREATE = 0x00000100
+_IN_MOVED_TO = 0x00000080
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def spec_source_paths(spec):
+    """
+    Return a sorted list of the sources (files or directories) from the
+    source maps of the spec.
+    """
+
+    source_maps = [
+        spec.get('transpile_source_map', {}),
+        spec.get('bundle_source_map', {}),
+    ]
+    source_maps.extend(spec.get(REQUIREJS_PLUGINS, {}).values())
+    return sorted(set(
+        source for source_map in source_maps
+        for source in source_map.values() if source != EMPTY
+    ))
+
+
+class PollingWatcher(object):
+    """
+    Watch the paths by periodically checking the modification time and
+    size of the files.
+    """
+
+    def __init__(self, paths, interval=DEFAULT_POLL_INTERVAL):
+        self.paths = list(paths)
+        self.interval = interval
+        self.stamps = self._stamps()
+
+    def _stamps(self):
+        return {
+            path: [file_stamp(p) for p in walk_files(path)]
+            if isdir(path) else file_stamp(path)
+            for path in self.paths
+        }
+
+    def poll(self):
+        """
+        Return the set of paths that changed since the previous poll.
+        """
+
+        stamps = self._stamps()
+        changed = {
+            path for path in self.paths
+            if stamps[path] != self.stamps[path]
+        }
+        self.stamps = stamps
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Wait until some paths have changed, returning the set of them,
+        or an empty set if the timeout in seconds was reached.
+        """
+
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            changed = self.poll()
+            if changed:
+                return changed
+            remaining = self.interval if end is None else min(
+                self.interval, end - time.time())
+            if remaining <= 0:
+                return changed
+            time.sleep(remaining)
+
+    def close(self):
+        pass
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    # imported here as this is only needed for the --watch flag.
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):  # pragma: no cover
+        return None
+    return libc
+
+
+def _errno_error(*a):
+    import ctypes
+    err = ctypes.get_errno()
+    return OSError(err, os.strerror(err), *a)
+
+
+class InotifyWatcher(object):
+    """
+    Watch the paths through inotify.  The directories containing the
+    files are watched rather than the files themselves, such that the
+    files being replaced (as done by many editors) are also picked up.
+    """
+
+    def __init__(self, paths, libc=None):
+        self.libc = libc or _load_libc()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.paths = list(paths)
+        self.fd = self.libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise _errno_error()
+        # the watch descriptors to the directories
+        self.dirs = {}
+        # the files and the directories being watched, with the values
+        # being the path reported as changed.
+        self.files = {}
+        self.trees = {}
+        try:
+            for path in self.paths:
+                if isdir(path):
+                    self._add_tree(path, path)
+                else:
+                    self._add_watch(dirname(path))
+                    self.files[path] = path
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, path):
+        if path in self.dirs.values():
+            return
+        wd = self.libc.inotify_add_watch(
+            self.fd, path.encode(sys.getfilesystemencoding()), _IN_MASK)
+        if wd < 0:
+            raise _errno_error(path)
+        self.dirs[wd] = path
+
+    def _add_tree(self, path, tree):
+        """
+        Watch the directory at path and all directories inside it, for
+        reporting the changes in them as changes to tree.
+        """
+
+        for root, dirs, files in os.walk(path):
+            self._add_watch(root)
+            self.trees[root] = tree
+
+    def _read(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:  # pragma: no cover
+            if e.errno == errno.EAGAIN:
+                return changed
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(
+                sys.getfilesystemencoding())
+            offset += length
+            root = self.dirs.get(wd)
+            if root is None:
+                continue
+            if mask & _IN_IGNORED:
+                # the directory was removed.
+                del self.dirs[wd]
+                self.trees.pop(root, None)
+                continue
+            path = join(root, name)
+            if root in self.trees:
+                changed.add(self.trees[root])
+                if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # watch the directory created inside the tree; the
+                    # files that may have been created in there before
+                    # the watch was added are covered by this event.
+                    try:
+                        self._add_tree(path, self.trees[root])
+                    except OSError as e:
+                        logger.debug(
+                            "failed to watch new directory '%s': %s",
+                            path, e)
+            if path in self.files:
+                changed.add(self.files[path])
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Wait until some paths have changed, returning the set of them,
+        or an empty set if the timeout in seconds was reached.
+        """
+
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if end is None else max(end - time.time(), 0)
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                return set()
+            changed = self._read()
+            if changed:
+                return changed
+
+    def close(self):
+        if self.fd is not None and self.fd >= 0:
+            os.close(self.fd)
+        self.fd = None
+
+
+def get_watcher(paths):
+    """
+    Return an InotifyWatcher for the paths if available, otherwise a
+    PollingWatcher.
+    """
+
+    try:
+        return InotifyWatcher(paths)
+    except OSError as e:
+        logger.debug(
+            'inotify unavailable (%s); falling back to polling', e)
+        return PollingWatcher(paths)
+
+
+class SpecWatcher(object):
+    """
+    Build a spec produced by spec_factory with the toolchain, then keep
+    rebuilding with a new spec from the factory every time the sources
+    referenced by the spec change.
+
+    The factory is expected to produce each new spec from the same
+    source maps, such that the expensive resolution of those will only
+    need to be done once.
+    """
+
+    def __init__(
+            self, toolchain, spec_factory, debounce=DEFAULT_DEBOUNCE,
+            watcher_factory=get_watcher):
+        self.toolchain = toolchain
+        self.spec_factory = spec_factory
+        self.debounce = debounce
+        self.watcher_factory = watcher_factory
+
+    def build(self):
+        spec = self.spec_factory()
+        try:
+            self.toolchain(spec)
+        except Exception as e:
+            # keep on watching, as the next change may fix the problem.
+            logger.error('build failed: %s: %s', type(e).__name__, e)
+        return spec
+
+    def wait(self, watcher):
+        """
+        Wait for changes, and then until no further changes happen for
+        the debounce period; return the set of paths changed.
+        """
+
+        changed = watcher.wait()
+        while changed:
+            more = watcher.wait(self.debounce)
+            if not more:
+                break
+            changed |= more
+        return changed
+
+    def run(self, rebuilds=None):
+        """
+        Do the initial build and then watch for changes until
+        interrupted, or until the number of rebuilds are done.  Returns
+        the spec of the final build.
+        """
+
+        spec = self.build()
+        paths = spec_source_paths(spec)
+        watcher = self.watcher_factory(paths)
+        logger.info(
+            'watching %d source(s) for changes using %s',
+            len(paths), type(watcher).__name__,
+        )
+        count = 0
+        try:
+            while rebuilds is None or count < rebuilds:
+                changed = self.wait(watcher)
+                if not changed:
+                    continue
+                logger.info('rebuilding due to changes in: %s', ', '.join(
+                    sorted(basename(path) for path in changed)))
+                spec = self.build()
+                count += 1
+        except KeyboardInterrupt:
+            logger.info('stopped watching for changes')
+        finally:
+            watcher.close()
+        return spec
+
+
+def spec_factory_from(spec, prepare=None):
+    """
+    Return a factory that first returns the provided spec, followed by
+    new specs that are shallow copies of its items before the build,
+    with the incremental build flag set.  Advices are not copied, so the
+    optional prepare function will be invoked with the new specs for
+    their setup.
+    """
+
+    items = dict(spec)
+    specs = [spec]
+
+    def factory():
+        if specs:
+            return specs.pop()
+        new_spec = Spec(**items)
+        new_spec[INCREMENTAL] = True
+        if prepare:
+            prepare(new_spec)
+        return new_spec
+
+    return factory
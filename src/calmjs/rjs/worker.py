@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+A persistent Node.js worker process for running r.js builds.
+
+Invoking the r.js binary for every build means paying for the startup
+of Node.js and the loading of r.js every time.  The worker provided here
+loads r.js once as a module, and then accepts successive build configs
+through a simple line based JSON protocol over its stdin and stdout.
+Each request is a JSON object with an ``id`` and the ``config``, and
+each response is a JSON object with the same ``id``, with ``ok`` set to
+true along with the ``output`` of r.js, or false along with the
+``error``.  Anything else written to stdout by r.js is redirected to
+stderr.
+"""
+
+from __future__ import unicode_literals
+
+import json
+import logging
+import threading
+from os.path import join
+from os.path import normpath
+from os.path import relpath
+from os.path import sep
+from subprocess import PIPE
+from subprocess import Popen
+
+from .exc import RJSRuntimeError
+
+logger = logging.getLogger(__name__)
+
+RJS_WORKER_JS = """\
+(function() {
+    'use strict';
+
+    var readline = require('readline');
+    var write = process.stdout.write.bind(process.stdout);
+    var queue = [];
+    var busy = false;
+    var requirejs;
+
+    function respond(message) {
+        write(JSON.stringify(message) + '\\n');
+    }
+
+    function message(e) {
+        return String(e && e.message || e);
+    }
+
+    function next() {
+        if (busy || !queue.length) {
+            return;
+        }
+        busy = true;
+        var request = queue.shift();
+        var done = function(response) {
+            response.id = request.id;
+            respond(response);
+            busy = false;
+            next();
+        };
+        try {
+            requirejs.optimize(request.config, function(output) {
+                done({'ok': true, 'output': String(output)});
+            }, function(e) {
+                done({'ok': false, 'error': message(e)});
+            });
+        }
+        catch (e) {
+            done({'ok': false, 'error': message(e)});
+        }
+    }
+
+    // keep the protocol intact from the logging done by r.js.
+    process.stdout.write = process.stderr.write.bind(process.stderr);
+    try {
+        requirejs = require(process.argv[process.argv.length - 1]);
+    }
+    catch (e) {
+        respond({'id': 0, 'ok': false, 'error': message(e)});
+        process.exitCode = 1;
+        return;
+    }
+
+    readline.createInterface({'input': process.stdin}).on('line', function(
+            line) {
+        if (line.trim()) {
+            queue.push(JSON.parse(line));
+            next();
+        }
+    });
+    respond({'id': 0, 'ok': true, 'output': 'ready'});
+}());
+"""
+
+
+class RJSWorkerError(RJSRuntimeError):
+    """the r.js worker process failed"""
+
+
+def load_build_config(path):
+    """
+    Load the build config from the build manifest written by the
+    RJSToolchain, which is JSON wrapped in parentheses.
+    """
+
+    with open(path) as fd:
+        text = fd.read().strip()
+    if text.startswith('(') and text.endswith(')'):
+        text = text[1:-1]
+    return json.loads(text)
+
+
+def resolve_build_config(config, base_dir):
+    """
+    Return a copy of the build config with the baseUrl and the other
+    paths in there resolved against base_dir, as r.js does for the
+    paths in a build file against its directory; the worker does the
+    build through requirejs.optimize, which would resolve them against
+    its own working directory instead.
+
+    Arguments:
+
+    config
+        The build config, as loaded by load_build_config.
+    base_dir
+        The directory of the build manifest.
+    """
+
+    config = dict(config)
+    config['baseUrl'] = normpath(join(base_dir, config.get('baseUrl', '')))
+    for key in ('out', 'dir', 'mainConfigFile'):
+        if config.get(key):
+            config[key] = normpath(join(base_dir, config[key]))
+    return config
+
+
+def build_output_modnames(output, config):
+    """
+    Return the list of the module names that r.js reported as written
+    to the output in the output of its build, which lists the paths to
+    the files of the modules (or the names of the loader plugin
+    resources) that went into it after the line of dashes.  The paths
+    are mapped back to the module names through the paths and the
+    baseUrl in the build config; the ones that cannot be are left out.
+
+    Arguments:
+
+    output
+        The output of the build, as produced by r.js.
+    config
+        The build config, as resolved by resolve_build_config.
+    """
+
+    base_url = config.get('baseUrl', '')
+    roots = {}
+    for modname, target in config.get('paths', {}).items():
+        if target == 'empty:':
+            continue
+        if target.endswith('?'):
+            target = target[:-1]
+        if target.endswith('.js'):
+            target = target[:-3]
+        roots[normpath(join(base_url, target))] = modname
+
+    results = []
+    lines = output.splitlines()
+    if '-' * 16 in lines:
+        lines = lines[lines.index('-' * 16) + 1:]
+    for line in (line.strip() for line in lines):
+        if not line:
+            continue
+        if '!' in line:
+            results.append(line)
+            continue
+        path = normpath(line[:-3] if line.endswith('.js') else line)
+        rest = []
+        head = path
+        while head not in roots:
+            parent, tail = head.rsplit(sep, 1) if sep in head else ('', head)
+            if not parent or parent == head:
+                break
+            rest.insert(0, tail)
+            head = parent
+        if head in roots:
+            results.append('/'.join([roots[head]] + rest))
+            continue
+        if base_url and path.startswith(base_url.rstrip(sep) + sep):
+            results.append('/'.join(relpath(path, base_url).split(sep)))
+    return results
+
+
+class RJSWorker(object):
+    """
+    A Node.js process with r.js loaded, for doing successive builds.
+    """
+
+    def __init__(self, rjs_bin, node_bin='node', **popen_kw):
+        """
+        Arguments:
+
+        rjs_bin
+            The path to r.js, which will be loaded as a module.
+        node_bin
+            The Node.js binary.
+        popen_kw
+            Other keyword arguments for the Popen of the process, such
+            as the env and cwd.
+        """
+
+        self.rjs_bin = rjs_bin
+        self.node_bin = node_bin
+        self.popen_kw = popen_kw
+        self.process = None
+        self.lock = threading.Lock()
+        self._id = 0
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _receive(self, request_id):
+        line = self.process.stdout.readline()
+        if not line:
+            self.close()
+            raise RJSWorkerError('r.js worker process terminated')
+        try:
+            response = json.loads(line)
+        except ValueError:
+            self.close()
+            raise RJSWorkerError(
+                'r.js worker produced invalid response: %r' % line)
+        if response.get('id') != request_id:
+            self.close()
+            raise RJSWorkerError(
+                'r.js worker produced response to the wrong request')
+        return response
+
+    def start(self):
+        """
+        Start the worker process and wait for r.js to be loaded.
+        """
+
+        try:
+            self.process = Popen(
+                [self.node_bin, '-e', RJS_WORKER_JS, self.rjs_bin],
+                stdin=PIPE, stdout=PIPE, universal_newlines=True,
+                **self.popen_kw
+            )
+        except (OSError, IOError) as e:
+            raise RJSWorkerError(
+                'failed to start r.js worker: %s: %s' % (type(e).__name__, e))
+
+        response = self._receive(0)
+        if not response['ok']:
+            self.close()
+            raise RJSWorkerError(
+                "failed to load '%s' in r.js worker: %s" % (
+                    self.rjs_bin, response['error']))
+        logger.debug("started r.js worker with '%s'", self.rjs_bin)
+
+    def build(self, config):
+        """
+        Build with the provided r.js config, returning the response with
+        the ok flag, and the output or the error.  Raises RJSWorkerError
+        if the worker process failed, as opposed to the build itself.
+        """
+
+        with self.lock:
+            if not self.alive:
+                raise RJSWorkerError('r.js worker process is not running')
+            self._id += 1
+            try:
+                self.process.stdin.write(json.dumps(
+                    {'id': self._id, 'config': config}) + '\n')
+                self.process.stdin.flush()
+            except (OSError, IOError) as e:
+                self.close()
+                raise RJSWorkerError(
+                    'failed to send request to r.js worker: %s: %s' % (
+                        type(e).__name__, e))
+            return self._receive(self._id)
+
+    def close(self):
+        """
+        Stop the worker process.
+        """
+
+        process, self.process = self.process, None
+        if process is None:
+            return
+        for stream in (process.stdin, process.stdout):
+            try:
+                stream.close()
+            except (OSError, IOError):  # pragma: no cover
+                pass
+        # the worker will exit once its stdin is closed.
+        process.wait()